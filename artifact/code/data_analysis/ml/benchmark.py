@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""Benchmarks the training and evaluation pipeline on a synthetic corpus.
+
+`benchmark.py run` generates a corpus with synth_corpus.py (or reads an
+existing results directory) and times the stages of train_model.py and
+model_eval.py in one process:
+
+* ingest: reading the customized-mutants.csv files (model_eval.read_cm_df);
+* featurize: fitting the mapper and building the sparse design matrix;
+* fit: fitting one model per held-out class, for the first --folds classes;
+* predict_metrics: predicting the held-out classes and computing their
+  metrics (model_eval.create_predictions).
+
+Each stage records its wall time, CPU time, and peak RSS above the RSS at
+its start (sampled every few milliseconds), for each of --repeat runs. The
+results are written as JSON together with the git commit, parameters, and
+library versions, and `benchmark.py compare` prints the median change of each
+stage between two result files.
+
+Run `benchmark.py --help` for more information.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import scipy
+import sklearn
+from scipy import sparse
+
+import features
+import instrument
+import model_eval
+import models
+import synth_corpus
+
+RESULT_VERSION = 1
+
+STAGES = ["ingest", "featurize", "fit", "predict_metrics"]
+
+arg_parser = argparse.ArgumentParser(description="Benchmark the ML pipeline.")
+subparsers = arg_parser.add_subparsers(dest="command", required=True)
+run_parser = subparsers.add_parser("run", help="Run the benchmark.")
+run_parser.add_argument("out_json", type=pathlib.Path)
+run_parser.add_argument(
+    "--results_dir",
+    type=pathlib.Path,
+    default=None,
+    help="Read customized-mutants.csv files here instead of a synthetic corpus.",
+)
+run_parser.add_argument("--projects", type=int, default=4)
+run_parser.add_argument("--classes", type=int, default=20, help="Classes per project")
+run_parser.add_argument("--mutants", type=int, default=100, help="Mutants per class")
+run_parser.add_argument("--seed", type=int, default=0)
+run_parser.add_argument("--data", choices=features.DATA_CHOICES, default="all")
+run_parser.add_argument("--model", choices=models.MODEL_CHOICES, default="linear")
+run_parser.add_argument(
+    "--folds", type=int, default=8, help="The number of held-out classes to fit."
+)
+run_parser.add_argument("--repeat", type=int, default=3)
+compare_parser = subparsers.add_parser(
+    "compare", help="Compare the results of two benchmark runs."
+)
+compare_parser.add_argument("base_json", type=pathlib.Path)
+compare_parser.add_argument("new_json", type=pathlib.Path)
+
+
+def measure(fn: Callable[[], Any]) -> Tuple[Any, Dict[str, float]]:
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    with instrument.RssSampler() as sampler:
+        result = fn()
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+    peak_rss_mb = sampler.peak_bytes / 2**20
+    return result, {"wall_s": wall, "cpu_s": cpu, "peak_rss_mb": peak_rss_mb}
+
+
+def _fit_fold(X_all, y_all, train, model_name):
+    model = models.build_model(model_name)
+    model.fit(X_all[train], y_all[train])
+    return model
+
+
+def run_once(results_dir: pathlib.Path, args) -> Tuple[Dict[str, Dict], List[Dict]]:
+    stats = {}
+    cm_df, stats["ingest"] = measure(lambda: model_eval.read_cm_df(results_dir))
+
+    mapper = features.build_mapper(args.data)
+
+    def featurize():
+        X = mapper.fit_transform(cm_df.copy()).astype(np.float32)
+        return sparse.csc_matrix(X)
+
+    X_all, stats["featurize"] = measure(featurize)
+    y_all = cm_df.pKillsDom.values.copy()
+
+    # Leave-one-class-out folds, as in train_model.py (without --project_only).
+    held_out = cm_df[["projectId", "bugId", "className"]].drop_duplicates()
+    held_out = held_out.iloc[: args.folds]
+    folds, results = [], []
+
+    def fit_all():
+        for proj, bug_id, class_name in held_out.itertuples(index=False):
+            train = (cm_df.className != class_name).values
+            model, fold_stats = measure(
+                lambda: _fit_fold(X_all, y_all, train, args.model)
+            )
+            folds.append({"class": class_name, "rows": int(train.sum()), **fold_stats})
+            results.append(((proj, bug_id, {"class": class_name}), model))
+
+    _, stats["fit"] = measure(fit_all)
+    _, stats["predict_metrics"] = measure(
+        lambda: model_eval.create_predictions(cm_df, mapper, results)
+    )
+    stats["featurize"]["shape"] = list(X_all.shape)
+    stats["featurize"]["nnz"] = int(X_all.nnz)
+    return stats, folds
+
+
+def _git_commit() -> Dict[str, Any]:
+    here = pathlib.Path(__file__).resolve().parent
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=here,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            cwd=here,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "dirty": None}
+    return {"commit": commit, "dirty": bool(dirty)}
+
+
+def run(args) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as tmp:
+        results_dir = args.results_dir
+        if results_dir is None:
+            results_dir = pathlib.Path(tmp)
+            corpus = synth_corpus.generate(
+                args.projects, args.classes, args.mutants, args.seed
+            )
+            synth_corpus.write_corpus(corpus, results_dir)
+        runs = [run_once(results_dir, args) for _ in range(args.repeat)]
+
+    stages = {}
+    for stage in STAGES:
+        stages[stage] = {
+            key: [stats[stage][key] for stats, _ in runs]
+            for key in ("wall_s", "cpu_s", "peak_rss_mb")
+        }
+    stages["featurize"]["shape"] = runs[0][0]["featurize"]["shape"]
+    stages["featurize"]["nnz"] = runs[0][0]["featurize"]["nnz"]
+    return {
+        "version": RESULT_VERSION,
+        **_git_commit(),
+        "params": {
+            k: str(v) if isinstance(v, pathlib.Path) else v
+            for k, v in vars(args).items()
+            if k not in ("command", "out_json")
+        },
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "scipy": scipy.__version__,
+            "sklearn": sklearn.__version__,
+            "cpus": os.cpu_count(),
+            "machine": platform.machine(),
+        },
+        "stages": stages,
+        "folds": runs[-1][1],
+    }
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any]) -> pd.DataFrame:
+    """Median wall time and peak RSS of each stage, with new/base ratios."""
+    rows = []
+    for stage in STAGES:
+        b, n = base["stages"][stage], new["stages"][stage]
+        row = {"stage": stage}
+        for key in ("wall_s", "peak_rss_mb"):
+            row[f"base_{key}"] = float(np.median(b[key]))
+            row[f"new_{key}"] = float(np.median(n[key]))
+            base_value, new_value = row[f"base_{key}"], row[f"new_{key}"]
+            row[f"{key}_ratio"] = new_value / base_value if base_value else np.nan
+        rows.append(row)
+    return pd.DataFrame(rows).set_index("stage")
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    if args.command == "compare":
+        base = json.loads(args.base_json.read_text())
+        new = json.loads(args.new_json.read_text())
+        if base["params"] != new["params"]:
+            print("Warning: the runs have different parameters", file=sys.stderr)
+        print(f"base: {base['commit']}  new: {new['commit']}")
+        with pd.option_context("display.width", 200, "display.max_columns", None):
+            print(compare(base, new).round(3))
+        return 0
+
+    result = run(args)
+    args.out_json.write_text(json.dumps(result, indent=2))
+    for stage in STAGES:
+        s = result["stages"][stage]
+        print(
+            f"{stage:>16}: {np.median(s['wall_s']):8.3f}s wall "
+            f"{np.median(s['cpu_s']):8.3f}s cpu {np.median(s['peak_rss_mb']):8.1f} MiB"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
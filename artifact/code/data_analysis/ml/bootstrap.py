@@ -0,0 +1,107 @@
+"""Bootstrap confidence intervals for per-project median correlations.
+
+`model_eval.py` summarizes each model by the per-project median of its
+per-class Spearman correlations. This module attaches percentile bootstrap
+confidence intervals to those medians, resampling classes within each
+(model, project) group.
+
+All groups are resampled together: the resample indices of a batch of
+bootstrap replicates form one integer matrix with a column per class. As each
+group's values are pre-sorted and occupy a contiguous index range, one row-wise
+sort of that matrix partitions every replicate into sorted group segments, from
+which all grouped medians are read off at fixed positions.
+"""
+
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+GROUP_LEVELS = ["modelType", "featuresUsed", "trainingSet", "projectId"]
+
+# Fixed seed, so CIs are reproducible across runs.
+DEFAULT_SEED = 42
+
+# Upper bound on the number of elements in one batch of resampled values.
+_BATCH_ELEMENTS = 1 << 23
+
+
+def grouped_median_cis(
+    values: np.ndarray,
+    group_sizes: Sequence[int],
+    n_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = DEFAULT_SEED,
+) -> np.ndarray:
+    """Returns (low, high) bootstrap CIs of the median of each group.
+
+    Args:
+        values: The observations, ordered by group, without NaNs.
+        group_sizes: The number of observations in each (contiguous) group.
+
+    Returns:
+        An array of shape (number of groups, 2).
+    """
+    group_sizes = np.asarray(group_sizes, dtype=np.int64)
+    if (group_sizes <= 0).any() or group_sizes.sum() != len(values):
+        raise ValueError("Group sizes must be positive and cover all values")
+    n = len(values)
+    offsets = np.concatenate([[0], np.cumsum(group_sizes)[:-1]])
+    group_of = np.repeat(np.arange(len(group_sizes)), group_sizes)
+
+    # Sort values within each group. A resample index then orders like the
+    # value it points to, and since groups occupy disjoint index ranges,
+    # sorting a row of indices sorts every group's segment independently.
+    sorted_values = values[np.lexsort((values, group_of))]
+
+    # Positions of the lower and upper middle elements of every group.
+    lo_pos = offsets + (group_sizes - 1) // 2
+    hi_pos = offsets + group_sizes // 2
+
+    index_dtype = np.int32 if n < np.iinfo(np.int32).max else np.int64
+    rng = np.random.default_rng(seed)
+    medians = np.empty((n_resamples, len(group_sizes)), dtype=np.float64)
+    batch = max(1, _BATCH_ELEMENTS // max(n, 1))
+    for start in range(0, n_resamples, batch):
+        stop = min(start + batch, n_resamples)
+        idx = rng.integers(
+            0, group_sizes[group_of], size=(stop - start, n), dtype=index_dtype
+        )
+        idx += offsets[group_of].astype(index_dtype)
+        # A full sort of small integers is faster here than np.partition with
+        # two kth positions per group.
+        idx.sort(axis=1)
+        lo = sorted_values[idx[:, lo_pos]]
+        hi = sorted_values[idx[:, hi_pos]]
+        medians[start:stop] = (lo + hi) / 2.0
+
+    alpha = (1.0 - confidence) / 2.0
+    return np.quantile(medians, [alpha, 1.0 - alpha], axis=0).T
+
+
+def median_spearman_cis(
+    all_eval_metrics: pd.DataFrame,
+    metric: str = "spearmans",
+    n_resamples: int = 10000,
+    confidence: float = 0.95,
+    seed: int = DEFAULT_SEED,
+) -> pd.DataFrame:
+    """Computes per-project medians of `metric` with bootstrap CIs.
+
+    `all_eval_metrics` is indexed like model_eval.py's `all_eval_metrics_df`.
+    Classes with an undefined metric are dropped, as in the median itself.
+    """
+    df = all_eval_metrics[metric].dropna().reset_index()
+    df = df.sort_values(GROUP_LEVELS, kind="stable")
+    grouped = df.groupby(GROUP_LEVELS, sort=False)[metric]
+    summary = grouped.agg(["median", "size"]).rename(columns={"size": "nClasses"})
+    cis = grouped_median_cis(
+        df[metric].values.astype(np.float64),
+        summary.nClasses.values,
+        n_resamples=n_resamples,
+        confidence=confidence,
+        seed=seed,
+    )
+    summary["ciLow"] = cis[:, 0]
+    summary["ciHigh"] = cis[:, 1]
+    return summary
@@ -0,0 +1,102 @@
+"""An on-disk cache of per-model evaluation results for model_eval.py.
+
+Entries hold the per-class metrics and per-mutant predictions produced by
+`model_eval.create_predictions` for one model file. An entry's key is a
+content hash of the model artifact (which includes the fitted mapper), of
+the covered-mutant data, and of `CACHE_VERSION`, so retraining one model or
+adding a subject only invalidates the affected entries.
+
+The cache is bounded in size: entries are files whose modification time is
+refreshed on every hit, and the least recently used entries are evicted
+once the total size exceeds the bound.
+"""
+
+import hashlib
+import os
+import pathlib
+import tempfile
+from typing import Any, Optional, Union
+
+import joblib
+import pandas as pd
+
+# Bump when create_predictions' outputs change, to invalidate old entries.
+CACHE_VERSION = 1
+
+_READ_BLOCK_SIZE = 1 << 20
+
+
+def file_digest(path: Union[str, pathlib.Path]) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as fo:
+        for block in iter(lambda: fo.read(_READ_BLOCK_SIZE), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """Hashes a DataFrame's column names, index, and values."""
+    h = hashlib.sha256()
+    h.update(repr(list(df.columns)).encode("utf8"))
+    h.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return h.hexdigest()
+
+
+def entry_key(model_digest: str, data_digest: str) -> str:
+    h = hashlib.sha256()
+    for part in (str(CACHE_VERSION), model_digest, data_digest):
+        h.update(part.encode("utf8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class EvalCache:
+    def __init__(self, root: Union[str, pathlib.Path], max_bytes: int):
+        self.root = pathlib.Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+
+    def _path(self, key: str) -> pathlib.Path:
+        return self.root / f"{key}.joblib"
+
+    def get(self, key: str) -> Optional[Any]:
+        path = self._path(key)
+        try:
+            with open(path, "rb") as fo:
+                value = joblib.load(fo)
+        except FileNotFoundError:
+            return None
+        # Mark as recently used.
+        os.utime(path)
+        return value
+
+    def put(self, key: str, value: Any) -> None:
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fo:
+                joblib.dump(value, fo)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self.evict()
+
+    def evict(self) -> None:
+        """Removes least recently used entries until the cache fits its bound."""
+        entries = []
+        for path in self.root.glob("*.joblib"):
+            try:
+                st = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            total -= size
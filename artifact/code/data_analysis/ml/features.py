@@ -0,0 +1,224 @@
+"""The feature sets used to train the mutant-selection models.
+
+`build_mapper` returns the (unfitted) `DataFrameMapper` for a `--data` choice
+of train_model.py, which turns covered rows of customized-mutants.csv into a
+feature matrix. The mapper is stored with the fold models, so model_eval.py
+and other consumers transform data exactly as the model was trained.
+`mapper_blocks` describes which columns of a fitted mapper's output each
+feature (block) occupies.
+
+`--data hashed` uses the features of `--data all`, but instead of one-hot
+encoding the categorical features (whose width grows with every new context
+value), it hashes their (feature, value) pairs, and optionally pairs of them,
+into a fixed number of sparse columns. It needs no vocabulary, so the same
+value always maps to the same column, whatever data the mapper was fitted on.
+"""
+
+from typing import List, NamedTuple, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+import sklearn_pandas
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.impute import SimpleImputer
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+from sklearn.utils import murmurhash3_32
+
+DATA_CHOICES = ["all", "small", "hashed"]
+
+# Default number of columns of the hashed categorical features.
+HASH_FEATURES = 2**16
+
+# Numeric features, by preprocessing.
+IMPUTED_FEATURES = ["lineRatio"]
+SCALED_FEATURES = ["nestingIf", "nestingLoop", "nestingTotal", "maxNestingInSameMethod"]
+UNSCALED_FEATURES = [
+    "nestingRatioLoop",
+    "nestingRatioIf",
+    "nestingRatioTotal",
+    "hasOperatorChild",
+    "hasVariableChild",
+    "hasLiteralChild",
+]
+
+# Categorical features; node types may be missing.
+NODE_TYPE_FEATURES = ["nodeTypeBasic", "nodeTypeDetailed"]
+CONTEXT_FEATURES = [
+    "mutationOperator",
+    "mutationOperatorGroup",
+    "nodeContextBasic",
+    "astContextBasic",
+    "astContextDetailed",
+    "astStmtContextBasic",
+    "astStmtContextDetailed",
+    "parentContextBasic",
+    "parentContextDetailed",
+    "parentStmtContextBasic",
+    "parentStmtContextDetailed",
+]
+
+# The features of --data small.
+SMALL_FEATURES = ["mutationOperator", "parentStmtContextDetailed"]
+
+
+class HashedCategoricals(BaseEstimator, TransformerMixin):
+    """Hashes categorical (feature, value) pairs into `n_features` columns.
+
+    For every column, a row gets a 1 in the column given by the hash of
+    "feature=value"; for every cross (a, b) of two columns, it also gets a 1
+    in the column given by the hash of "a=value_a&b=value_b". Pairs that hash
+    to the same column add up. Missing values are hashed as "Unknown", as the
+    one-hot mappers impute them. The transformer has no fitted state.
+    """
+
+    def __init__(
+        self,
+        columns: Sequence[str],
+        n_features: int = HASH_FEATURES,
+        crosses: Sequence[Tuple[str, str]] = (),
+    ):
+        self.columns = columns
+        self.n_features = n_features
+        self.crosses = crosses
+
+    def fit(self, X, y=None):
+        self.n_features_in_ = np.shape(X)[1]
+        return self
+
+    def _hashed(self, names: Sequence[str], values: pd.DataFrame) -> np.ndarray:
+        """Returns each row's column for the combination of `names` values."""
+        codes, uniques = pd.factorize(pd.MultiIndex.from_frame(values))
+        buckets = np.array(
+            [
+                murmurhash3_32(
+                    "&".join(f"{n}={v}" for n, v in zip(names, u)), positive=True
+                )
+                % self.n_features
+                for u in uniques
+            ],
+            dtype=np.int64,
+        )
+        return buckets[codes]
+
+    def transform(self, X) -> sparse.csr_matrix:
+        values = pd.DataFrame(np.asarray(X, dtype=object), columns=list(self.columns))
+        values = values.fillna("Unknown").astype(str)
+        groups = [[c] for c in self.columns] + [list(c) for c in self.crosses]
+        n_rows = len(values)
+        indices = np.empty((n_rows, len(groups)), dtype=np.int64)
+        for j, names in enumerate(groups):
+            indices[:, j] = self._hashed(names, values[names])
+        X = sparse.csr_matrix(
+            (
+                np.ones(indices.size, dtype=np.float64),
+                indices.ravel(),
+                np.arange(0, indices.size + 1, len(groups)),
+            ),
+            shape=(n_rows, self.n_features),
+        )
+        X.sum_duplicates()
+        return X
+
+
+def build_mapper(
+    data: str,
+    hash_features: int = HASH_FEATURES,
+    hash_crosses: Sequence[Tuple[str, str]] = (),
+) -> sklearn_pandas.DataFrameMapper:
+    """Returns the mapper of a --data choice.
+
+    `hash_features` and `hash_crosses` only apply to --data hashed.
+    """
+    if data == "small":
+        return sklearn_pandas.DataFrameMapper(
+            [(SMALL_FEATURES, OneHotEncoder(handle_unknown="ignore"))]
+        )
+    elif data == "all":
+        return sklearn_pandas.DataFrameMapper(
+            [
+                (IMPUTED_FEATURES, [SimpleImputer(strategy="mean"), StandardScaler()]),
+                (SCALED_FEATURES, StandardScaler()),
+                (UNSCALED_FEATURES, None),
+                (
+                    NODE_TYPE_FEATURES,
+                    [
+                        SimpleImputer(strategy="constant", fill_value="Unknown"),
+                        OneHotEncoder(handle_unknown="ignore"),
+                    ],
+                ),
+                (CONTEXT_FEATURES, OneHotEncoder(handle_unknown="ignore")),
+            ]
+        )
+    elif data == "hashed":
+        categorical = NODE_TYPE_FEATURES + CONTEXT_FEATURES
+        for a, b in hash_crosses:
+            if a not in categorical or b not in categorical:
+                raise ValueError(f"Unexpected cross: {a}, {b}")
+        return sklearn_pandas.DataFrameMapper(
+            [
+                (IMPUTED_FEATURES, [SimpleImputer(strategy="mean"), StandardScaler()]),
+                (SCALED_FEATURES, StandardScaler()),
+                (UNSCALED_FEATURES, None),
+                (
+                    categorical,
+                    HashedCategoricals(
+                        categorical, hash_features, [tuple(c) for c in hash_crosses]
+                    ),
+                ),
+            ],
+            sparse=True,
+        )
+    raise ValueError(f"Unexpected data arg: {data}")
+
+
+class FeatureBlock(NamedTuple):
+    name: str
+    start: int
+    stop: int
+    kind: str  # "onehot", "hashed" or "numeric"
+
+
+def mapper_blocks(mapper) -> List[FeatureBlock]:
+    """Returns the column blocks of a fitted DataFrameMapper's output.
+
+    Each one-hot encoded source column becomes its own block, and the hashed
+    categoricals a single block; every other mapper entry becomes a single
+    numeric block.
+    """
+    blocks = []
+    start = 0
+    for columns, transformer, *_ in mapper.built_features:
+        if isinstance(columns, str):
+            columns = [columns]
+        last = transformer
+        if hasattr(transformer, "steps"):
+            last = transformer.steps[-1][1]
+        if hasattr(last, "categories_"):
+            for column, categories in zip(columns, last.categories_):
+                blocks.append(
+                    FeatureBlock(column, start, start + len(categories), "onehot")
+                )
+                start += len(categories)
+        elif isinstance(last, HashedCategoricals):
+            stop = start + last.n_features
+            blocks.append(FeatureBlock("_".join(columns), start, stop, "hashed"))
+            start = stop
+        else:
+            width = len(columns) if last is None else last.n_features_in_
+            stop = start + width
+            blocks.append(FeatureBlock("_".join(columns), start, stop, "numeric"))
+            start = stop
+    return blocks
+
+
+def categorical_columns(mapper) -> np.ndarray:
+    """Returns the one-hot and hashed columns of a fitted mapper's output."""
+    return np.concatenate(
+        [
+            np.arange(b.start, b.stop)
+            for b in mapper_blocks(mapper)
+            if b.kind in ("onehot", "hashed")
+        ]
+        + [np.empty(0, dtype=np.int64)]
+    )
@@ -0,0 +1,146 @@
+"""Runs per-fold model fits in parallel under a memory budget.
+
+A fixed number of joblib workers either runs out of memory (when several of
+the large between-projects folds fit at once) or leaves cores idle (when a
+conservative worker count is used for the small leave-one-class-out folds).
+`FoldScheduler` instead admits folds while their estimated peak memory fits
+in a budget:
+
+* A fold's peak memory is estimated from its training rows and nonzeros with
+  a per-model linear model (MEMORY_MODELS), scaled by a correction factor.
+* Folds are dispatched largest first; whenever a fold finishes, the largest
+  pending fold that fits in the remaining budget is started. A fold that does
+  not fit even in the whole budget runs alone.
+* Each fold reports the peak RSS increase of its worker while it ran
+  (sampled every few milliseconds). The correction factor is the largest
+  ratio of observed to modeled peak so far, so later estimates follow what
+  the fits actually allocate. It starts at 1 and only grows: a reused
+  worker already holds the memory-mapped inputs and memory of earlier fits,
+  so its increase understates a fold's peak in a fresh worker.
+
+Workers come from joblib's memory-mapping executor, so large arrays passed to
+the folds (such as the design matrix) are shared rather than copied.
+"""
+
+import concurrent.futures
+import os
+import time
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+import psutil
+from joblib.executor import get_memmapping_executor
+
+import instrument
+
+
+class MemoryModel(NamedTuple):
+    """Peak bytes of a fold fit ~ base + per_nnz * nonzeros + per_row * rows."""
+
+    base: float
+    per_nnz: float
+    per_row: float
+
+
+# The sliced training matrix (float32 values and int32 indices) plus the
+# model's working arrays. These are starting points; observed peaks correct
+# them.
+MEMORY_MODELS = {
+    "linear": MemoryModel(base=32 * 2**20, per_nnz=16, per_row=64),
+    "randomforest": MemoryModel(base=64 * 2**20, per_nnz=24, per_row=256),
+    "neighbors": MemoryModel(base=32 * 2**20, per_nnz=24, per_row=64),
+}
+
+
+class FoldJob(NamedTuple):
+    fn: Callable[..., Any]
+    args: Tuple
+    rows: int
+    nnz: int
+
+
+def default_budget() -> int:
+    """80% of the memory currently available, in bytes."""
+    return int(psutil.virtual_memory().available * 0.8)
+
+
+def _measured(fn: Callable[..., Any], args: Tuple) -> Tuple[Any, int]:
+    """Runs fn(*args); returns its result and the peak RSS increase in bytes."""
+    with instrument.RssSampler() as sampler:
+        result = fn(*args)
+    return result, sampler.peak_bytes
+
+
+class FoldScheduler:
+    def __init__(
+        self,
+        model: str,
+        budget_bytes: Optional[int] = None,
+        max_workers: Optional[int] = None,
+        verbose: bool = True,
+    ):
+        self.memory_model = MEMORY_MODELS[model]
+        self.budget = budget_bytes or default_budget()
+        self.max_workers = max_workers or os.cpu_count()
+        self.verbose = verbose
+        # Largest ratio of observed to modeled peak memory so far (at least 1).
+        self.factor = 1.0
+        # (rows, nnz, modeled bytes, observed bytes) of every finished fold.
+        self.observations = []
+
+    def modeled_bytes(self, job: FoldJob) -> float:
+        m = self.memory_model
+        return m.base + m.per_nnz * job.nnz + m.per_row * job.rows
+
+    def estimate(self, job: FoldJob) -> float:
+        return self.modeled_bytes(job) * self.factor
+
+    def _observe(self, job: FoldJob, peak_bytes: int) -> None:
+        modeled = self.modeled_bytes(job)
+        self.observations.append((job.rows, job.nnz, modeled, peak_bytes))
+        self.factor = max(self.factor, peak_bytes / modeled)
+
+    def run(self, jobs: List[FoldJob]) -> List[Any]:
+        """Runs all jobs; returns their results in the order of `jobs`."""
+        results = [None] * len(jobs)
+        # Largest first; estimates only change by a common factor, so the
+        # order stays the same.
+        pending = sorted(range(len(jobs)), key=lambda i: -self.modeled_bytes(jobs[i]))
+        running = {}
+        reserved = 0.0
+        executor = get_memmapping_executor(self.max_workers)
+        start_time = time.monotonic()
+
+        while pending or running:
+            while pending and len(running) < self.max_workers:
+                free = self.budget - reserved
+                fits = [i for i in pending if self.estimate(jobs[i]) <= free]
+                if fits:
+                    i = fits[0]
+                elif not running:
+                    i = pending[0]  # Too large for the budget; run it alone.
+                else:
+                    break
+                pending.remove(i)
+                estimate = self.estimate(jobs[i])
+                future = executor.submit(_measured, jobs[i].fn, jobs[i].args)
+                running[future] = (i, estimate)
+                reserved += estimate
+
+            done, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                i, estimate = running.pop(future)
+                reserved -= estimate
+                results[i], peak_bytes = future.result()
+                self._observe(jobs[i], peak_bytes)
+                if self.verbose:
+                    print(
+                        f"[{time.monotonic() - start_time:7.1f}s] fold "
+                        f"{len(jobs) - len(pending) - len(running)}/{len(jobs)}: "
+                        f"{jobs[i].rows} rows, peak {peak_bytes / 2**20:.0f} MiB "
+                        f"(estimated {estimate / 2**20:.0f} MiB), "
+                        f"{len(running)} running",
+                        flush=True,
+                    )
+        return results
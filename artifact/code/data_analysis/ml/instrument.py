@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Lightweight stage instrumentation for the ML scripts.
+
+When enabled, every `stage` appends one JSON line to a trace file, with the
+stage's wall time, CPU time of the calling process, and the process's RSS at
+the start of the stage and its peak increase during the stage (sampled by an
+`RssSampler`), plus any arguments the caller attaches (e.g., matrix shapes).
+Each line is a Chrome trace "complete" event (fields name, cat, ph, ts, dur,
+pid, tid, and args; times in microseconds), so `instrument.py chrome` turns a
+trace into a file that chrome://tracing or Perfetto can open.
+
+The trace path is passed to joblib workers through the ML_TRACE environment
+variable, so per-fold stages run in worker processes land in the same file
+(lines are appended with single writes). When disabled, `stage` only yields
+an empty dict.
+
+Run `instrument.py --help` for more information.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import pathlib
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterator, Optional, Union
+
+import pandas as pd
+import psutil
+
+TRACE_ENV = "ML_TRACE"
+
+# Interval of the RSS sampler, in seconds.
+SAMPLE_INTERVAL = 0.005
+
+arg_parser = argparse.ArgumentParser(description="Inspect ML pipeline traces.")
+subparsers = arg_parser.add_subparsers(dest="command", required=True)
+_summary_parser = subparsers.add_parser(
+    "summary", help="Print per-stage totals and worker utilization."
+)
+_summary_parser.add_argument("trace", type=pathlib.Path)
+_chrome_parser = subparsers.add_parser(
+    "chrome", help="Convert a trace to the Chrome trace (JSON object) format."
+)
+_chrome_parser.add_argument("trace", type=pathlib.Path)
+_chrome_parser.add_argument("out_json", type=pathlib.Path)
+
+
+def enable(path: Union[str, pathlib.Path, None]) -> None:
+    """Writes traces of this process and its (future) workers to `path`.
+
+    Does nothing if `path` is None.
+    """
+    if path is not None:
+        os.environ[TRACE_ENV] = str(pathlib.Path(path).resolve())
+
+
+def trace_path() -> Optional[str]:
+    return os.environ.get(TRACE_ENV) or None
+
+
+class RssSampler:
+    """Samples the RSS of this process in a background thread.
+
+    Used as a context manager; afterwards, `start_bytes` is the RSS on entry
+    and `peak_bytes` the peak RSS increase above it while the block ran.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.start_bytes = 0
+        self._peak = 0
+
+    def _sample(self) -> None:
+        self._peak = max(self._peak, self._process.memory_info().rss)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def __enter__(self) -> "RssSampler":
+        self.start_bytes = self._peak = self._process.memory_info().rss
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._sample()
+
+    @property
+    def peak_bytes(self) -> int:
+        return self._peak - self.start_bytes
+
+
+def _write(path: str, event: Dict[str, Any]) -> None:
+    line = (json.dumps(event, default=_json_default) + "\n").encode("utf8")
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+    finally:
+        os.close(fd)
+
+
+def _json_default(o):
+    # NumPy scalars and tuples of them (e.g., shapes).
+    if hasattr(o, "item"):
+        return o.item()
+    return str(o)
+
+
+@contextlib.contextmanager
+def stage(name: str, cat: str = "stage", **args) -> Iterator[Dict[str, Any]]:
+    """Traces the enclosed block as one event.
+
+    Yields the event's args, so the block can add to them (e.g., the shape of
+    a matrix it builds).
+    """
+    path = trace_path()
+    if path is None:
+        yield {}
+        return
+    start_wall = time.time()
+    start_cpu = time.process_time()
+    sampler = RssSampler()
+    try:
+        with sampler:
+            yield args
+    finally:
+        end_wall = time.time()
+        args["cpu_s"] = time.process_time() - start_cpu
+        args["start_rss_mb"] = sampler.start_bytes / 2**20
+        args["peak_rss_mb"] = sampler.peak_bytes / 2**20
+        _write(
+            path,
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": int(start_wall * 1e6),
+                "dur": int((end_wall - start_wall) * 1e6),
+                "pid": os.getpid(),
+                "tid": threading.get_ident(),
+                "args": args,
+            },
+        )
+
+
+def read_trace(path: Union[str, pathlib.Path]) -> pd.DataFrame:
+    with open(path) as f:
+        events = [json.loads(line) for line in f if line.strip()]
+    df = pd.DataFrame.from_records(events)
+    args = pd.DataFrame.from_records(list(df.args), index=df.index)
+    return pd.concat([df.drop(columns="args"), args], axis=1)
+
+
+def summarize(events: pd.DataFrame) -> pd.DataFrame:
+    """Totals of wall time, CPU time, and peak RSS per stage name."""
+    df = events.assign(wall_s=events.dur / 1e6)
+    return df.groupby(["cat", "name"], sort=False).agg(
+        count=("wall_s", "size"),
+        wall_s=("wall_s", "sum"),
+        max_wall_s=("wall_s", "max"),
+        cpu_s=("cpu_s", "sum"),
+        peak_rss_mb=("peak_rss_mb", "max"),
+    )
+
+
+def utilization(events: pd.DataFrame) -> pd.DataFrame:
+    """Worker utilization of each "parallel" stage.
+
+    The fold events that start within a parallel stage are its work, and the
+    distinct processes that ran them are its workers. The utilization is the
+    total duration of the work over the stage's duration times the number of
+    workers.
+    """
+    rows = []
+    folds = events[events.cat == "fold"]
+    for _, p in events[events.cat == "parallel"].iterrows():
+        inside = folds[(folds.ts >= p.ts) & (folds.ts <= p.ts + p.dur)]
+        n_workers = inside.pid.nunique()
+        busy = inside.dur.sum()
+        capacity = p.dur * n_workers
+        rows.append(
+            {
+                "name": p["name"],
+                "wall_s": p.dur / 1e6,
+                "tasks": len(inside),
+                "workers": n_workers,
+                "busy_s": busy / 1e6,
+                "utilization": busy / capacity if capacity else 0.0,
+            }
+        )
+    return pd.DataFrame(rows)
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    events = read_trace(args.trace)
+    if args.command == "summary":
+        with pd.option_context("display.width", 200, "display.max_rows", None):
+            print(summarize(events).round(3))
+            parallel = utilization(events)
+            if len(parallel):
+                print()
+                print(parallel.round(3).to_string(index=False))
+    else:
+        with open(args.trace) as f:
+            trace_events = [json.loads(line) for line in f if line.strip()]
+        with open(args.out_json, "w") as f:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
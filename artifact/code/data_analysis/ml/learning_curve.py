@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""Learning curves of the linear model: accuracy and fit time vs. training data.
+
+For each fraction in --fractions, the training data is subsampled (by
+classes within each subject, or by subjects), the folds of train_model.py
+(leave one class out; or --project_only, or --between_projects) are fit on
+the sample, and each held-out class is scored with the per-class Spearman
+correlation of model_eval.py (pKillsDom vs. prediction; NaN for classes with
+fewer than 2 mutants); folds without training data in the sample are
+skipped. Samples are nested: every repeat draws one random order of the
+classes (or subjects), and each fraction takes a prefix of it.
+
+No fold is fit on rows. Ridge regression with an intercept only depends on
+the training data through the sufficient statistics n, sum(x), sum(y), X'y,
+and X'X, and these add up over classes. They are computed once per class
+(and cached in --cache_dir, keyed by the data and the featurization), so the
+statistics of a fold are those of the sample, minus those of the held-out
+class (or project), and fitting it is one conjugate-gradient solve of the
+centered normal equations, (X'X - n mm' + alpha I) w = X'y - n m mean(y),
+where m = sum(x) / n. The solve is warm-started from the solution for the
+whole sample and preconditioned with the diagonal, and the difference of the
+Gram matrices is never formed.
+
+The per-class results are written to --out, and the median Spearman, mean
+training rows, and mean fit time of each fraction are printed (and written
+to --summary_out).
+
+Run `learning_curve.py --help` for more information.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import inspect
+import pathlib
+import sys
+import tempfile
+import time
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.stats
+from scipy import sparse
+from scipy.sparse import linalg as sparse_linalg
+
+import eval_cache
+import features
+import model_eval
+
+# Bump when the cached statistics change.
+STATS_VERSION = 1
+
+# Relative residual of the conjugate-gradient solves.
+_CG_TOL = 1e-8
+# SciPy 1.12 renamed cg's `tol` to `rtol`, and 1.14 removed `tol`.
+_CG_TOL_ARG = (
+    "rtol" if "rtol" in inspect.signature(sparse_linalg.cg).parameters else "tol"
+)
+
+arg_parser = argparse.ArgumentParser(
+    description="Compute learning curves of the linear model from class statistics."
+)
+arg_parser.add_argument(
+    "results_dir",
+    type=pathlib.Path,
+    help="The directory to search for customized_mutants.csv files.",
+)
+arg_parser.add_argument("--data", default="all", choices=features.DATA_CHOICES)
+arg_parser.add_argument(
+    "--fractions",
+    type=float,
+    nargs="+",
+    default=[0.1, 0.25, 0.5, 1.0],
+    help="The fractions of the training units to sample.",
+)
+arg_parser.add_argument(
+    "--unit",
+    default="class",
+    choices=["class", "subject"],
+    help="Sample classes within each subject, or whole subjects.",
+)
+arg_parser.add_argument("--repeats", type=int, default=3)
+arg_parser.add_argument("--seed", type=int, default=0)
+arg_parser.add_argument("--alpha", type=float, default=1.0)
+arg_parser.add_argument(
+    "--project_only",
+    action="store_true",
+    help="If set, training data will only be drawn from the same project.",
+)
+arg_parser.add_argument(
+    "--between_projects",
+    action="store_true",
+    help="If set, training data will only be drawn from other projects.",
+)
+arg_parser.add_argument(
+    "--eval_classes",
+    type=int,
+    default=None,
+    help="Only score this many (randomly chosen) classes at each point.",
+)
+arg_parser.add_argument(
+    "--cache_dir",
+    type=pathlib.Path,
+    default=None,
+    help="If given, cache the per-class statistics here.",
+)
+arg_parser.add_argument(
+    "--out", type=pathlib.Path, default=None, help="Write per-class results here."
+)
+arg_parser.add_argument(
+    "--summary_out",
+    type=pathlib.Path,
+    default=None,
+    help="Write the per-fraction summary here.",
+)
+
+
+class Stats(NamedTuple):
+    """Sufficient statistics of ridge regression over a set of rows."""
+
+    n: int
+    sum_x: np.ndarray
+    sum_y: float
+    xty: np.ndarray
+    # X'X, as a sum of (sign, sparse matrix) terms.
+    gram: List[Tuple[int, sparse.spmatrix]]
+
+    def minus(self, other: "Stats") -> "Stats":
+        return Stats(
+            self.n - other.n,
+            self.sum_x - other.sum_x,
+            self.sum_y - other.sum_y,
+            self.xty - other.xty,
+            self.gram + [(-sign, g) for sign, g in other.gram],
+        )
+
+
+class ClassStats:
+    """The statistics and design matrix rows of every class of a corpus."""
+
+    def __init__(self, cm_df: pd.DataFrame, X: sparse.spmatrix, y: np.ndarray):
+        keys = ["projectId", "bugId", "className"]
+        codes = cm_df.groupby(keys, sort=True).ngroup().values
+        self.classes = (
+            cm_df[keys].drop_duplicates().sort_values(keys).reset_index(drop=True)
+        )
+        X = sparse.csr_matrix(X, dtype=np.float64)
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(self.classes) + 1))
+        self.X: List[sparse.csr_matrix] = []
+        self.y: List[np.ndarray] = []
+        self.gram: List[sparse.coo_matrix] = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            rows = order[start:stop]
+            X_c = X[rows]
+            self.X.append(X_c)
+            self.y.append(np.asarray(y[rows], dtype=np.float64))
+            self.gram.append((X_c.T @ X_c).tocoo())
+        self.n = np.diff(bounds)
+        self.sum_x = sparse.vstack(
+            [sparse.csr_matrix(X_c.sum(axis=0)) for X_c in self.X]
+        )
+        self.sum_y = np.array([y_c.sum() for y_c in self.y])
+        self.xty = sparse.vstack(
+            [sparse.csr_matrix(X_c.T @ y_c) for X_c, y_c in zip(self.X, self.y)]
+        )
+        self.n_columns = X.shape[1]
+
+    def total(self, indices: Sequence[int]) -> Stats:
+        """Returns the statistics of the union of the given classes."""
+        indices = np.asarray(indices, dtype=np.int64)
+        grams = [self.gram[i] for i in indices]
+        p = self.n_columns
+        gram = sparse.csr_matrix(
+            (
+                np.concatenate([g.data for g in grams] or [np.zeros(0)]),
+                (
+                    np.concatenate([g.row for g in grams] or [np.zeros(0, np.int32)]),
+                    np.concatenate([g.col for g in grams] or [np.zeros(0, np.int32)]),
+                ),
+            ),
+            shape=(p, p),
+        )
+        return Stats(
+            int(self.n[indices].sum()),
+            np.asarray(self.sum_x[indices].sum(axis=0)).ravel(),
+            float(self.sum_y[indices].sum()),
+            np.asarray(self.xty[indices].sum(axis=0)).ravel(),
+            [(1, gram)],
+        )
+
+
+def solve(
+    stats: Stats, alpha: float, x0: Optional[np.ndarray] = None
+) -> Tuple[np.ndarray, float]:
+    """Fits ridge regression with an intercept to the rows of `stats`.
+
+    Returns:
+        (coefficients, intercept).
+    """
+    n = stats.n
+    m = stats.sum_x / n
+    y_mean = stats.sum_y / n
+
+    def matvec(v):
+        v = np.ravel(v)
+        out = alpha * v - n * m * (m @ v)
+        for sign, g in stats.gram:
+            out += sign * (g @ v)
+        return out
+
+    diagonal = alpha - n * m * m
+    for sign, g in stats.gram:
+        diagonal = diagonal + sign * g.diagonal()
+    p = len(m)
+    A = sparse_linalg.LinearOperator((p, p), matvec=matvec, dtype=np.float64)
+    M = sparse_linalg.LinearOperator(
+        (p, p), matvec=lambda v: np.ravel(v) / diagonal, dtype=np.float64
+    )
+    rhs = stats.xty - n * m * y_mean
+    coef, info = sparse_linalg.cg(
+        A, rhs, x0=x0, M=M, maxiter=10 * p, **{_CG_TOL_ARG: _CG_TOL}
+    )
+    if info != 0:
+        print(f"Warning: CG did not converge ({info})", file=sys.stderr)
+    return coef, y_mean - m @ coef
+
+
+def class_spearman(X: sparse.spmatrix, y: np.ndarray, coef, intercept) -> float:
+    """The per-class Spearman of model_eval.create_predictions."""
+    if len(y) < 2:
+        return np.nan
+    return scipy.stats.spearmanr(y, X @ coef + intercept).correlation
+
+
+def _stats_cache_key(cm_df: pd.DataFrame, data: str) -> str:
+    h = hashlib.sha256()
+    h.update(json.dumps({"version": STATS_VERSION, "data": data}).encode("utf8"))
+    h.update(eval_cache.frame_digest(cm_df).encode("utf8"))
+    return h.hexdigest()
+
+
+def class_stats(
+    cm_df: pd.DataFrame, data: str, cache_dir: Optional[pathlib.Path] = None
+) -> ClassStats:
+    """Featurizes the corpus (as train_model.py) and computes ClassStats."""
+    cache_path = None
+    if cache_dir is not None:
+        cache_path = cache_dir / f"stats-{_stats_cache_key(cm_df, data)}.joblib"
+        if cache_path.exists():
+            print(f"Using cached statistics: {cache_path}")
+            # Cached as a dict, so the cache does not depend on the module name
+            # (__main__ when run as a script).
+            stats = ClassStats.__new__(ClassStats)
+            stats.__dict__.update(joblib.load(cache_path))
+            return stats
+    mapper = features.build_mapper(data)
+    X = mapper.fit_transform(cm_df.copy()).astype(np.float32)
+    stats = ClassStats(cm_df, X, cm_df.pKillsDom.values)
+    if cache_path is not None:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fo:
+                joblib.dump(vars(stats), fo)
+            os.replace(tmp_path, cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return stats
+
+
+def sample_units(
+    classes: pd.DataFrame, unit: str, fractions: Sequence[float], seed: int
+) -> Dict[float, np.ndarray]:
+    """Returns a nested sample of the classes for each fraction (as a mask)."""
+    rng = np.random.default_rng(seed)
+    samples = {}
+    if unit == "subject":
+        subjects = classes.projectId.drop_duplicates().values
+        order = rng.permutation(subjects)
+        for f in fractions:
+            chosen = order[: max(1, int(np.ceil(f * len(order))))]
+            samples[f] = classes.projectId.isin(chosen).values
+        return samples
+    # A random rank of each class within its subject.
+    rank = (
+        pd.Series(rng.random(len(classes)))
+        .groupby(classes.projectId.values)
+        .rank(method="first")
+        .values
+    )
+    size = classes.groupby("projectId").className.transform("size").values
+    for f in fractions:
+        samples[f] = rank <= np.maximum(1, np.ceil(f * size))
+    return samples
+
+
+def learning_curve(stats: ClassStats, args) -> pd.DataFrame:
+    classes = stats.classes
+    all_indices = np.arange(len(classes))
+    eval_indices = all_indices
+    if args.eval_classes is not None and args.eval_classes < len(classes):
+        rng = np.random.default_rng(args.seed)
+        eval_indices = np.sort(
+            rng.choice(all_indices, args.eval_classes, replace=False)
+        )
+    projects = classes.projectId.values
+
+    records = []
+    for repeat in range(args.repeats):
+        samples = sample_units(
+            classes, args.unit, args.fractions, [args.seed, repeat]
+        )
+        for fraction in args.fractions:
+            in_sample = samples[fraction]
+            sample_total = stats.total(all_indices[in_sample])
+            x0, _ = solve(sample_total, args.alpha)
+            project_totals = {}
+
+            def project_total(project):
+                if project not in project_totals:
+                    members = all_indices[in_sample & (projects == project)]
+                    project_totals[project] = stats.total(members)
+                return project_totals[project]
+
+            if args.between_projects:
+                folds = [
+                    (project, eval_indices[projects[eval_indices] == project])
+                    for project in pd.unique(projects[eval_indices])
+                ]
+            else:
+                folds = [(projects[i], np.array([i])) for i in eval_indices]
+
+            for project, evaluated in folds:
+                start = time.perf_counter()
+                if args.between_projects:
+                    train = sample_total.minus(project_total(project))
+                else:
+                    base = project_total(project) if args.project_only else sample_total
+                    held_out = evaluated[in_sample[evaluated]]
+                    train = base.minus(stats.total(held_out)) if len(held_out) else base
+                if train.n == 0:
+                    continue  # No training data in the sample.
+                coef, intercept = solve(train, args.alpha, x0)
+                seconds = time.perf_counter() - start
+                for i in evaluated:
+                    spearman = class_spearman(stats.X[i], stats.y[i], coef, intercept)
+                    records.append(
+                        {
+                            "fraction": fraction,
+                            "repeat": repeat,
+                            "projectId": classes.projectId[i],
+                            "bugId": classes.bugId[i],
+                            "className": classes.className[i],
+                            "trainRows": train.n,
+                            "spearmans": spearman,
+                            "fitSeconds": seconds,
+                        }
+                    )
+            print(
+                f"repeat {repeat}, fraction {fraction}: {in_sample.sum()} classes, "
+                f"{sample_total.n} rows",
+                flush=True,
+            )
+    return pd.DataFrame.from_records(records)
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """The median Spearman, mean training rows, and mean fit time per fraction."""
+    per_repeat = results.groupby(["fraction", "repeat"]).agg(
+        medianSpearman=("spearmans", "median"),
+        trainRows=("trainRows", "mean"),
+        fitSeconds=("fitSeconds", "mean"),
+    )
+    summary = per_repeat.groupby("fraction").mean()
+    summary["medianSpearmanStd"] = per_repeat.medianSpearman.groupby("fraction").std()
+    return summary
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+    assert not (args.project_only and args.between_projects), "Args cannot be combined"
+    assert all(0 < f <= 1 for f in args.fractions), "Fractions must be in (0, 1]"
+
+    cm_df = model_eval.read_cm_df(args.results_dir)
+    stats = class_stats(cm_df, args.data, args.cache_dir)
+    results = learning_curve(stats, args)
+    summary = summarize(results)
+    print(summary.to_string())
+    if args.out is not None:
+        print(f"Writing to: {args.out}")
+        results.to_csv(args.out, index=False)
+    if args.summary_out is not None:
+        print(f"Writing summary to: {args.summary_out}")
+        summary.to_csv(args.summary_out)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
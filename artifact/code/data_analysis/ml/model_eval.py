@@ -25,6 +25,12 @@ import scipy.stats
 import sklearn
 import sklearn.metrics
 
+import bootstrap
+import eval_cache
+import instrument
+import multi_target
+import rf_compile
+
 arg_parser = argparse.ArgumentParser(
     description="Create plots for the intrinsic model comparison."
 )
@@ -58,22 +64,89 @@ arg_parser.add_argument(
     type=pathlib.Path,
     help="The destination directory for the output predictions CSVS",
 )
+arg_parser.add_argument(
+    "--quantized",
+    action="store_true",
+    help="If set, evaluate the quantize.py outputs (model-*.quantized.joblib) instead.",
+)
+arg_parser.add_argument(
+    "--metrics_dir",
+    type=pathlib.Path,
+    default=None,
+    help="If given, write per-class metrics (eval_metrics.csv) and bootstrap CIs "
+    "of the per-project median Spearman (median_spearmans_ci.csv) here.",
+)
+arg_parser.add_argument(
+    "--bootstrap_resamples",
+    type=int,
+    default=10000,
+    help="The number of bootstrap resamples used for --metrics_dir.",
+)
+arg_parser.add_argument(
+    "--cache_dir",
+    type=pathlib.Path,
+    default=None,
+    help="If given, cache each model's predictions and metrics here, keyed by the "
+    "contents of the model file and the covered-mutant data.",
+)
+arg_parser.add_argument(
+    "--cache_max_bytes",
+    type=int,
+    default=4 * 2**30,
+    help="Least recently used cache entries are evicted beyond this size.",
+)
+arg_parser.add_argument(
+    "--trace",
+    type=pathlib.Path,
+    default=None,
+    help="Append a JSON-lines trace of stage times and memory to this file "
+    "(see instrument.py).",
+)
 
 
 def main() -> int:
     logging.basicConfig()
 
     args = arg_parser.parse_args()
+    instrument.enable(args.trace)
+
+    with instrument.stage("read_csv") as trace_args:
+        cm_df = read_cm_df(args.results_dir)
+        trace_args["rows"] = len(cm_df)
+    model_paths = find_models(
+        args.model_root, suffix=".quantized" if args.quantized else ""
+    )
 
-    cm_df = read_cm_df(args.results_dir)
-    loaded_models = load_models(args.model_root)
+    # Reuse cached results for unchanged models; only score the others.
+    cache = None
+    if args.cache_dir is not None:
+        cache = eval_cache.EvalCache(args.cache_dir, args.cache_max_bytes)
+        data_digest = eval_cache.frame_digest(cm_df)
+    evaluated = {}
+    to_score = []
+    for name, path in model_paths.items():
+        cache_key = None
+        if cache is not None:
+            cache_key = eval_cache.entry_key(eval_cache.file_digest(path), data_digest)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                print(f"Using cached results for: {path}")
+                evaluated[name] = cached
+                continue
+        to_score.append((name, path, cache_key))
+
+    with instrument.stage("score_models", cat="parallel", models=len(to_score)):
+        for name, cache_key, result in joblib.Parallel(n_jobs=-1)(
+            joblib.delayed(_cpd_job)(n, p, cm_df, k) for n, p, k in to_score
+        ):
+            evaluated[name] = result
+            if cache is not None:
+                cache.put(cache_key, result)
 
     all_eval_metrics = {}
     mutants_to_predictions = {}
-    src = list(loaded_models.items())
-    for name, (em, m2p) in joblib.Parallel(n_jobs=-1)(
-        joblib.delayed(_cpd_job)(n, cm_df, m, r) for n, (m, r) in src
-    ):
+    for name in model_paths:
+        em, m2p = evaluated[name]
         expanded_model_desc = tuple(name.split("-"))
         assert len(expanded_model_desc) == 3
         all_eval_metrics[expanded_model_desc] = em
@@ -83,17 +156,23 @@ def main() -> int:
         all_eval_metrics, names=["modelType", "featuresUsed", "trainingSet"]
     )
 
+    if args.metrics_dir is not None:
+        args.metrics_dir.mkdir(parents=True, exist_ok=True)
+        all_eval_metrics_df.to_csv(args.metrics_dir / "eval_metrics.csv")
+        bootstrap.median_spearman_cis(
+            all_eval_metrics_df, n_resamples=args.bootstrap_resamples
+        ).to_csv(args.metrics_dir / "median_spearmans_ci.csv")
+
     # Save the plot as a .pgf to a temp. path
-    plot_spearmans_to_temp_file(
-        all_eval_metrics_df, args.output_pdf_path, args.output_pgf_path
-    )
+    with instrument.stage("plot"):
+        plot_spearmans_to_temp_file(
+            all_eval_metrics_df, args.output_pdf_path, args.output_pgf_path
+        )
 
     # Save predictions to one gzipped CSV per model.
     mutants_to_predictions_df = pd.concat(
         {
-            model_desc: pd.DataFrame.from_records(
-                d, index=["projectId", "bugId", "mutantId"]
-            )
+            model_desc: d.set_index(["projectId", "bugId", "mutantId"])
             for model_desc, d in mutants_to_predictions.items()
         },
         names=["modelType", "featuresUsed", "trainingSet"],
@@ -107,11 +186,15 @@ def main() -> int:
     ):
         file_key = "-".join(key)
         filename = args.output_predictions_path / f"predictions-{file_key}.csv.gz"
-        to_write = mutants_to_predictions_df.loc[key].rename(
-            columns={"prediction": "predictedProbKillsDom"}
+        # Drop extra target columns that only other (multi-target) models have.
+        to_write = (
+            mutants_to_predictions_df.loc[key]
+            .rename(columns={"prediction": "predictedProbKillsDom"})
+            .dropna(axis="columns", how="all")
         )
         assert len(to_write)
-        to_write.to_csv(str(filename), index=True)
+        with instrument.stage("write_predictions", path=filename, rows=len(to_write)):
+            to_write.to_csv(str(filename), index=True)
 
     return 0
 
@@ -140,34 +223,62 @@ def read_cm_df(results_dir: Union[str, pathlib.Path]) -> pd.DataFrame:
     return cm_df
 
 
-def load_models(models_root: Union[str, pathlib.Path]) -> Mapping[str, Any]:
+def load_models(
+    models_root: Union[str, pathlib.Path], suffix: str = ""
+) -> Mapping[str, Any]:
     """Loads all machine learning models from the given directory.
 
+    If given, `suffix` is inserted before the file extension; e.g., ".quantized"
+    loads model-linear-all_features-project_only.quantized.joblib.
+
     Returns:
         A dictionary mapping model names to loaded models. A name is derived
         from the path; e.g., "linear-all_features-project_only".
     """
+    loaded_models = {}
+    for name, path in find_models(models_root, suffix).items():
+        with open(path, "rb") as fo:
+            loaded_models[name] = joblib.load(fo)
+    return loaded_models
+
+
+def find_models(
+    models_root: Union[str, pathlib.Path], suffix: str = ""
+) -> Mapping[str, pathlib.Path]:
+    """Finds the model files in the given directory, keyed by model name."""
     if isinstance(models_root, str):
         models_root = pathlib.Path(models_root)
 
-    loaded_models = {}
+    model_paths = {}
     for t in itertools.product(
-        ["linear", "randomforest"],
-        ["all_features", "few_features"],
+        ["linear", "randomforest", "neighbors"],
+        ["all_features", "few_features", "hashed_features"],
         ["all_projects", "project_only", "between_projects"],
     ):
         name = "-".join(t)
-        path = models_root / f"model-{name}.joblib"
+        path = models_root / f"model-{name}{suffix}.joblib"
         if not path.is_file():
             warnings.warn(f"Skipping {path}")
             continue
-        with open(path, "rb") as fo:
-            loaded_models[name] = joblib.load(fo)
-    return loaded_models
+        model_paths[name] = path
+    return model_paths
+
+
+def _cpd_job(name, path, cm_df, cache_key):
+    with instrument.stage("score_model", cat="fold", model=name):
+        with instrument.stage("load_model", model=name):
+            with open(path, "rb") as fo:
+                mapper, results = joblib.load(fo)
+        with instrument.stage("create_predictions", model=name, rows=len(cm_df)):
+            eval_metrics, m2p = create_predictions(cm_df, mapper, results)
+        return name, cache_key, (eval_metrics, pd.DataFrame.from_records(m2p))
 
 
-def _cpd_job(name, *args):
-    return name, create_predictions(*args)
+def _predict_targets(model, X) -> np.ndarray:
+    """Returns a model's predictions with one column per target."""
+    if isinstance(model, multi_target.MultiTargetModel):
+        return model.predict_targets(X)
+    return np.asarray(model.predict(X)).reshape(X.shape[0], 1)
 
 
 # Produce predictions for each Java class, for each model
@@ -181,7 +292,9 @@ def create_predictions(cm_df: pd.DataFrame, mapper, results):
     spearmans = []
     spearmans_exp_dom_nodes = []
 
-    for (proj, bug_id, key), model in results:
+    # Resolve the classes each fold's model is evaluated on.
+    segments = []
+    for fold_idx, ((proj, bug_id, key), model) in enumerate(results):
         if isinstance(key, str):  # Convert. (For backward compatibility.)
             key = {"class": key}
         assert isinstance(key, dict), "Key was " + str(type(key))
@@ -194,38 +307,86 @@ def create_predictions(cm_df: pd.DataFrame, mapper, results):
             target_class_names = [key["class"]]
 
         for target_class_name in target_class_names:
-            project_ids.append(proj)
-            bug_ids.append(bug_id)
-            class_names.append(target_class_name)
-
             eval_df = cm_df[
                 (cm_df.projectId == proj) & (cm_df.className == target_class_name)
             ].copy()
             assert len(eval_df) < len(cm_df)
+            segments.append((proj, bug_id, target_class_name, fold_idx, eval_df))
+
+    # Multi-target models (see multi_target.py) are evaluated on every target;
+    # the first target's predictions are the ones reported as "prediction".
+    targets = multi_target.model_targets(results[0][1]) if results else []
+    per_target_metrics = {}
+    if len(targets) > 1:
+        for t in targets:
+            per_target_metrics[f"r2Score_{t}"] = []
+            per_target_metrics[f"spearmans_{t}"] = []
+
+    # Random forests from all folds are compiled into flat arrays and evaluated
+    # in one batched pass; other models are evaluated fold by fold.
+    compiled = rf_compile.compile_forests(
+        [multi_target.unwrap(model) for _, model in results]
+    )
+    if compiled is not None:
+        gathered = [compiled.gather(mapper.transform(s[4])) for s in segments]
+        fold_ids = np.concatenate(
+            [np.full(len(s[4]), s[3], dtype=np.int64) for s in segments]
+        )
+        all_preds = compiled.predict_gathered(
+            np.concatenate(gathered) if gathered else np.empty((0, 0)), fold_ids
+        ).reshape(-1, len(targets))
+        bounds = np.cumsum([0] + [len(s[4]) for s in segments])
+        segment_preds = [all_preds[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+    else:
+        segment_preds = [
+            _predict_targets(results[fold_idx][1], mapper.transform(eval_df))
+            for _, _, _, fold_idx, eval_df in segments
+        ]
 
-            X_ = mapper.transform(eval_df)
-            y_ = eval_df.pKillsDom.values.copy()
-            y_exp_killed = eval_df.expKilledDomNodes.copy()
-
-            preds = model.predict(X_)
-            for m, p in zip(eval_df.mutantId, preds):
-                m2p.append(
-                    {"projectId": proj, "bugId": bug_id, "mutantId": m, "prediction": p}
-                )
-
-            if len(y_) < 2:
-                print(
-                    "Skipping R2/Spearman because fewer than 2 samples", file=sys.stderr
-                )
-                r2_scores.append(np.nan)
-                spearmans.append(np.nan)
-                spearmans_exp_dom_nodes.append(np.nan)
-            else:
-                r2_scores.append(sklearn.metrics.r2_score(y_, preds))
-                spearmans.append(scipy.stats.spearmanr(y_, preds).correlation)
-                spearmans_exp_dom_nodes.append(
-                    scipy.stats.spearmanr(y_exp_killed, preds).correlation
-                )
+    for (proj, bug_id, target_class_name, _, eval_df), target_preds in zip(
+        segments, segment_preds
+    ):
+        project_ids.append(proj)
+        bug_ids.append(bug_id)
+        class_names.append(target_class_name)
+
+        y_ = eval_df.pKillsDom.values.copy()
+        y_exp_killed = eval_df.expKilledDomNodes.copy()
+        preds = target_preds[:, 0]
+
+        for i, m in enumerate(eval_df.mutantId):
+            record = {
+                "projectId": proj,
+                "bugId": bug_id,
+                "mutantId": m,
+                "prediction": preds[i],
+            }
+            for j, t in enumerate(targets[1:], start=1):
+                record["predicted" + t[0].upper() + t[1:]] = target_preds[i, j]
+            m2p.append(record)
+
+        if len(y_) < 2:
+            print("Skipping R2/Spearman because fewer than 2 samples", file=sys.stderr)
+            r2_scores.append(np.nan)
+            spearmans.append(np.nan)
+            spearmans_exp_dom_nodes.append(np.nan)
+            for values in per_target_metrics.values():
+                values.append(np.nan)
+        else:
+            r2_scores.append(sklearn.metrics.r2_score(y_, preds))
+            spearmans.append(scipy.stats.spearmanr(y_, preds).correlation)
+            spearmans_exp_dom_nodes.append(
+                scipy.stats.spearmanr(y_exp_killed, preds).correlation
+            )
+            if per_target_metrics:
+                for j, t in enumerate(targets):
+                    y_t = eval_df[t].values.astype(np.float64)
+                    per_target_metrics[f"r2Score_{t}"].append(
+                        sklearn.metrics.r2_score(y_t, target_preds[:, j])
+                    )
+                    per_target_metrics[f"spearmans_{t}"].append(
+                        scipy.stats.spearmanr(y_t, target_preds[:, j]).correlation
+                    )
 
     eval_metrics = pd.DataFrame(
         data={
@@ -235,6 +396,7 @@ def create_predictions(cm_df: pd.DataFrame, mapper, results):
             "r2Score": r2_scores,
             "spearmans": spearmans,
             "spearmans_exp_dom_nodes": spearmans_exp_dom_nodes,
+            **per_target_metrics,
         }
     ).set_index(["projectId", "bugId", "className"], verify_integrity=True)
 
@@ -273,8 +435,10 @@ def plot_spearmans_to_temp_file(
                     {
                         "linear": "Linear",
                         "randomforest": "Random Forest",
+                        "neighbors": "Nearest Neighbors",
                         "all_features": "All",
                         "few_features": "Few",
+                        "hashed_features": "Hashed",
                         "all_projects": "All Projects",
                         "between_projects": "Between Projects",
                         "project_only": "Project-Only",
@@ -0,0 +1,34 @@
+"""The model classes that train_model.py can fit per fold."""
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+import neighbors
+import solvers
+
+MODEL_CHOICES = ["linear", "randomforest", "neighbors"]
+
+
+def build_model(
+    model: str, linear_solver: str = "auto", categorical_columns: np.ndarray = None
+):
+    """Returns a new, unfitted estimator for a `--model` choice of train_model.py.
+
+    `linear_solver` is the backend of linear models (see solvers.py), and
+    `categorical_columns` the posting columns of neighbors models (see
+    `features.categorical_columns`).
+    """
+    if model == "linear":
+        return solvers.BackendRidge(backend=linear_solver)
+    elif model == "randomforest":
+        return RandomForestRegressor(
+            max_depth=3,
+            n_estimators=10,
+            n_jobs=1,
+            # n_jobs=max(1, os.cpu_count() // 8),
+        )
+    elif model == "neighbors":
+        if categorical_columns is None:
+            raise ValueError("Neighbors models need the categorical columns")
+        return neighbors.ContextNeighbors(categorical_columns)
+    raise ValueError(f"Unexpected model arg: {model}")
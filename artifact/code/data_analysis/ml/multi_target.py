@@ -0,0 +1,48 @@
+"""Support for models fit to several labels at once.
+
+`train_model.py --targets ...` fits one model per fold against several label
+columns of customized-mutants.csv. Such models are stored wrapped in a
+`MultiTargetModel`, which records the label names and keeps `predict`
+returning the primary (first) target.
+
+Only models whose multi-output fit is the same as separate per-target fits
+support several targets: ridge regression solves every label column
+independently, and so does the nearest-neighbor model. A random forest would
+grow joint trees whose splits minimize the summed error of all targets, so
+the larger-scaled labels (e.g., expKilledDomNodes) would drive the splits of
+the primary target; train_model.py rejects several targets for it.
+"""
+
+from typing import Sequence
+
+import numpy as np
+
+# Label columns that can be learned. The first is always the primary target.
+TARGETS = ["pKillsDom", "expKilledDomNodes", "isDominator"]
+
+
+class MultiTargetModel:
+    def __init__(self, model, targets: Sequence[str]):
+        self.model = model
+        self.targets = list(targets)
+
+    def predict(self, X) -> np.ndarray:
+        return self.predict_targets(X)[:, 0]
+
+    def predict_targets(self, X) -> np.ndarray:
+        """Returns predictions with one column per entry in `targets`."""
+        return np.asarray(self.model.predict(X)).reshape(X.shape[0], len(self.targets))
+
+
+def model_targets(model) -> Sequence[str]:
+    """Returns the labels predicted by `model`."""
+    if isinstance(model, MultiTargetModel):
+        return model.targets
+    return TARGETS[:1]
+
+
+def unwrap(model):
+    """Returns the underlying estimator of a (possibly wrapped) model."""
+    if isinstance(model, MultiTargetModel):
+        return model.model
+    return model
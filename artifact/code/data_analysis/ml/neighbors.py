@@ -0,0 +1,67 @@
+"""A nearest-neighbor model over an inverted index of categorical features.
+
+Mutants with the same operator and AST context tend to have similar utility.
+`ContextNeighbors` predicts a mutant's label as a weighted average of the
+labels of the training mutants that share (feature, value) pairs with it.
+
+The (feature, value) pairs are the postings of an inverted index over the
+design matrix: its one-hot (--data all, small) or hashed (--data hashed)
+categorical columns, as given by `features.categorical_columns` of the
+mapper. Other columns (the numeric features) are ignored.
+A training mutant's weight is the sum of the idf weights, log(n / n_p), of
+the postings p it shares with the query, so rare context values count more
+than, e.g., a shared operator group. Merging the query's posting lists then
+reduces to
+
+    sum_m weight_m * y_m = sum_{p in query} idf_p * sum_{m in P(p)} y_m,
+
+where P(p) is the posting list of p. `fit` therefore only keeps the size and
+label sums of each posting list, and a query costs O(k) for its k postings,
+independently of the number of training mutants. The average is shrunk
+towards the mean training label with a prior weight `prior`, so that queries
+sharing no postings with any training mutant predict the mean.
+"""
+
+import numpy as np
+from scipy import sparse
+
+
+class ContextNeighbors:
+    def __init__(self, columns: np.ndarray, prior: float = 1.0):
+        self.columns = columns
+        self.prior = prior
+
+    @staticmethod
+    def _binary_postings(X, columns: np.ndarray) -> sparse.csr_matrix:
+        """Returns the binary mutant x posting matrix of X's `columns`."""
+        postings = sparse.csr_matrix(sparse.csc_matrix(X)[:, columns])
+        postings.eliminate_zeros()
+        postings.data = np.ones_like(postings.data, dtype=np.float64)
+        return postings
+
+    def _postings(self, X) -> sparse.csr_matrix:
+        return self._binary_postings(X, self.columns_)
+
+    def fit(self, X, y):
+        X = sparse.csc_matrix(X)
+        y = np.asarray(y, dtype=np.float64)
+        self.n_targets_ = 0 if y.ndim == 1 else y.shape[1]
+        y = y.reshape(len(y), -1)
+        columns = np.asarray(self.columns, dtype=np.int64)
+        postings_t = sparse.csr_matrix(self._binary_postings(X, columns).T)
+        counts = np.asarray(postings_t.sum(axis=1))[:, 0]
+        # Values that never occur in training have no posting list.
+        self.columns_ = columns[counts > 0]
+        postings_t = postings_t[counts > 0]
+        self.counts_ = counts[counts > 0]
+        self.sums_ = postings_t @ y
+        self.idf_ = np.log(len(y) / self.counts_)
+        self.mean_ = y.mean(axis=0)
+        return self
+
+    def predict(self, X) -> np.ndarray:
+        postings = self._postings(X)
+        weight = postings @ (self.idf_ * self.counts_) + self.prior
+        sums = postings @ (self.idf_[:, None] * self.sums_) + self.prior * self.mean_
+        preds = sums / weight[:, None]
+        return preds[:, 0] if self.n_targets_ == 0 else preds
@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+"""Compact storage for featurized data and quantized linear models.
+
+Most columns produced by the `train_model.py` mappers are one-hot indicators,
+and the rest are a handful of scaled numeric features. This module provides:
+
+* `CompactDesignMatrix`, which stores one-hot blocks as index-only sparse
+  structure (no data array), hashed blocks as sparse int8 values, and
+  numeric blocks as float16; and
+* `QuantizedRidge`, a drop-in replacement for a fitted `Ridge` whose
+  coefficients are stored as int8 with one float32 scale per feature block.
+
+Run as a script, it quantizes the linear models in a `train_model.py` output
+file. Every quantized fold model carries a `guardrail` record comparing its
+per-class Spearman correlations (as computed by `model_eval.py`) with those of
+the float32 model; folds exceeding the tolerance keep their float32 model.
+
+Run `quantize.py --help` for more information.
+"""
+
+import argparse
+import pathlib
+import sys
+from typing import Iterable, Optional, Sequence
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.linear_model import Ridge
+
+import model_eval
+import multi_target
+from features import FeatureBlock, mapper_blocks
+
+arg_parser = argparse.ArgumentParser(
+    description="Quantize the linear models produced by train_model.py."
+)
+arg_parser.add_argument(
+    "results_dir",
+    type=pathlib.Path,
+    help="The directory to search for customized-mutants.csv files.",
+)
+arg_parser.add_argument("model_path", type=pathlib.Path, help="A train_model.py output")
+arg_parser.add_argument(
+    "out_path",
+    type=pathlib.Path,
+    help="The destination; e.g., model-linear-all_features-project_only.quantized.joblib",
+)
+arg_parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=0.01,
+    help="Maximum absolute change of any per-class Spearman correlation.",
+)
+arg_parser.add_argument(
+    "--features_out",
+    type=pathlib.Path,
+    default=None,
+    help="If given, also write the compact featurized covered mutants here.",
+)
+
+# Rows transformed at a time when building a CompactDesignMatrix from a DataFrame.
+_TRANSFORM_CHUNK_ROWS = 20000
+
+
+def _csr_columns(X: sparse.csr_matrix, columns: np.ndarray, index_dtype):
+    """Returns the (indptr, indices, data) of X[:, columns], without zeros.
+
+    The indices are the columns' indices in X.
+    """
+    part = X[:, columns]
+    part.eliminate_zeros()
+    return (
+        part.indptr.astype(np.int64),
+        columns[part.indices].astype(index_dtype),
+        part.data,
+    )
+
+
+def _concatenate_indptrs(indptrs: Sequence[np.ndarray]) -> np.ndarray:
+    offsets = np.cumsum([0] + [indptr[-1] for indptr in indptrs[:-1]])
+    return np.concatenate(
+        [indptrs[0][:1]] + [indptr[1:] + o for indptr, o in zip(indptrs, offsets)]
+    )
+
+
+class CompactDesignMatrix:
+    """A featurized design matrix with index-only one-hot blocks.
+
+    One-hot columns are kept as the `indices`/`indptr` of a CSR matrix whose
+    values are implicitly 1. Hashed columns (--data hashed) are kept as a CSR
+    matrix with int8 values. Numeric columns are kept densely as float16.
+    """
+
+    def __init__(
+        self,
+        shape,
+        onehot_indptr: np.ndarray,
+        onehot_indices: np.ndarray,
+        hashed_indptr: np.ndarray,
+        hashed_indices: np.ndarray,
+        hashed_values: np.ndarray,
+        numeric_columns: np.ndarray,
+        numeric_values: np.ndarray,
+    ):
+        self.shape = tuple(shape)
+        self.onehot_indptr = onehot_indptr
+        self.onehot_indices = onehot_indices
+        self.hashed_indptr = hashed_indptr
+        self.hashed_indices = hashed_indices
+        self.hashed_values = hashed_values
+        self.numeric_columns = numeric_columns
+        self.numeric_values = numeric_values
+
+    @classmethod
+    def from_matrix(cls, X, blocks: Sequence[FeatureBlock]) -> "CompactDesignMatrix":
+        if blocks[-1].stop != X.shape[1]:
+            raise ValueError(
+                f"Blocks cover {blocks[-1].stop} columns, but X has {X.shape[1]}"
+            )
+        kinds = np.empty(X.shape[1], dtype=object)
+        for b in blocks:
+            kinds[b.start : b.stop] = b.kind
+        numeric_columns = np.flatnonzero(kinds == "numeric")
+
+        X = sparse.csr_matrix(X)
+        index_dtype = np.uint16 if X.shape[1] <= np.iinfo(np.uint16).max else np.int32
+        onehot_indptr, onehot_indices, onehot_values = _csr_columns(
+            X, np.flatnonzero(kinds == "onehot"), index_dtype
+        )
+        if not np.all(onehot_values == 1):
+            raise ValueError("One-hot blocks must only contain zeros and ones")
+        hashed_indptr, hashed_indices, hashed_values = _csr_columns(
+            X, np.flatnonzero(kinds == "hashed"), index_dtype
+        )
+        int8 = np.iinfo(np.int8)
+        if not np.all(
+            (hashed_values == np.rint(hashed_values))
+            & (hashed_values >= int8.min)
+            & (hashed_values <= int8.max)
+        ):
+            raise ValueError("Hashed blocks must only contain int8 values")
+        return cls(
+            X.shape,
+            onehot_indptr,
+            onehot_indices,
+            hashed_indptr,
+            hashed_indices,
+            hashed_values.astype(np.int8),
+            numeric_columns,
+            X[:, numeric_columns].toarray().astype(np.float16),
+        )
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, mapper) -> "CompactDesignMatrix":
+        """Transforms `df` with `mapper` in chunks, never holding it all densely."""
+        blocks = mapper_blocks(mapper)
+        parts = [
+            cls.from_matrix(mapper.transform(df.iloc[i : i + _TRANSFORM_CHUNK_ROWS]), blocks)
+            for i in range(0, len(df), _TRANSFORM_CHUNK_ROWS)
+        ]
+        return cls.concatenate(parts)
+
+    @classmethod
+    def concatenate(cls, parts: Sequence["CompactDesignMatrix"]) -> "CompactDesignMatrix":
+        if not parts:
+            raise ValueError("Expected at least one part")
+        return cls(
+            (sum(p.shape[0] for p in parts), parts[0].shape[1]),
+            _concatenate_indptrs([p.onehot_indptr for p in parts]),
+            np.concatenate([p.onehot_indices for p in parts]),
+            _concatenate_indptrs([p.hashed_indptr for p in parts]),
+            np.concatenate([p.hashed_indices for p in parts]),
+            np.concatenate([p.hashed_values for p in parts]),
+            parts[0].numeric_columns,
+            np.concatenate([p.numeric_values for p in parts]),
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            self.onehot_indptr.nbytes
+            + self.onehot_indices.nbytes
+            + self.hashed_indptr.nbytes
+            + self.hashed_indices.nbytes
+            + self.hashed_values.nbytes
+            + self.numeric_columns.nbytes
+            + self.numeric_values.nbytes
+        )
+
+    def to_csr(self, rows=None, dtype=np.float32) -> sparse.csr_matrix:
+        """Materializes (a row selection of) the matrix as a CSR matrix."""
+        onehot = sparse.csr_matrix(
+            (
+                np.ones(len(self.onehot_indices), dtype=dtype),
+                self.onehot_indices.astype(np.int32),
+                self.onehot_indptr,
+            ),
+            shape=self.shape,
+        )
+        hashed = sparse.csr_matrix(
+            (
+                self.hashed_values.astype(dtype),
+                self.hashed_indices.astype(np.int32),
+                self.hashed_indptr,
+            ),
+            shape=self.shape,
+        )
+        numeric_values = self.numeric_values
+        if rows is not None:
+            onehot = onehot[rows]
+            hashed = hashed[rows]
+            numeric_values = numeric_values[rows]
+        r, c = np.nonzero(numeric_values)
+        numeric = sparse.csr_matrix(
+            (numeric_values[r, c].astype(dtype), (r, self.numeric_columns[c])),
+            shape=(onehot.shape[0], self.shape[1]),
+        )
+        return (onehot + hashed + numeric).tocsr()
+
+
+class QuantizedRidge:
+    """A fitted Ridge model with int8 coefficients and per-block scales."""
+
+    def __init__(self, model: Ridge, blocks: Sequence[FeatureBlock]):
+        coef = np.atleast_2d(model.coef_)
+        self._single_output = np.ndim(model.coef_) == 1
+        self.block_bounds = np.array([b.start for b in blocks] + [blocks[-1].stop])
+        if self.block_bounds[-1] != coef.shape[1]:
+            raise ValueError("Blocks do not match the model's coefficients")
+        widths = np.diff(self.block_bounds)
+
+        max_abs = np.maximum.reduceat(np.abs(coef), self.block_bounds[:-1], axis=1)
+        self.scales = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        self.coef_q = np.rint(coef / np.repeat(self.scales, widths, axis=1)).astype(
+            np.int8
+        )
+        self.intercept_ = model.intercept_
+        self.n_features_in_ = coef.shape[1]
+        self.guardrail: Optional[dict] = None
+
+    @property
+    def coef_(self) -> np.ndarray:
+        widths = np.diff(self.block_bounds)
+        coef = self.coef_q * np.repeat(self.scales, widths, axis=1)
+        return coef[0] if self._single_output else coef
+
+    def predict(self, X) -> np.ndarray:
+        return X @ self.coef_.T + self.intercept_
+
+
+def _spearman_changes(cm_df, mapper, fold, quantized_model) -> pd.Series:
+    """Per-class absolute Spearman changes for a single fold."""
+    key, model = fold
+    before, _ = model_eval.create_predictions(cm_df, mapper, [(key, model)])
+    after, _ = model_eval.create_predictions(cm_df, mapper, [(key, quantized_model)])
+    diff = (after.spearmans - before.spearmans).abs()
+    # Undefined correlations are fine if both are undefined, and failures otherwise.
+    both_nan = before.spearmans.isna() & after.spearmans.isna()
+    return diff.where(~both_nan, 0.0).fillna(np.inf)
+
+
+def quantize_results(
+    cm_df: pd.DataFrame, mapper, results: Iterable, tolerance: float
+) -> list:
+    """Quantizes each fold's Ridge model, keeping float32 ones that fail the guardrail.
+
+    Ridge models wrapped in a `MultiTargetModel` are quantized (and rewrapped)
+    as well.
+    """
+    blocks = mapper_blocks(mapper)
+    quantized = []
+    for key, model in results:
+        inner = multi_target.unwrap(model)
+        if not isinstance(inner, Ridge):
+            quantized.append((key, model))
+            continue
+        q_model = QuantizedRidge(inner, blocks)
+        if isinstance(model, multi_target.MultiTargetModel):
+            q_model = multi_target.MultiTargetModel(q_model, model.targets)
+        changes = _spearman_changes(cm_df, mapper, (key, model), q_model)
+        guardrail = {
+            "metric": "spearmans",
+            "tolerance": tolerance,
+            "maxAbsChange": float(changes.max()) if len(changes) else 0.0,
+            "classesChecked": int(len(changes)),
+            "passed": bool((changes <= tolerance).all()),
+        }
+        multi_target.unwrap(q_model).guardrail = guardrail
+        if guardrail["passed"]:
+            quantized.append((key, q_model))
+        else:
+            print(
+                f"Keeping float32 model for {key}: Spearman changed by "
+                f"{guardrail['maxAbsChange']:.4f}",
+                file=sys.stderr,
+            )
+            quantized.append((key, model))
+    return quantized
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    cm_df = model_eval.read_cm_df(args.results_dir)
+    with open(args.model_path, "rb") as fo:
+        mapper, results = joblib.load(fo)
+
+    # Use the importable module, not __main__, so that pickled models can be
+    # loaded by model_eval.py.
+    import quantize
+
+    quantized = quantize.quantize_results(cm_df, mapper, results, args.tolerance)
+    is_quantized = [
+        isinstance(multi_target.unwrap(m), quantize.QuantizedRidge)
+        for _, m in quantized
+    ]
+    print(f"Quantized {sum(is_quantized)} of {len(quantized)} models")
+    skipped = [
+        key
+        for (key, m), q in zip(quantized, is_quantized)
+        if not q and not isinstance(multi_target.unwrap(m), Ridge)
+    ]
+    if skipped:
+        print(
+            f"Skipped {len(skipped)} models that are not Ridge models", file=sys.stderr
+        )
+    print(f"Writing to: {args.out_path}")
+    joblib.dump((mapper, quantized), args.out_path)
+
+    if args.features_out is not None:
+        X = quantize.CompactDesignMatrix.from_frame(cm_df, mapper)
+        print(f"Writing {X.nbytes:,} bytes of features to: {args.features_out}")
+        joblib.dump(X, args.features_out)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""Compiles fitted random forests into flat arrays for batched inference.
+
+`model_eval.py` evaluates one forest per fold (one per held-out class or
+project). The forests trained by `train_model.py` are tiny (`max_depth=3`,
+`n_estimators=10`), so calling `RandomForestRegressor.predict` once per fold
+is dominated by per-call overhead rather than by tree traversal. This module
+flattens the trees of all folds into contiguous NumPy arrays and evaluates
+every tree of every fold over the design matrix in a few vectorized passes.
+
+Predictions are bit-for-bit identical to sklearn's: inputs are cast to
+float32 and compared against the float64 thresholds exactly as sklearn's tree
+code does, and tree outputs are accumulated in estimator order before the
+final division by the number of trees.
+"""
+
+from typing import Optional, Sequence
+
+import numpy as np
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+
+# Rows are evaluated in chunks of this size to bound the (rows x trees) node
+# index matrices.
+_CHUNK_ROWS = 1 << 16
+
+
+class CompiledForests:
+    """A set of random forests flattened into shared node arrays.
+
+    Forest `i` of the constructor argument is selected per row by passing `i`
+    in `forest_ids` to `predict`. Leaves point to themselves, so every row
+    can be pushed down `max_depth` levels without per-row control flow.
+    """
+
+    def __init__(self, forests: Sequence[RandomForestRegressor]):
+        if not forests:
+            raise ValueError("Expected at least one forest")
+
+        n_features = {f.n_features_in_ for f in forests}
+        n_outputs = {f.n_outputs_ for f in forests}
+        if len(n_features) != 1 or len(n_outputs) != 1:
+            raise ValueError("All forests must share input and output widths")
+        self.n_features_in_ = n_features.pop()
+        self.n_outputs_ = n_outputs.pop()
+
+        trees = [[e.tree_ for e in f.estimators_] for f in forests]
+        max_trees = max(len(ts) for ts in trees)
+
+        # Node 0 is a shared dummy leaf (value 0) used to pad forests with
+        # fewer trees; adding 0.0 leaves the accumulated sum unchanged.
+        features = [np.zeros(1, dtype=np.int64)]
+        thresholds = [np.zeros(1, dtype=np.float64)]
+        lefts = [np.zeros(1, dtype=np.int64)]
+        rights = [np.zeros(1, dtype=np.int64)]
+        missing_left = [np.zeros(1, dtype=bool)]
+        values = [np.zeros((1, self.n_outputs_), dtype=np.float64)]
+        roots = np.zeros((len(forests), max_trees), dtype=np.int64)
+        offset = 1
+        max_depth = 0
+        for forest_idx, forest_trees in enumerate(trees):
+            for tree_idx, tree in enumerate(forest_trees):
+                n = tree.node_count
+                is_leaf = tree.children_left == -1
+                own = np.arange(offset, offset + n, dtype=np.int64)
+                features.append(np.where(is_leaf, 0, tree.feature).astype(np.int64))
+                thresholds.append(tree.threshold.astype(np.float64))
+                lefts.append(np.where(is_leaf, own, tree.children_left + offset))
+                rights.append(np.where(is_leaf, own, tree.children_right + offset))
+                mgl = getattr(tree, "missing_go_to_left", None)
+                missing_left.append(
+                    np.zeros(n, dtype=bool) if mgl is None else mgl.astype(bool)
+                )
+                values.append(tree.value[:, :, 0].astype(np.float64))
+                roots[forest_idx, tree_idx] = offset
+                offset += n
+                max_depth = max(max_depth, tree.max_depth)
+
+        feature = np.concatenate(features)
+
+        # Only the columns used by some split need to be materialized; remap
+        # split features to indices into that (small) set of columns.
+        self.columns = np.unique(feature[np.concatenate(lefts) != np.arange(offset)])
+        local = np.zeros(self.n_features_in_, dtype=np.int64)
+        local[self.columns] = np.arange(len(self.columns))
+        self.feature = local[feature]
+        self.threshold = np.concatenate(thresholds)
+        self.left = np.concatenate(lefts)
+        self.right = np.concatenate(rights)
+        self.missing_left = np.concatenate(missing_left)
+        self.value = np.concatenate(values)
+        self.roots = roots
+        self.n_trees = np.array([len(ts) for ts in trees], dtype=np.float64)
+        self.max_depth = max_depth
+
+    def gather(self, X) -> np.ndarray:
+        """Returns the columns of X used by any split, as a dense float32 array.
+
+        X may be dense or sparse. Gathered blocks of several design matrices
+        can be concatenated and evaluated with a single `predict_gathered`.
+        """
+        if X.shape[1] != self.n_features_in_:
+            raise ValueError(
+                f"X has {X.shape[1]} features, expected {self.n_features_in_}"
+            )
+        if sparse.issparse(X):
+            return sparse.csc_matrix(X, dtype=np.float32)[:, self.columns].toarray()
+        return np.asarray(X, dtype=np.float32)[:, self.columns]
+
+    def predict_gathered(
+        self, X_used: np.ndarray, forest_ids: np.ndarray
+    ) -> np.ndarray:
+        """Predicts each row of `X_used` with the forest given in `forest_ids`."""
+        forest_ids = np.asarray(forest_ids, dtype=np.int64)
+        if forest_ids.shape != (X_used.shape[0],):
+            raise ValueError("Expected one forest id per row")
+        out = np.empty((X_used.shape[0], self.n_outputs_), dtype=np.float64)
+        has_nan = bool(np.isnan(X_used).any())
+        for start in range(0, X_used.shape[0], _CHUNK_ROWS):
+            stop = start + _CHUNK_ROWS
+            out[start:stop] = self._predict_chunk(
+                X_used[start:stop], forest_ids[start:stop], has_nan
+            )
+        if self.n_outputs_ == 1:
+            return out[:, 0]
+        return out
+
+    def predict(self, X, forest_ids: np.ndarray) -> np.ndarray:
+        return self.predict_gathered(self.gather(X), forest_ids)
+
+    def _predict_chunk(
+        self, X_used: np.ndarray, forest_ids: np.ndarray, has_nan: bool
+    ) -> np.ndarray:
+        rows = np.arange(X_used.shape[0])[:, np.newaxis]
+        node = self.roots[forest_ids]
+        for _ in range(self.max_depth):
+            x = X_used[rows, self.feature[node]]
+            go_left = x <= self.threshold[node]
+            if has_nan:
+                go_left |= np.isnan(x) & self.missing_left[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+
+        # Accumulate in estimator order, as RandomForestRegressor.predict does.
+        acc = np.zeros((X_used.shape[0], self.n_outputs_), dtype=np.float64)
+        for tree_idx in range(node.shape[1]):
+            acc += self.value[node[:, tree_idx]]
+        acc /= self.n_trees[forest_ids][:, np.newaxis]
+        return acc
+
+
+def compile_forests(models: Sequence) -> Optional[CompiledForests]:
+    """Compiles `models` if all are random forests; otherwise returns None."""
+    if not models or not all(isinstance(m, RandomForestRegressor) for m in models):
+        return None
+    return CompiledForests(models)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Splits train_model.py's folds into shards and merges the shards' outputs.
+
+With `--shard INDEX/COUNT`, train_model.py fits only the folds of one shard
+and writes a partial artifact instead of the usual (mapper, results) file.
+Every shard reads all data and fits the mapper on it, so the shards' mappers
+are identical; `shards.py merge` checks that (by content hash), checks that
+the partials are exactly the shards 0, ..., COUNT - 1 of one partition, and
+writes the (mapper, results) file an unsharded run would have written, with
+the results in the same order.
+
+Folds are assigned to shards deterministically: largest first (by the
+number of nonzeros in their training data, ties broken by fold key), each to
+the shard with the least work so far. Since all shards see the same data,
+they compute the same assignment without coordinating. For example, to
+train on three machines (or in three local processes):
+
+    train_model.py --shard 0/3 --out part0.joblib ...
+    train_model.py --shard 1/3 --out part1.joblib ...
+    train_model.py --shard 2/3 --out part2.joblib ...
+    shards.py merge model.joblib part0.joblib part1.joblib part2.joblib
+
+Run `shards.py --help` for more information.
+"""
+
+import argparse
+import heapq
+import pathlib
+import sys
+from typing import Any, Dict, Hashable, List, Sequence, Tuple
+
+import joblib
+
+# Bump when the partial artifact format changes.
+PARTIAL_VERSION = 1
+
+arg_parser = argparse.ArgumentParser(description="Merge sharded train_model.py runs.")
+subparsers = arg_parser.add_subparsers(dest="command", required=True)
+merge_parser = subparsers.add_parser(
+    "merge", help="Merge partial artifacts into a (mapper, results) file."
+)
+merge_parser.add_argument("out", type=pathlib.Path)
+merge_parser.add_argument("partials", type=pathlib.Path, nargs="+")
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parses INDEX/COUNT (0 <= INDEX < COUNT)."""
+    index, sep, count = spec.partition("/")
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected INDEX/COUNT, got {spec!r}")
+    if not sep or not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"expected 0 <= INDEX < COUNT, got {spec!r}")
+    return index, count
+
+
+def assign(keys: Sequence[Hashable], costs: Sequence[float], count: int) -> List[int]:
+    """Returns the shard of each fold (longest processing time first)."""
+    order = sorted(range(len(keys)), key=lambda i: (-costs[i], repr(keys[i])))
+    loads = [(0.0, shard) for shard in range(count)]
+    shards = [0] * len(keys)
+    for i in order:
+        load, shard = heapq.heappop(loads)
+        shards[i] = shard
+        heapq.heappush(loads, (load + costs[i], shard))
+    return shards
+
+
+def write_partial(
+    path: str,
+    shard: Tuple[int, int],
+    fold_keys: List[Hashable],
+    mapper: Any,
+    results: List[Any],
+) -> None:
+    """Writes the results of one shard.
+
+    Args:
+        shard: (INDEX, COUNT).
+        fold_keys: The keys of all folds (of all shards), in output order.
+        results: The shard's results, in the order of its folds in fold_keys.
+    """
+    joblib.dump(
+        {
+            "version": PARTIAL_VERSION,
+            "shard": tuple(shard),
+            "fold_keys": list(fold_keys),
+            "mapper_hash": joblib.hash(mapper),
+            "mapper": mapper,
+            "results": results,
+        },
+        path,
+    )
+
+
+def fold_key(project_id: str, selection_key: Dict[str, str]) -> Hashable:
+    """The key of a fold, e.g., ("Lang", (("class", "org.Foo"),))."""
+    return (project_id, tuple(selection_key.items()))
+
+
+def _result_fold_key(result) -> Hashable:
+    # results are ((project_id, bug_id, selection_key), model).
+    (project_id, _, selection_key), _ = result
+    return fold_key(project_id, selection_key)
+
+
+def merge(partials: List[Dict[str, Any]]) -> Tuple[Any, List[Any]]:
+    """Combines the partials of all shards into (mapper, results)."""
+    if not partials:
+        raise ValueError("No partial artifacts")
+    for p in partials:
+        if p.get("version") != PARTIAL_VERSION:
+            raise ValueError(f"Unsupported partial version: {p.get('version')}")
+    first = partials[0]
+    count = first["shard"][1]
+    indices = sorted(p["shard"][0] for p in partials)
+    if any(p["shard"][1] != count for p in partials) or indices != list(range(count)):
+        shards = sorted(p["shard"] for p in partials)
+        raise ValueError(f"Expected shards 0..{count - 1} of {count}, got {shards}")
+    for p in partials[1:]:
+        if p["fold_keys"] != first["fold_keys"]:
+            raise ValueError(f"Shard {p['shard'][0]} was run on different folds")
+        if p["mapper_hash"] != first["mapper_hash"]:
+            raise ValueError(f"Shard {p['shard'][0]} fitted a different mapper")
+
+    by_key = {}
+    for p in partials:
+        for result in p["results"]:
+            key = _result_fold_key(result)
+            if key in by_key:
+                raise ValueError(f"Fold {key} is in more than one shard")
+            by_key[key] = result
+    missing = [key for key in first["fold_keys"] if key not in by_key]
+    if missing or len(by_key) != len(first["fold_keys"]):
+        raise ValueError(f"Missing folds: {missing}")
+    return first["mapper"], [by_key[key] for key in first["fold_keys"]]
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    partials = [joblib.load(path) for path in args.partials]
+    mapper, results = merge(partials)
+    joblib.dump((mapper, results), args.out)
+    print(f"Merged {len(results)} models from {len(partials)} shards into {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+"""Ridge solver backends, chosen per fold by the shape of its training data.
+
+train_model.py used to fit every linear model with Ridge(solver="sparse_cg")
+on CSC input, whatever the fold's size. `BackendRidge` is a Ridge whose `fit`
+runs one of several backends (BACKENDS) that all solve the same problem,
+ridge regression with an intercept:
+
+* "cg_csc", "cg_csr": sklearn's sparse_cg on CSC (the previous default) or
+  CSR input;
+* "lsqr": sklearn's lsqr;
+* "cholesky": a Cholesky factorization of the centered normal equations (or,
+  for folds with fewer rows than columns, of the centered kernel matrix),
+  built with sparse products; and
+* "dense": the same, from a dense copy of the training data.
+
+The direct backends are only feasible for folds with few rows or columns.
+With backend="auto", the backend is picked by a per-machine calibration: all
+backends are timed on synthetic one-hot data of several shapes, and a cost
+model log(time) ~ log(rows) + log(columns) + log(nonzeros) is fit per
+backend by least squares. The calibration is stored in a JSON file
+(CALIBRATION_FILE, or $LINEAR_SOLVER_CALIBRATION) and is redone when the
+host or the library versions change. Without a calibration, "auto" uses
+DEFAULT_BACKEND.
+
+The iterative backends stop at a relative residual of `tol` (the sparse_cg
+default of 1e-4; the fold matrices are float32, so sparse_cg gets no closer
+to the exact solution at smaller values). `solvers.py check` fits all
+backends on the same synthetic data and checks that their coefficients agree
+within a tolerance.
+
+Run `solvers.py --help` for more information.
+"""
+
+import argparse
+import json
+import os
+import pathlib
+import platform
+import sys
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import numpy as np
+import scipy
+import scipy.linalg
+import sklearn
+from scipy import sparse
+from sklearn.linear_model import Ridge
+
+# Bump when the calibration problems or the cost model change.
+CALIBRATION_VERSION = 1
+CALIBRATION_FILE = pathlib.Path(
+    os.getenv(
+        "LINEAR_SOLVER_CALIBRATION",
+        pathlib.Path.home() / ".cache" / "mutant_prioritization" / "solvers.json",
+    )
+)
+
+DEFAULT_BACKEND = "cg_csc"
+DEFAULT_TOL = 1e-4
+
+# Size limits of the direct backends: the Gram (or kernel) matrix has at most
+# _MAX_GRAM rows, and the dense copy of the data at most _MAX_DENSE elements.
+_MAX_GRAM = 8192
+_MAX_DENSE = 1 << 24
+
+# The calibration problems: all rows x columns combinations, with the
+# nonzeros per row alternating between the values of _CALIBRATION_ROW_NNZ.
+_CALIBRATION_ROWS = [2000, 20000, 100000]
+_CALIBRATION_COLUMNS = [64, 512, 4096]
+_CALIBRATION_ROW_NNZ = [8, 32]
+
+# A solver takes (X, Y, alpha, tol), with Y of shape (rows, targets), and
+# returns (coef, intercept) of shapes (targets, columns) and (targets,).
+Solver = Callable[..., Tuple[np.ndarray, np.ndarray]]
+
+
+def _centered_targets(X, Y: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Returns the column means of X and Y, and Y minus its means."""
+    x_mean = np.asarray(X.mean(axis=0), dtype=np.float64).ravel()
+    y_mean = Y.mean(axis=0)
+    return x_mean, y_mean, Y - y_mean
+
+
+def _cholesky_solve(gram: np.ndarray, rhs: np.ndarray, alpha: float) -> np.ndarray:
+    """Solves (gram + alpha I) x = rhs, overwriting gram."""
+    gram[np.diag_indices_from(gram)] += alpha
+    factor = scipy.linalg.cho_factor(gram, overwrite_a=True, check_finite=False)
+    return scipy.linalg.cho_solve(factor, rhs, check_finite=False)
+
+
+def _solve_centered(X, Y: np.ndarray, alpha: float, gram_fn, kernel_fn):
+    """Solves ridge regression with an intercept from centered Gram products.
+
+    gram_fn(x_mean) and kernel_fn(x_mean) return the centered X'X and XX'.
+    """
+    n, p = X.shape
+    x_mean, y_mean, Y_c = _centered_targets(X, Y)
+    if p <= n:
+        # (X - 1m')'Y_c = X'Y_c, since the columns of Y_c sum to 0.
+        coef = _cholesky_solve(gram_fn(x_mean), X.T @ Y_c, alpha)
+    else:
+        dual = _cholesky_solve(kernel_fn(x_mean), Y_c, alpha)
+        coef = X.T @ dual - np.outer(x_mean, dual.sum(axis=0))
+    coef = np.asarray(coef).T
+    return coef, y_mean - coef @ x_mean
+
+
+def _fit_cholesky(X, Y: np.ndarray, alpha: float, tol: float):
+    X = sparse.csr_matrix(X, dtype=np.float64)
+    n = X.shape[0]
+
+    def gram(x_mean):
+        # (X - 1m')'(X - 1m') = X'X - n mm'
+        return (X.T @ X).toarray() - n * np.outer(x_mean, x_mean)
+
+    def kernel(x_mean):
+        # (X - 1m')(X - 1m')' = XX' - Xm 1' - 1 (Xm)' + m'm
+        Xm = X @ x_mean
+        return (X @ X.T).toarray() - Xm[:, None] - Xm[None, :] + x_mean @ x_mean
+
+    return _solve_centered(X, Y, alpha, gram, kernel)
+
+
+def _fit_dense(X, Y: np.ndarray, alpha: float, tol: float):
+    X = X.toarray() if sparse.issparse(X) else np.asarray(X)
+    X = X.astype(np.float64)
+    X_c = X - X.mean(axis=0)
+    return _solve_centered(
+        X, Y, alpha, lambda x_mean: X_c.T @ X_c, lambda x_mean: X_c @ X_c.T
+    )
+
+
+def _sklearn_solver(
+    solver: str, format: Optional[str], tol_scale: float = 1.0
+) -> Solver:
+    def fit(X, Y: np.ndarray, alpha: float, tol: float):
+        if format is not None:
+            X = X.asformat(format)
+        tol *= tol_scale
+        model = Ridge(alpha=alpha, solver=solver, tol=tol, copy_X=False).fit(X, Y)
+        return model.coef_, model.intercept_
+
+    return fit
+
+
+def _any_shape(rows: int, columns: int, nnz: int) -> bool:
+    return True
+
+
+def _small_gram(rows: int, columns: int, nnz: int) -> bool:
+    return min(rows, columns) <= _MAX_GRAM
+
+
+def _small_dense(rows: int, columns: int, nnz: int) -> bool:
+    return _small_gram(rows, columns, nnz) and rows * columns <= _MAX_DENSE
+
+
+class Backend(NamedTuple):
+    fit: Solver
+    # Whether the backend can fit data of a shape (rows, columns, nonzeros).
+    feasible: Callable[[int, int, int], bool]
+
+
+BACKENDS: Dict[str, Backend] = {
+    "cg_csc": Backend(_sklearn_solver("sparse_cg", "csc"), _any_shape),
+    "cg_csr": Backend(_sklearn_solver("sparse_cg", "csr"), _any_shape),
+    # lsqr stops on different residual norms than sparse_cg; at tol / 100 its
+    # coefficients are about as close to the exact solution.
+    "lsqr": Backend(_sklearn_solver("lsqr", None, tol_scale=0.01), _any_shape),
+    "cholesky": Backend(_fit_cholesky, _small_gram),
+    "dense": Backend(_fit_dense, _small_dense),
+}
+BACKEND_CHOICES = ["auto"] + list(BACKENDS)
+
+
+def _machine() -> Dict[str, object]:
+    """The properties that a calibration is valid for."""
+    return {
+        "version": CALIBRATION_VERSION,
+        "host": platform.node(),
+        "cpus": os.cpu_count(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "sklearn": sklearn.__version__,
+    }
+
+
+def _cost_features(rows: int, columns: int, nnz: int) -> np.ndarray:
+    return np.array([1.0, np.log(rows), np.log(columns), np.log(max(nnz, 1))])
+
+
+def synthetic_problem(
+    rows: int, columns: int, row_nnz: int, seed: int = 0
+) -> Tuple[sparse.csc_matrix, np.ndarray]:
+    """Returns one-hot-like data (CSC, float32, as in train_model.py) and labels.
+
+    Each row has up to `row_nnz` ones, in columns drawn with Zipf-like
+    frequencies (like one-hot encoded categorical features).
+    """
+    rng = np.random.default_rng(seed)
+    row_nnz = min(row_nnz, columns)
+    weights = 1.0 / np.arange(1, columns + 1)
+    cols = rng.choice(columns, size=rows * row_nnz, p=weights / weights.sum())
+    X = sparse.csr_matrix(
+        (np.ones(len(cols), dtype=np.float32), (np.arange(len(cols)) // row_nnz, cols)),
+        shape=(rows, columns),
+    )
+    X.data[:] = 1.0  # Duplicates were summed.
+    y = 1 / (1 + np.exp(-(X @ rng.normal(0, 0.3, columns) + rng.normal(0, 0.5, rows))))
+    return X.tocsc(), y
+
+
+def calibrate(verbose: bool = True) -> Dict[str, object]:
+    """Times all feasible backends on the calibration problems."""
+    timings = []
+    for i, rows in enumerate(_CALIBRATION_ROWS):
+        for j, columns in enumerate(_CALIBRATION_COLUMNS):
+            row_nnz = _CALIBRATION_ROW_NNZ[(i + j) % len(_CALIBRATION_ROW_NNZ)]
+            X, y = synthetic_problem(rows, columns, row_nnz)
+            for name, backend in BACKENDS.items():
+                if not backend.feasible(rows, columns, X.nnz):
+                    continue
+                start = time.perf_counter()
+                backend.fit(X, y[:, None], 1.0, DEFAULT_TOL)
+                seconds = time.perf_counter() - start
+                timings.append(
+                    {
+                        "backend": name,
+                        "rows": rows,
+                        "columns": columns,
+                        "nnz": int(X.nnz),
+                        "seconds": seconds,
+                    }
+                )
+                if verbose:
+                    print(
+                        f"{name:>8}: {rows:>6} x {columns:<5} ({X.nnz} nonzeros): "
+                        f"{seconds:.3f}s",
+                        flush=True,
+                    )
+    return {"machine": _machine(), "timings": timings}
+
+
+def cost_models(calibration: Dict[str, object]) -> Dict[str, np.ndarray]:
+    """Fits the log-time cost model of each backend to the calibration timings."""
+    models = {}
+    for name in BACKENDS:
+        points = [t for t in calibration["timings"] if t["backend"] == name]
+        if not points:
+            continue
+        A = np.array(
+            [_cost_features(t["rows"], t["columns"], t["nnz"]) for t in points]
+        )
+        b = np.log([max(t["seconds"], 1e-6) for t in points])
+        models[name] = np.linalg.lstsq(A, b, rcond=None)[0]
+    return models
+
+
+def load_calibration(
+    path: pathlib.Path = CALIBRATION_FILE, create: bool = False
+) -> Optional[Dict[str, object]]:
+    """Reads a calibration that is valid for this machine.
+
+    If there is none and `create` is set, calibrates and writes the file.
+    """
+    try:
+        with open(path) as fo:
+            calibration = json.load(fo)
+        if calibration.get("machine") == _machine():
+            return calibration
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    if not create:
+        return None
+    print(f"Calibrating the linear solver backends (once per machine): {path}")
+    calibration = calibrate()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+    with open(tmp_path, "w") as fo:
+        json.dump(calibration, fo, indent=1)
+    os.replace(tmp_path, path)
+    return calibration
+
+
+_cost_model_cache: Dict[str, Optional[Dict[str, np.ndarray]]] = {}
+
+
+def _cached_cost_models(path: pathlib.Path) -> Optional[Dict[str, np.ndarray]]:
+    key = str(path)
+    if key not in _cost_model_cache:
+        calibration = load_calibration(path)
+        models = None if calibration is None else cost_models(calibration)
+        _cost_model_cache[key] = models
+    return _cost_model_cache[key]
+
+
+def select_backend(
+    rows: int, columns: int, nnz: int, path: pathlib.Path = CALIBRATION_FILE
+) -> str:
+    """Returns the backend with the lowest predicted time for a fold's shape."""
+    models = _cached_cost_models(path)
+    if not models:
+        return DEFAULT_BACKEND
+    features = _cost_features(rows, columns, nnz)
+    costs = {
+        name: float(features @ theta)
+        for name, theta in models.items()
+        if BACKENDS[name].feasible(rows, columns, nnz)
+    }
+    return min(costs, key=costs.get) if costs else DEFAULT_BACKEND
+
+
+class BackendRidge(Ridge):
+    """A Ridge model (with an intercept) fit by one of BACKENDS.
+
+    `backend` is a name in BACKEND_CHOICES; after fitting, `backend_` is the
+    backend that was used.
+    """
+
+    def __init__(
+        self,
+        alpha: float = 1.0,
+        *,
+        backend: str = "auto",
+        tol: float = DEFAULT_TOL,
+        calibration_file: pathlib.Path = CALIBRATION_FILE,
+    ):
+        super().__init__(alpha=alpha, tol=tol, copy_X=False)
+        self.backend = backend
+        self.calibration_file = calibration_file
+
+    def fit(self, X, y, sample_weight=None):
+        if sample_weight is not None:
+            raise ValueError("BackendRidge does not support sample weights")
+        y = np.asarray(y, dtype=np.float64)
+        n, p = X.shape
+        nnz = X.nnz if sparse.issparse(X) else np.count_nonzero(X)
+        backend = self.backend
+        if backend == "auto":
+            backend = select_backend(n, p, nnz, self.calibration_file)
+        elif not BACKENDS[backend].feasible(n, p, nnz):
+            raise ValueError(f"Backend {backend} cannot fit a {n} x {p} matrix")
+        coef, intercept = BACKENDS[backend].fit(
+            X, y.reshape(n, -1), self.alpha, self.tol
+        )
+        coef = np.asarray(coef, dtype=np.float64).reshape(-1, p)
+        intercept = np.asarray(intercept, dtype=np.float64).ravel()
+        if y.ndim == 1:
+            coef, intercept = coef[0], intercept[0]
+        self.coef_, self.intercept_ = coef, intercept
+        self.n_features_in_ = p
+        self.backend_ = backend
+        return self
+
+
+def check(
+    rows: int, columns: int, row_nnz: int, tolerance: float, seed: int = 0
+) -> bool:
+    """Fits all feasible backends to one synthetic problem; compares coefficients.
+
+    Coefficients must agree with those of the first feasible direct backend
+    within `tolerance` times the largest coefficient.
+    """
+    X, y = synthetic_problem(rows, columns, row_nnz, seed)
+    fitted, seconds = {}, {}
+    for name, backend in BACKENDS.items():
+        if backend.feasible(rows, columns, X.nnz):
+            start = time.perf_counter()
+            fitted[name] = BackendRidge(backend=name).fit(X, y)
+            seconds[name] = time.perf_counter() - start
+    reference = next(
+        (fitted[name] for name in ("dense", "cholesky") if name in fitted),
+        fitted[DEFAULT_BACKEND],
+    )
+    scale = max(np.abs(reference.coef_).max(), 1e-12)
+    ok = True
+    for name, model in fitted.items():
+        coef_diff = np.abs(model.coef_ - reference.coef_).max() / scale
+        intercept_diff = abs(model.intercept_ - reference.intercept_) / scale
+        print(
+            f"{rows} x {columns}: {name:>8}: {seconds[name]:.3f}s, relative "
+            f"difference {coef_diff:.2g} (coefficients), {intercept_diff:.2g} "
+            f"(intercept)"
+        )
+        if max(coef_diff, intercept_diff) > tolerance:
+            print(f"{name} differs by more than {tolerance}", file=sys.stderr)
+            ok = False
+    return ok
+
+
+arg_parser = argparse.ArgumentParser(description="Calibrate or check ridge backends.")
+arg_parser.add_argument(
+    "--calibration_file", type=pathlib.Path, default=CALIBRATION_FILE
+)
+subparsers = arg_parser.add_subparsers(dest="command", required=True)
+calibrate_parser = subparsers.add_parser(
+    "calibrate", help="Time the backends and store the calibration of this machine."
+)
+calibrate_parser.add_argument(
+    "--force", action="store_true", help="Recalibrate even if a calibration exists."
+)
+check_parser = subparsers.add_parser(
+    "check", help="Check that all backends reach the same coefficients."
+)
+check_parser.add_argument(
+    "--shapes",
+    nargs="+",
+    default=["5000x200", "300x2000", "50000x4096"],
+    metavar="ROWSxCOLUMNS",
+)
+check_parser.add_argument("--row_nnz", type=int, default=16)
+check_parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=1e-2,
+    help="The maximum difference to the direct solution, relative to the "
+    "largest coefficient.",
+)
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    if args.command == "calibrate":
+        if args.force and args.calibration_file.exists():
+            args.calibration_file.unlink()
+        calibration = load_calibration(args.calibration_file, create=True)
+        for name, theta in cost_models(calibration).items():
+            print(f"{name:>8}: log(seconds) ~ {np.round(theta, 3).tolist()}")
+        for rows, columns, nnz in [(2000, 13440, 40000), (500000, 13440, 10**7)]:
+            backend = select_backend(rows, columns, nnz, args.calibration_file)
+            print(f"{rows} x {columns} ({nnz} nonzeros): {backend}")
+        return 0
+
+    ok = True
+    for shape in args.shapes:
+        rows, columns = map(int, shape.split("x"))
+        ok = check(rows, columns, args.row_nnz, args.tolerance) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
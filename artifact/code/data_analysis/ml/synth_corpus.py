@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""Generates synthetic customized-mutants.csv corpora for benchmarking.
+
+The corpus has the schema of the data-collection output and is laid out like
+it (<out_dir>/<PID>/<BID>f/customized-mutants.csv), so train_model.py,
+model_eval.py, and benchmark.py read it like the real data. Its size is set by
+the number of projects, classes per project, and mutants per class.
+
+Categorical features take values with Zipf-like frequencies over the
+cardinalities in CARDINALITIES, which add up to the one-hot column counts of
+the real corpus (37 node-type and 13,403 context columns; see
+transformed_dataframe_columns.txt); every value occurs at least once if the
+corpus has enough mutants. The labels depend on a few features plus noise, so
+models have some signal to fit.
+
+Run `synth_corpus.py --help` for more information.
+"""
+
+import argparse
+import pathlib
+import sys
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+import features
+
+# The columns of customized-mutants.csv, in order.
+CM_COLUMNS = [
+    "projectId",
+    "bugId",
+    "methodName",
+    "mutantId",
+    "compositeId",
+    "className",
+    "lineNumber",
+    "testSignature",
+    "mutationOperatorGroup",
+    "mutationOperator",
+    "nodeTypeBasic",
+    "nodeTypeDetailed",
+    "nodeContextBasic",
+    "astContextBasic",
+    "astContextDetailed",
+    "astStmtContextBasic",
+    "astStmtContextDetailed",
+    "parentContextBasic",
+    "parentContextDetailed",
+    "parentStmtContextBasic",
+    "parentStmtContextDetailed",
+    "hasLiteralChild",
+    "hasVariableChild",
+    "hasOperatorChild",
+    "isCovered",
+    "coveringTests",
+    "isKilled",
+    "killingTests",
+    "isTrivial",
+    "trivialityScore",
+    "trivialityTests",
+    "isDominator",
+    "dominatorStrength",
+    "isUnproductive",
+    "isFaultCoupled",
+    "pKillsDom",
+    "expKilledDomNodes",
+    "nestingTotal",
+    "nestingLoop",
+    "nestingIf",
+    "maxNestingInSameMethod",
+    "nestingRatioTotal",
+    "nestingRatioLoop",
+    "nestingRatioIf",
+    "numMutantsInSameMethod",
+    "maxLineNumberInSameMethod",
+    "minLineNumberInSameMethod",
+    "lineRatio",
+]
+
+# Number of distinct values per categorical feature.
+CARDINALITIES = {
+    "nodeTypeBasic": 7,
+    "nodeTypeDetailed": 30,
+    "mutationOperatorGroup": 9,
+    "mutationOperator": 245,
+    "nodeContextBasic": 40,
+    "astContextBasic": 160,
+    "astContextDetailed": 3400,
+    "astStmtContextBasic": 280,
+    "astStmtContextDetailed": 4100,
+    "parentContextBasic": 60,
+    "parentContextDetailed": 1900,
+    "parentStmtContextBasic": 60,
+    "parentStmtContextDetailed": 3149,
+}
+
+# Fraction of mutants with a missing node type or lineRatio.
+_MISSING_RATIO = 0.02
+
+arg_parser = argparse.ArgumentParser(
+    description="Generate a synthetic customized-mutants.csv corpus."
+)
+arg_parser.add_argument("out_dir", type=pathlib.Path)
+arg_parser.add_argument("--projects", type=int, default=4)
+arg_parser.add_argument("--classes", type=int, default=20, help="Classes per project")
+arg_parser.add_argument("--mutants", type=int, default=100, help="Mutants per class")
+arg_parser.add_argument("--seed", type=int, default=0)
+
+
+def _categorical(
+    name: str, n: int, rng: np.random.Generator
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Draws `n` values of a categorical feature; returns (values, codes)."""
+    cardinality = CARDINALITIES[name]
+    weights = 1.0 / np.arange(1, cardinality + 1) ** 1.1
+    codes = rng.choice(cardinality, size=n, p=weights / weights.sum())
+    # Make every value occur, as far as the corpus size allows.
+    k = min(n, cardinality)
+    codes[rng.choice(n, size=k, replace=False)] = rng.permutation(cardinality)[:k]
+    return np.char.add(f"{name}_", codes.astype(str)).astype(object), codes
+
+
+def generate(
+    n_projects: int, n_classes: int, n_mutants: int, seed: int = 0
+) -> Dict[Tuple[str, int], pd.DataFrame]:
+    """Returns a synthetic customized-mutants.csv DataFrame per (PID, BID)."""
+    rng = np.random.default_rng(seed)
+    n = n_projects * n_classes * n_mutants
+    project = np.repeat(np.arange(n_projects), n_classes * n_mutants)
+    klass = np.repeat(np.arange(n_projects * n_classes), n_mutants)
+    method = rng.integers(0, 10, n)
+
+    df = pd.DataFrame(
+        {
+            "projectId": np.char.add("Synth", project.astype(str)).astype(object),
+            "bugId": project + 1,
+            "methodName": np.char.add("m", method.astype(str)).astype(object),
+            "mutantId": np.arange(n) % (n_classes * n_mutants) + 1,
+            "className": np.char.add("org.synth.C", klass.astype(str)).astype(object),
+            "lineNumber": method * 20 + rng.integers(1, 20, n),
+            "testSignature": np.nan,
+        }
+    )
+    df["compositeId"] = df.mutantId
+
+    signal = np.zeros(n)
+    for name in CARDINALITIES:
+        values, codes = _categorical(name, n, rng)
+        df[name] = values
+        # Frequent values of some features shift the labels.
+        if name in ("mutationOperator", "nodeContextBasic", features.SMALL_FEATURES[1]):
+            signal += np.where(codes < 10, (codes % 3) - 1.0, 0.0)
+    for name in features.NODE_TYPE_FEATURES:
+        df.loc[rng.random(n) < _MISSING_RATIO, name] = np.nan
+
+    for name in ["hasLiteralChild", "hasVariableChild", "hasOperatorChild"]:
+        df[name] = rng.integers(0, 2, n)
+    df["nestingIf"] = rng.poisson(1.0, n)
+    df["nestingLoop"] = rng.poisson(0.5, n)
+    df["nestingTotal"] = df.nestingIf + df.nestingLoop + rng.poisson(0.3, n)
+    df["maxNestingInSameMethod"] = df.nestingTotal + rng.poisson(1.0, n)
+    denominator = df.maxNestingInSameMethod.clip(lower=1)
+    df["nestingRatioTotal"] = df.nestingTotal / denominator
+    df["nestingRatioLoop"] = df.nestingLoop / denominator
+    df["nestingRatioIf"] = df.nestingIf / denominator
+    df["numMutantsInSameMethod"] = rng.integers(1, 50, n)
+    df["minLineNumberInSameMethod"] = method * 20 + 1
+    df["maxLineNumberInSameMethod"] = method * 20 + 20
+    df["lineRatio"] = (df.lineNumber - df.minLineNumberInSameMethod) / 19
+    df.loc[rng.random(n) < _MISSING_RATIO, "lineRatio"] = np.nan
+    signal += 0.5 * df.hasOperatorChild - 0.3 * df.nestingRatioTotal
+
+    df["isCovered"] = (rng.random(n) < 0.9).astype(int)
+    df["coveringTests"] = df.isCovered * rng.integers(1, 40, n)
+    killed = (df.isCovered == 1) & (rng.random(n) < 0.8)
+    df["isKilled"] = killed.astype(int)
+    df["killingTests"] = np.where(killed, rng.integers(1, 40, n), 0)
+    df["killingTests"] = np.minimum(df.killingTests, df.coveringTests)
+    df["isTrivial"] = (killed & (rng.random(n) < 0.05)).astype(int)
+    df["trivialityScore"] = np.where(
+        killed, df.killingTests / df.coveringTests.clip(lower=1), 0
+    )
+    df["trivialityTests"] = df.coveringTests
+    p = 1 / (1 + np.exp(-(signal + rng.normal(0, 0.5, n))))
+    df["pKillsDom"] = np.where(killed, p, 0.0)
+    df["expKilledDomNodes"] = np.where(killed, p * (1 + rng.poisson(1.0, n)), 0.0)
+    df["isDominator"] = (killed & (rng.random(n) < 0.3 * p)).astype(int)
+    df["dominatorStrength"] = np.where(
+        df.isDominator == 1, 1.0, np.where(killed, p / 2, -1.0)
+    )
+    df["isUnproductive"] = 0
+    df["isFaultCoupled"] = 0
+
+    df = df[CM_COLUMNS]
+    return {
+        (pid, int(bid)): subject.reset_index(drop=True)
+        for (pid, bid), subject in df.groupby(["projectId", "bugId"], sort=False)
+    }
+
+
+def write_corpus(
+    corpus: Dict[Tuple[str, int], pd.DataFrame], out_dir: pathlib.Path
+) -> None:
+    for (pid, bid), df in corpus.items():
+        subject_dir = out_dir / pid / f"{bid}f"
+        subject_dir.mkdir(parents=True, exist_ok=True)
+        df.to_csv(subject_dir / "customized-mutants.csv", index=False)
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    corpus = generate(args.projects, args.classes, args.mutants, args.seed)
+    write_corpus(corpus, args.out_dir)
+    n_rows = sum(len(df) for df in corpus.values())
+    print(f"Wrote {n_rows} mutants of {len(corpus)} subjects to {args.out_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
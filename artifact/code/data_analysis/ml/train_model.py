@@ -13,17 +13,33 @@ import joblib
 import numpy as np
 import pandas as pd
 import seaborn as sns
-import sklearn_pandas
 from scipy import sparse
-from sklearn.ensemble import RandomForestRegressor
-from sklearn.impute import SimpleImputer
-from sklearn.linear_model import Ridge
-from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+import features
+import fold_scheduler
+import instrument
+import models
+import shards
+import solvers
+from multi_target import TARGETS, MultiTargetModel
 
 arg_parser = argparse.ArgumentParser()
-arg_parser.add_argument("--model", required=True, choices=["linear", "randomforest"])
-arg_parser.add_argument("--data", required=True, choices=["all", "small"])
+arg_parser.add_argument("--model", required=True, choices=models.MODEL_CHOICES)
+arg_parser.add_argument("--data", required=True, choices=features.DATA_CHOICES)
 arg_parser.add_argument("--out", required=True, type=str)
+arg_parser.add_argument(
+    "--hash_features",
+    type=int,
+    default=features.HASH_FEATURES,
+    help="The number of hashed categorical columns (--data hashed only).",
+)
+arg_parser.add_argument(
+    "--hash_crosses",
+    nargs="*",
+    default=[],
+    metavar="FEATURE:FEATURE",
+    help="Pairs of categorical features to also hash jointly (--data hashed only).",
+)
 arg_parser.add_argument(
     "--project_only",
     action="store_true",
@@ -34,14 +50,60 @@ arg_parser.add_argument(
     action="store_true",
     help="If set, training data will only be drawn from other projects.",
 )
+arg_parser.add_argument(
+    "--targets",
+    nargs="+",
+    default=TARGETS[:1],
+    choices=TARGETS,
+    help="The labels to learn. The first must be pKillsDom. If several are given, "
+    "each fold's model is fit to all of them in one pass (not supported by "
+    "--model randomforest).",
+)
+arg_parser.add_argument(
+    "--trace",
+    type=str,
+    default=None,
+    help="Append a JSON-lines trace of stage times and memory to this file "
+    "(see instrument.py).",
+)
+arg_parser.add_argument(
+    "--mem_budget",
+    type=float,
+    default=float(os.getenv("TRAIN_MODEL_MEM_GB", "0")) or None,
+    help="The memory (in GiB) that concurrent fold fits may use "
+    "(default: $TRAIN_MODEL_MEM_GB, or 80%% of the available memory).",
+)
+arg_parser.add_argument(
+    "--linear_solver",
+    default="auto",
+    choices=solvers.BACKEND_CHOICES,
+    help="The solver backend of linear models (see solvers.py). By default, it "
+    "is picked per fold from a calibration of this machine.",
+)
+arg_parser.add_argument(
+    "--shard",
+    type=shards.parse_shard,
+    default=None,
+    metavar="INDEX/COUNT",
+    help="Only fit the folds of this shard, and write a partial artifact to "
+    "--out (merge the partials of all shards with shards.py merge).",
+)
 arg_parser.add_argument(
     "results_dir",
     type=str,
     help="The directory to search for customized_mutants.csv files.",
 )
 args = arg_parser.parse_args()
+instrument.enable(args.trace)
 
 assert not (args.project_only and args.between_projects), "Args cannot be combined"
+assert args.targets[0] == TARGETS[0], "The first target must be " + TARGETS[0]
+assert len(set(args.targets)) == len(args.targets), "Targets must be unique"
+# Random forests would split on the summed error of all targets (see
+# multi_target.py).
+assert (
+    len(args.targets) == 1 or args.model != "randomforest"
+), "--model randomforest cannot be fit to several targets"
 
 # Validate the results_dir is a directory.
 assert os.path.isdir(args.results_dir)
@@ -53,11 +115,13 @@ if not paths:
     raise Exception(f"No customized-mutants.csv files found in {args.results_dir}")
 
 # Read all results and concatenate into a single DataFrame: cm_df
-cm_dfs = []
-for path in paths:
-    print(f"Reading: {path}")
-    cm_dfs.append(pd.read_csv(path))
-cm_df = pd.concat(cm_dfs)
+with instrument.stage("read_csv", files=len(paths)) as trace_args:
+    cm_dfs = []
+    for path in paths:
+        print(f"Reading: {path}")
+        cm_dfs.append(pd.read_csv(path))
+    cm_df = pd.concat(cm_dfs)
+    trace_args["rows"] = len(cm_df)
 
 # We're only interested in covered mutants, so immediately discard uncovered.
 cm_df.isCovered = cm_df.isCovered.astype("bool")
@@ -66,69 +130,28 @@ cm_df = cm_df[cm_df.isCovered]
 # Assert that we only have one bug ID per project
 assert (cm_df.groupby("projectId").bugId.nunique() == 1).all()
 
-if args.data == "small":
-    mapper = sklearn_pandas.DataFrameMapper(
-        [
-            (
-                ["mutationOperator", "parentStmtContextDetailed"],
-                OneHotEncoder(handle_unknown="ignore"),
-            )
-        ]
-    )
-elif args.data == "all":
-    mapper = sklearn_pandas.DataFrameMapper(
-        [
-            (["lineRatio"], [SimpleImputer(strategy="mean"), StandardScaler()]),
-            (
-                ["nestingIf", "nestingLoop", "nestingTotal", "maxNestingInSameMethod"],
-                StandardScaler(),
-            ),
-            (
-                [
-                    "nestingRatioLoop",
-                    "nestingRatioIf",
-                    "nestingRatioTotal",
-                    "hasOperatorChild",
-                    "hasVariableChild",
-                    "hasLiteralChild",
-                ],
-                None,
-            ),
-            (
-                ["nodeTypeBasic", "nodeTypeDetailed"],
-                [
-                    SimpleImputer(strategy="constant", fill_value="Unknown"),
-                    OneHotEncoder(handle_unknown="ignore"),
-                ],
-            ),
-            (
-                [
-                    "mutationOperator",
-                    "mutationOperatorGroup",
-                    "nodeContextBasic",
-                    "astContextBasic",
-                    "astContextDetailed",
-                    "astStmtContextBasic",
-                    "astStmtContextDetailed",
-                    "parentContextBasic",
-                    "parentContextDetailed",
-                    "parentStmtContextBasic",
-                    "parentStmtContextDetailed",
-                ],
-                OneHotEncoder(handle_unknown="ignore"),
-            ),
-        ]
-    )
-else:
-    raise Exception(f"Unexpected --data arg: " + str(args.data))
+mapper = features.build_mapper(
+    args.data,
+    hash_features=args.hash_features,
+    hash_crosses=[tuple(c.split(":")) for c in args.hash_crosses],
+)
 
-X_all = mapper.fit_transform(cm_df.copy()).astype(np.float32)
-y_all = cm_df.pKillsDom.values.copy()
+with instrument.stage("fit_transform", data=args.data) as trace_args:
+    X_all = mapper.fit_transform(cm_df.copy()).astype(np.float32)
+    categorical_columns = features.categorical_columns(mapper)
+    if len(args.targets) == 1:
+        y_all = cm_df[args.targets[0]].values.copy()
+    else:
+        y_all = cm_df[args.targets].values.astype(np.float64)
 
-if args.model == "linear":
-    X_all = sparse.csc_matrix(X_all)
-elif args.model == "randomforest":
-    X_all = sparse.csc_matrix(X_all)
+    if args.model == "linear":
+        X_all = sparse.csc_matrix(X_all)
+    elif args.model == "randomforest":
+        X_all = sparse.csc_matrix(X_all)
+    elif args.model == "neighbors":
+        X_all = sparse.csc_matrix(X_all)
+    trace_args["shape"] = X_all.shape
+    trace_args["nnz"] = X_all.nnz
 
 
 def _fit_model(project_id, train_set_selection, selection_key):
@@ -144,61 +167,104 @@ def _fit_model(project_id, train_set_selection, selection_key):
     assert X.shape[0] < len(cm_df)
     assert y.shape[0] < len(cm_df)
 
-    if args.model == "linear":
-        model = Ridge(solver="sparse_cg", copy_X=False)
-    elif args.model == "randomforest":
-        model = RandomForestRegressor(
-            max_depth=3,
-            n_estimators=10,
-            n_jobs=1,
-            # n_jobs=max(1, os.cpu_count() // 8),
-        )
-    else:
-        raise Exception(f"Unexpected model arg: " + str(args.model))
-    model.fit(X, y)
+    model = models.build_model(args.model, args.linear_solver, categorical_columns)
+    with instrument.stage(
+        "fit", cat="fold", fold=selection_key, shape=X.shape, nnz=X.nnz
+    ) as trace_args:
+        model.fit(X, y)
+        if hasattr(model, "backend_"):
+            trace_args["backend"] = model.backend_
+    if len(args.targets) > 1:
+        model = MultiTargetModel(model, args.targets)
     return (project_id, bug_id, selection_key), model
 
 
-def fit_model(project_id, held_out_class_name):
-    assert (cm_df.className == held_out_class_name).any()
+def class_train_selection(project_id, held_out_class_name):
     train_set_selection = cm_df.className != held_out_class_name
     if args.project_only:
         train_set_selection = train_set_selection & (cm_df.projectId == project_id)
+    return train_set_selection
+
+
+def fit_model(project_id, held_out_class_name):
+    assert (cm_df.className == held_out_class_name).any()
+    train_set_selection = class_train_selection(project_id, held_out_class_name)
     return _fit_model(project_id, train_set_selection, {"class": held_out_class_name})
 
 
+def other_projects_selection(project_id):
+    return cm_df.projectId != project_id
+
+
 def fit_model_from_other_projects(project_id):
     assert isinstance(project_id, str)
-    train_set_selection = cm_df.projectId != project_id
+    train_set_selection = other_projects_selection(project_id)
     return _fit_model(project_id, train_set_selection, {"project": project_id})
 
 
-project_names = [
-    tuple(row)
-    for _, row in cm_df[["projectId", "className"]].drop_duplicates().iterrows()
-]
 project_classes = [
     tuple(row)
     for _, row in cm_df[["projectId", "className"]].drop_duplicates().iterrows()
 ]
 
+# The number of worker processes; how many of them run at once depends on
+# the memory budget.
 if args.data == "small":
     n_jobs = int(os.getenv("TRAIN_MODEL_CPUS", "-1"))
-elif args.data == "all":
-    n_jobs = int(os.getenv("TRAIN_MODEL_CPUS", "8"))
-
 else:
-    raise Exception(f"Unexpected model arg: " + str(args.model))
+    n_jobs = int(os.getenv("TRAIN_MODEL_CPUS", "8"))
+if n_jobs < 1:
+    n_jobs = os.cpu_count()
 
 if args.between_projects:
-    fit_model_delayed = joblib.delayed(fit_model_from_other_projects)
-    parallel_jobs = [fit_model_delayed(n) for n in cm_df.projectId.drop_duplicates()]
+    fold_args = [(n,) for n in cm_df.projectId.drop_duplicates()]
+    fit_fn, selection_fn = fit_model_from_other_projects, other_projects_selection
+    fold_keys = [shards.fold_key(p, {"project": p}) for p, in fold_args]
 else:
-    fit_model_delayed = joblib.delayed(fit_model)
-    parallel_jobs = [fit_model_delayed(*t) for t in project_classes]
-print(f"Training {len(parallel_jobs)} models")
-results = joblib.Parallel(n_jobs=n_jobs, verbose=61)(parallel_jobs)
+    fold_args = project_classes
+    fit_fn, selection_fn = fit_model, class_train_selection
+    fold_keys = [shards.fold_key(p, {"class": c}) for p, c in fold_args]
+# Nonzeros per row of the design matrix, to estimate the size of each fold.
+row_nnz = np.bincount(X_all.indices, minlength=X_all.shape[0])
+fold_jobs = []
+for fold in fold_args:
+    selection = selection_fn(*fold).values
+    fold_jobs.append(
+        fold_scheduler.FoldJob(
+            fit_fn, fold, int(selection.sum()), int(row_nnz[selection].sum())
+        )
+    )
+if args.shard is not None:
+    shard_index, shard_count = args.shard
+    fold_shards = shards.assign(fold_keys, [job.nnz for job in fold_jobs], shard_count)
+    fold_jobs = [job for job, i in zip(fold_jobs, fold_shards) if i == shard_index]
+    print(f"Shard {shard_index}/{shard_count}: {len(fold_jobs)} of {len(fold_keys)}")
+if args.model == "linear" and args.linear_solver == "auto":
+    # Calibrate before the workers start, so they all read the same file.
+    solvers.load_calibration(create=True)
+scheduler = fold_scheduler.FoldScheduler(
+    args.model,
+    budget_bytes=int(args.mem_budget * 2**30) if args.mem_budget else None,
+    max_workers=n_jobs,
+)
+print(
+    f"Training {len(fold_jobs)} models on up to {n_jobs} workers "
+    f"within {scheduler.budget / 2**30:.1f} GiB"
+)
+with instrument.stage(
+    "train_folds",
+    cat="parallel",
+    n_jobs=n_jobs,
+    folds=len(fold_jobs),
+    budget_mb=scheduler.budget / 2**20,
+) as trace_args:
+    results = scheduler.run(fold_jobs)
+    trace_args["memory_factor"] = scheduler.factor
 
 # Save all results, including models, to disk
 print(f"Writing to: {args.out}")
-joblib.dump((mapper, results), args.out)
+with instrument.stage("dump", path=args.out):
+    if args.shard is None:
+        joblib.dump((mapper, results), args.out)
+    else:
+        shards.write_partial(args.out, args.shard, fold_keys, mapper, results)
@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""Coverage-based test-suite sampling over a bit-packed line coverage matrix.
+
+A port of sim_core.R's simCovTesting (used by cov_simulation.R) and
+sampleTests (used by the sampling-mode work simulation). Both add tests in a
+random order and keep those that cover a new line. Here, each covering test's
+lines are a bit-packed row, and all runs are processed together: at every
+position of the shuffled test order, the coverage of all unfinished runs is
+updated with one word-level OR and popcount.
+
+Run as a script, this computes the coverage simulation of a subject, like
+cov_simulation.R, writing the (Class, Run, Tests, TestsRatio, Coverage) curves
+to <out dir>/<PID>.coverage.csv (or <PID>-<BID>-<class>.coverage.csv with
+--class).
+
+Run `cov_sampler.py --help` for more information.
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+import zlib
+from typing import NamedTuple, Optional
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# bitset.py is shared with (and lives with) the data-collection scripts.
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[2] / "data_collection"))
+import bitset  # noqa: E402
+
+# Number of runs for each class
+N_RUNS = 1000
+
+# Upper bound on (runs x tests) processed in one batch.
+_BATCH_ELEMENTS = 1 << 22
+
+arg_parser = argparse.ArgumentParser(
+    description="Simulate coverage-based testing for a subject."
+)
+arg_parser.add_argument("pid", type=str, help="The project ID")
+arg_parser.add_argument("bid", type=int, help="The bug ID")
+arg_parser.add_argument("res_root", type=pathlib.Path, help="CM_RESULTS_ROOT")
+arg_parser.add_argument("out_dir", type=pathlib.Path)
+arg_parser.add_argument(
+    "--class",
+    dest="class_name",
+    type=str,
+    default=None,
+    help="Only simulate this class.",
+)
+arg_parser.add_argument("--runs", type=int, default=N_RUNS)
+arg_parser.add_argument("--seed", type=int, default=1)
+arg_parser.add_argument(
+    "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    help="The number of classes to simulate in parallel.",
+)
+
+
+class Coverage(NamedTuple):
+    """A subject's covered mutants and their coverage by tests.
+
+    Rows of `covers` follow `mutants`; rows of `lines` are line numbers,
+    which (as in the R scripts) are not distinguished by file. Columns of
+    both follow `test_ids`.
+    """
+
+    mutants: pd.DataFrame
+    test_ids: np.ndarray
+    covers: sparse.csr_matrix
+    lines: sparse.csr_matrix
+
+
+class ClassCoverage(NamedTuple):
+    # Columns (into Coverage.test_ids) of the tests covering some class mutant.
+    covering: np.ndarray
+    # Packed sets of lines covered by each covering test.
+    line_sets: np.ndarray
+    n_lines: int
+
+
+def subject_matrix(rows, cols, row_index, col_index) -> sparse.csr_matrix:
+    """Returns a boolean (row, col) incidence matrix over the given indices.
+
+    Pairs with a row or column outside the indices are dropped.
+    """
+    r = row_index.get_indexer(rows)
+    c = col_index.get_indexer(cols)
+    keep = (r >= 0) & (c >= 0)
+    m = sparse.csr_matrix(
+        (np.ones(keep.sum(), dtype=bool), (r[keep], c[keep])),
+        shape=(len(row_index), len(col_index)),
+    )
+    m.sum_duplicates()
+    return m
+
+
+def read_coverage(in_dir: pathlib.Path, pid: str, bid: int, test_ids=None) -> Coverage:
+    """Reads a subject's covered mutants and covMap.csv.
+
+    `test_ids` defaults to the tests in covMap.csv.
+    """
+    mutants = pd.read_csv(in_dir / "customized-mutants.csv")
+    mutants = mutants[
+        (mutants.projectId == pid) & (mutants.bugId == bid) & (mutants.isCovered == 1)
+    ]
+    mutants = mutants.drop_duplicates("mutantId").sort_values("mutantId")
+    mutants = mutants.reset_index(drop=True)
+
+    cov_map = pd.read_csv(in_dir / "covMap.csv")
+    if test_ids is None:
+        test_ids = np.unique(cov_map.TestNo.values)
+    test_index = pd.Index(test_ids)
+    covers = subject_matrix(
+        cov_map.MutantNo, cov_map.TestNo, pd.Index(mutants.mutantId.values), test_index
+    )
+
+    line_numbers = cov_map.MutantNo.map(mutants.set_index("mutantId").lineNumber)
+    has_line = line_numbers.notna().values
+    line_numbers = line_numbers[has_line].astype(np.int64)
+    lines = subject_matrix(
+        line_numbers,
+        cov_map.TestNo[has_line],
+        pd.Index(np.unique(line_numbers)),
+        test_index,
+    )
+    return Coverage(mutants, np.asarray(test_ids), covers, lines)
+
+
+def class_coverage(coverage: Coverage, class_name: str) -> ClassCoverage:
+    rows = np.flatnonzero((coverage.mutants.className == class_name).values)
+    covering = np.flatnonzero(
+        np.asarray(coverage.covers[rows].sum(axis=0)).ravel() > 0
+    )
+    lines = coverage.lines[:, covering]
+    covered_lines = np.flatnonzero(np.asarray(lines.sum(axis=1)).ravel() > 0)
+    return ClassCoverage(
+        covering=covering,
+        line_sets=bitset.pack(lines[covered_lines].T.toarray()),
+        n_lines=len(covered_lines),
+    )
+
+
+def _permutations(n_runs: int, n_tests: int, rng: np.random.Generator) -> np.ndarray:
+    return np.argsort(rng.random((n_runs, n_tests)), axis=1)
+
+
+def coverage_curves(
+    line_sets: np.ndarray, n_lines: int, n_runs: int, rng: np.random.Generator
+) -> pd.DataFrame:
+    """Port of simCovTesting: coverage over test-suite size, for random test orders.
+
+    Every run adds tests in a random order until all lines are covered;
+    tests that cover no new line are skipped.
+
+    Returns:
+        A DataFrame with columns Run (1-based), Tests, TestsRatio, and
+        Coverage, with a row per run and kept test.
+    """
+    n_tests = line_sets.shape[0]
+    batch = max(1, _BATCH_ELEMENTS // max(n_tests, 1))
+    parts = []
+    for start in range(0, n_runs, batch):
+        runs = np.arange(start, min(start + batch, n_runs))
+        perm = _permutations(len(runs), n_tests, rng)
+        cov = line_sets[perm[:, 0]].copy()
+        covered = bitset.popcount(cov)
+        kept = np.ones(len(runs), dtype=np.int64)
+        out_run, out_tests, out_covered = [runs], [kept.copy()], [covered.copy()]
+        active = np.flatnonzero(covered < n_lines)
+        for i in range(1, n_tests):
+            if not len(active):
+                break
+            cov[active] |= line_sets[perm[active, i]]
+            new_covered = bitset.popcount(cov[active])
+            grew = active[new_covered > covered[active]]
+            covered[active] = new_covered
+            kept[grew] += 1
+            out_run.append(runs[grew])
+            out_tests.append(kept[grew])
+            out_covered.append(covered[grew])
+            active = active[covered[active] < n_lines]
+        df = pd.DataFrame(
+            {
+                "Run": np.concatenate(out_run) + 1,
+                "Tests": np.concatenate(out_tests),
+                "Coverage": np.concatenate(out_covered) / n_lines,
+            }
+        )
+        parts.append(df)
+    df = pd.concat(parts, ignore_index=True).sort_values(["Run", "Tests"], kind="stable")
+    df.insert(2, "TestsRatio", df.Tests / n_tests)
+    return df.reset_index(drop=True)
+
+
+def sample_suites(
+    line_sets: np.ndarray, n_lines: int, sizes: np.ndarray, rng: np.random.Generator
+) -> np.ndarray:
+    """Port of sampleTests: samples one test suite per entry of `sizes`.
+
+    Suite r adds tests in a random order, keeping those that cover a new line,
+    until it has sizes[r] tests or all lines are covered. As in R, the first
+    kept test is always test 0, while coverage starts from the first shuffled
+    test.
+
+    Returns:
+        A boolean (runs x tests) matrix of the tests in each suite.
+    """
+    n_runs, n_tests = len(sizes), line_sets.shape[0]
+    selected = np.zeros((n_runs, n_tests), dtype=bool)
+    batch = max(1, _BATCH_ELEMENTS // max(n_tests, 1))
+    for start in range(0, n_runs, batch):
+        runs = np.arange(start, min(start + batch, n_runs))
+        limit = np.asarray(sizes)[runs]
+        perm = _permutations(len(runs), n_tests, rng)
+        selected[runs, 0] = True
+        cov = line_sets[perm[:, 0]].copy()
+        covered = bitset.popcount(cov)
+        kept = np.ones(len(runs), dtype=np.int64)
+        active = np.flatnonzero((covered < n_lines) & (kept < limit))
+        for i in range(1, n_tests):
+            if not len(active):
+                break
+            cov[active] |= line_sets[perm[active, i]]
+            new_covered = bitset.popcount(cov[active])
+            grew = active[new_covered > covered[active]]
+            covered[active] = new_covered
+            kept[grew] += 1
+            selected[runs[grew], perm[grew, i]] = True
+            active = active[(covered[active] < n_lines) & (kept[active] < limit[active])]
+    return selected
+
+
+def union_rows(selected: np.ndarray, sets: np.ndarray) -> np.ndarray:
+    """Returns, for each row of `selected`, the union of the selected packed sets."""
+    out = np.zeros((selected.shape[0], sets.shape[1]), dtype=sets.dtype)
+    for j in np.flatnonzero(selected.any(axis=0)):
+        out[selected[:, j]] |= sets[j]
+    return out
+
+
+def class_seed(seed: int, class_name: str):
+    """Returns a per-class seed, so results do not depend on scheduling."""
+    return [seed, zlib.crc32(class_name.encode("utf8"))]
+
+
+def _class_job(
+    coverage: ClassCoverage, class_name: str, n_runs: int, seed: int
+) -> Optional[pd.DataFrame]:
+    if not len(coverage.covering):
+        return None
+    rng = np.random.default_rng(class_seed(seed, class_name))
+    df = coverage_curves(coverage.line_sets, coverage.n_lines, n_runs, rng)
+    df.insert(0, "Class", class_name)
+    return df
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    in_dir = args.res_root / args.pid / f"{args.bid}f"
+    if args.class_name is None:
+        all_classes = sorted(os.listdir(in_dir / "score_matrix_slices"))
+    else:
+        all_classes = [args.class_name]
+    print(f"Found {len(all_classes)} classes for {args.pid}-{args.bid}")
+
+    coverage = read_coverage(in_dir, args.pid, args.bid)
+    # Parallelize simulation for all classes
+    curves = joblib.Parallel(n_jobs=args.jobs)(
+        joblib.delayed(_class_job)(class_coverage(coverage, c), c, args.runs, args.seed)
+        for c in all_classes
+    )
+    df = pd.concat([c for c in curves if c is not None], ignore_index=True)
+
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+    if args.class_name is None:
+        out_csv = args.out_dir / f"{args.pid}.coverage.csv"
+    else:
+        out_csv = args.out_dir / f"{args.pid}-{args.bid}-{args.class_name}.coverage.csv"
+    df.to_csv(out_csv, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,519 @@
+#!/usr/bin/env python3
+"""A batched Monte Carlo work simulation; a port of sim_core.R's runSimulation.
+
+For each class of a subject, the simulation repeatedly (N_RUNS times per
+strategy) ranks the class's mutants by a strategy's utility, breaking ties at
+random, and walks down the ranking: every mutant that is not yet killed costs
+one step, and a live mutant is killed by a random test that kills it, which
+also kills every other mutant that test kills. Each step records the number
+of dominator nodes killed so far.
+
+Instead of simulating one run at a time, this engine simulates a batch of runs
+together: all runs visit ranking position k at once, the killed mutants of
+every run are a bit-packed row, and the mutants killed by a test are a
+precomputed bit-packed kill vector, so a step is a few word-level operations
+per run. Dominator-node counts are updated incrementally from the newly
+killed mutants of each step.
+
+Inputs, outputs (one trace csv per class, plus a summary csv), and the quirks
+of runSimulation are kept, so the traces are statistically equivalent to
+those of work_simulation.R. Random numbers come from NumPy, seeded per class,
+so individual runs differ from R's.
+
+Run `sim_engine.py --help` for more information.
+"""
+
+import argparse
+import os
+import pathlib
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# bitset.py is shared with (and lives with) the data-collection scripts.
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[2] / "data_collection"))
+import bitset  # noqa: E402
+import cov_sampler  # noqa: E402
+import trace_store  # noqa: E402
+
+# Number of runs for each strategy
+N_RUNS = 1000
+
+# Run all these strategies
+STRATEGIES = ["predictedProbKillsDom", "OptimalDom", "Random"]
+
+TRACE_COLUMNS = [
+    "Strategy",
+    "Run",
+    "Step",
+    "LinesTotal",
+    "LinesCoveredBase",
+    "TestsTotal",
+    "TestsSelectedBase",
+    "MutantsTotal",
+    "MutantsKillable",
+    "MutantId",
+    "TestId",
+    "MutantUtility",
+    "isEqui",
+    "isDom",
+    "isTriv",
+    "NodesKilled",
+    "NodesRatio",
+    "Type",
+]
+
+SUMMARY_COLUMNS = ["Class", "MutantsTotal", "MutantsKillable", "TestsTotal", "SimRuns"]
+
+# Upper bound on (runs x ranked mutants) simulated in one batch.
+_BATCH_ELEMENTS = 1 << 22
+
+arg_parser = argparse.ArgumentParser(
+    description="Simulate the work of mutation-based testing for a subject."
+)
+arg_parser.add_argument("pid", type=str, help="The project ID")
+arg_parser.add_argument("bid", type=int, help="The bug ID")
+arg_parser.add_argument(
+    "res_root",
+    type=pathlib.Path,
+    help="The results directory (CM_RESULTS_ROOT), containing predictions.csv.",
+)
+arg_parser.add_argument("out_dir", type=pathlib.Path)
+arg_parser.add_argument(
+    "--class",
+    dest="class_name",
+    type=str,
+    default=None,
+    help="Only simulate this class.",
+)
+arg_parser.add_argument(
+    "--sample",
+    action="store_true",
+    help="Start each run from a sampled, coverage-adequate test suite (CM_SAMPLE).",
+)
+arg_parser.add_argument("--runs", type=int, default=N_RUNS)
+arg_parser.add_argument("--seed", type=int, default=1)
+arg_parser.add_argument(
+    "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    help="The number of classes to simulate in parallel.",
+)
+arg_parser.add_argument(
+    "--store",
+    choices=["csv", "npz"],
+    default="csv",
+    help="Write traces as csv or as compressed .trace.npz files (see trace_store.py).",
+)
+
+
+class Subject(NamedTuple):
+    """The simulation inputs of a subject (see sim_core.R's get* functions).
+
+    Mutants are the subject's covered mutants. Rows of `kills` follow
+    `mutants`, and its columns follow `coverage.test_ids`.
+    """
+
+    mutants: pd.DataFrame
+    kills: sparse.csr_matrix
+    coverage: cov_sampler.Coverage
+    utilities: pd.DataFrame
+    cov_sim: Optional[pd.DataFrame]
+
+
+class ClassInputs(NamedTuple):
+    """The data needed to simulate a single class.
+
+    Mutant arrays follow `mutant_ids`; columns are the tests that kill or
+    cover some mutant of the class, ordered by test id.
+    """
+
+    name: str
+    mutant_ids: np.ndarray
+    killable: np.ndarray
+    is_dom: np.ndarray
+    is_triv: np.ndarray
+    group: np.ndarray
+    # Positions (into mutant_ids) of the mutants with predictions, and their
+    # utility per strategy.
+    ranked: np.ndarray
+    utilities: Dict[str, np.ndarray]
+    test_ids: np.ndarray
+    # Killing tests of each mutant, as a CSR structure over columns.
+    kill_indptr: np.ndarray
+    kill_indices: np.ndarray
+    # Packed sets of class mutants killed by each column.
+    kill_sets: np.ndarray
+    # Columns of the tests covering some class mutant (test_ids in R).
+    covering: np.ndarray
+    # Packed sets of lines covered by each covering test.
+    line_sets: np.ndarray
+    n_lines: int
+    cov_model: Optional[Tuple[float, float]]
+
+
+def read_subject(res_root: pathlib.Path, pid: str, bid: int, sample: bool) -> Subject:
+    in_dir = res_root / pid / f"{bid}f"
+
+    kill_map = pd.read_csv(in_dir / "killMap.csv")
+    cov_map_tests = pd.read_csv(in_dir / "covMap.csv", usecols=["TestNo"]).TestNo
+    test_ids = np.union1d(kill_map.TestNo.values, cov_map_tests.values)
+    coverage = cov_sampler.read_coverage(in_dir, pid, bid, test_ids)
+    mutants = coverage.mutants.copy()
+
+    # Non-equivalent mutants' dmsg nodes; 0 (no node) otherwise.
+    dmsg = pd.read_csv(in_dir / "dmsgs.csv")
+    dmsg = dmsg[(dmsg.projectId == pid) & (dmsg.bugId == bid) & (dmsg.dominatorStrength >= 0)]
+    groups = dmsg.drop_duplicates("mutantId", keep="last").set_index("mutantId").groupId
+    mutants["groupId"] = mutants.mutantId.map(groups).fillna(0).astype(np.int64)
+
+    kills = cov_sampler.subject_matrix(
+        kill_map.MutantNo,
+        kill_map.TestNo,
+        pd.Index(mutants.mutantId.values),
+        pd.Index(test_ids),
+    )
+    mutants["isKillable"] = np.asarray(kills.sum(axis=1)).ravel() > 0
+
+    predictions = pd.read_csv(res_root / "predictions.csv")
+    predictions = predictions[(predictions.projectId == pid) & (predictions.bugId == bid)]
+    utilities = predictions[["mutantId", "predictedProbKillsDom"]].merge(
+        mutants[["mutantId", "expKilledDomNodes", "isDominator"]], on="mutantId"
+    )
+    # Optimal: rank mutants by expected number of dom nodes killed; use isDom
+    # as a tie breaker to distinguish between dom and sub nodes.
+    utilities["OptimalDom"] = utilities.expKilledDomNodes + utilities.isDominator / 100
+    # Random: all mutants have the same utility; ties are broken at random.
+    utilities["Random"] = 0.5
+    utilities = utilities.set_index("mutantId")[STRATEGIES]
+
+    cov_sim = None
+    if sample:
+        cov_sim = pd.read_csv(res_root / "cov_simulation" / f"{pid}.coverage.csv")
+
+    return Subject(mutants, kills, coverage, utilities, cov_sim)
+
+
+def fit_cov_model(cov_sim: pd.DataFrame, class_name: str) -> Tuple[float, float]:
+    """Fits lm(log(TestsRatio) ~ Coverage) to a class's coverage simulation.
+
+    Returns (intercept, slope). As in R, an undetermined slope (constant
+    Coverage) is dropped from the model.
+    """
+    df = cov_sim[cov_sim.Class == class_name]
+    y = np.log(df.TestsRatio.values.astype(np.float64))
+    x = df.Coverage.values.astype(np.float64)
+    if len(x) == 0:
+        raise ValueError(f"No coverage simulation for class {class_name}")
+    if np.ptp(x) == 0:
+        return float(y.mean()), 0.0
+    slope, intercept = np.polyfit(x, y, 1)
+    return float(intercept), float(slope)
+
+
+def class_inputs(subject: Subject, class_name: str) -> ClassInputs:
+    mutants = subject.mutants
+    rows = np.flatnonzero((mutants.className == class_name).values)
+    class_mutants = mutants.iloc[rows]
+
+    kills = subject.kills[rows]
+    coverage = cov_sampler.class_coverage(subject.coverage, class_name)
+    killing_cols = np.flatnonzero(np.asarray(kills.sum(axis=0)).ravel() > 0)
+    cols = np.union1d(coverage.covering, killing_cols)
+
+    local_kills = kills[:, cols].tocsr()
+    local_kills.sort_indices()
+    kill_sets = bitset.pack(local_kills.T.toarray())
+
+    utilities = subject.utilities
+    predicted = np.flatnonzero(class_mutants.mutantId.isin(utilities.index).values)
+    ranked_utilities = utilities.loc[class_mutants.mutantId.values[predicted]]
+
+    cov_model = None
+    if subject.cov_sim is not None and len(rows):
+        cov_model = fit_cov_model(subject.cov_sim, class_name)
+
+    return ClassInputs(
+        name=class_name,
+        mutant_ids=class_mutants.mutantId.values,
+        killable=class_mutants.isKillable.values.astype(bool),
+        is_dom=(class_mutants.isDominator == 1).values,
+        is_triv=(class_mutants.isTrivial == 1).values,
+        group=class_mutants.groupId.values,
+        ranked=predicted,
+        utilities={s: ranked_utilities[s].values.astype(np.float64) for s in STRATEGIES},
+        test_ids=subject.coverage.test_ids[cols],
+        kill_indptr=local_kills.indptr.astype(np.int64),
+        kill_indices=local_kills.indices.astype(np.int64),
+        kill_sets=kill_sets,
+        covering=np.searchsorted(cols, coverage.covering),
+        line_sets=coverage.line_sets,
+        n_lines=coverage.n_lines,
+        cov_model=cov_model,
+    )
+
+
+class _DomNodes:
+    """Counts the distinct dominator nodes among sets of class mutants."""
+
+    def __init__(self, ci: ClassInputs):
+        n = len(ci.mutant_ids)
+        dom = np.flatnonzero(ci.is_dom)
+        node_of, self.nodes = pd.factorize(ci.group[dom])
+        self.n_nodes = len(self.nodes)
+        self.dom_words = bitset.pack(ci.is_dom)
+        self.membership = sparse.csr_matrix(
+            (np.ones(len(dom)), (dom, node_of)), shape=(n, self.n_nodes)
+        )
+        self.n_mutants = n
+
+        # If the dominators of each node share one kill vector (as DMSG nodes
+        # do), a node is killed exactly when its first dominator is, and
+        # counting nodes is a popcount over those representatives.
+        first = np.zeros(n, dtype=bool)
+        first[dom[np.unique(node_of, return_index=True)[1]]] = True
+        self.rep_words = bitset.pack(first)
+        kill_rows = [
+            tuple(ci.kill_indices[ci.kill_indptr[m] : ci.kill_indptr[m + 1]])
+            for m in dom
+        ]
+        rep_row = {}
+        self.atomic = True
+        for node, row in zip(node_of, kill_rows):
+            if rep_row.setdefault(node, row) != row:
+                self.atomic = False
+                break
+
+    def count(self, words: np.ndarray) -> np.ndarray:
+        """Returns the number of distinct nodes with a dominator in each row."""
+        if self.atomic:
+            return bitset.popcount(words & self.rep_words)
+        bits = bitset.unpack(words & self.dom_words, self.n_mutants)
+        hit = sparse.csr_matrix(bits, dtype=np.float64) @ self.membership
+        return hit.getnnz(axis=1)
+
+
+class _Bases(NamedTuple):
+    """Per-run starting points: mutants killed by, and sizes of, a sampled suite."""
+
+    killed: np.ndarray
+    lines: np.ndarray
+    tests: np.ndarray
+    mutants: np.ndarray
+    killable: np.ndarray
+    dom_nodes: np.ndarray
+
+
+def _sampled_bases(
+    ci: ClassInputs, nodes: _DomNodes, n_runs: int, rng: np.random.Generator
+) -> _Bases:
+    intercept, slope = ci.cov_model
+    ratios = np.exp(intercept + slope * rng.random(n_runs))
+    sizes = np.ceil(ratios * len(ci.covering)).astype(np.int64)
+
+    killable_words = bitset.pack(ci.killable)
+    selected = cov_sampler.sample_suites(ci.line_sets, ci.n_lines, sizes, rng)
+    killed = cov_sampler.union_rows(selected, ci.kill_sets[ci.covering])
+    return _Bases(
+        killed=killed,
+        lines=bitset.popcount(cov_sampler.union_rows(selected, ci.line_sets)),
+        tests=sizes,
+        mutants=len(ci.mutant_ids) - bitset.popcount(killed),
+        killable=bitset.popcount(killable_words & ~killed),
+        dom_nodes=nodes.n_nodes - nodes.count(killed),
+    )
+
+
+def _unsampled_bases(ci: ClassInputs, nodes: _DomNodes, n_runs: int) -> _Bases:
+    return _Bases(
+        killed=np.zeros((n_runs, ci.kill_sets.shape[1]), dtype=bitset.WORD_DTYPE),
+        lines=np.zeros(n_runs, dtype=np.int64),
+        tests=np.zeros(n_runs, dtype=np.int64),
+        mutants=np.full(n_runs, len(ci.mutant_ids)),
+        killable=np.full(n_runs, ci.killable.sum()),
+        dom_nodes=np.full(n_runs, nodes.n_nodes),
+    )
+
+
+def _simulate_batch(
+    ci: ClassInputs,
+    nodes: _DomNodes,
+    utility: np.ndarray,
+    killed: np.ndarray,
+    rng: np.random.Generator,
+) -> Dict[str, np.ndarray]:
+    """Simulates the runs whose initially killed mutants are the rows of `killed`.
+
+    Returns the steps of all runs as arrays (run is the row in `killed`).
+    """
+    n_runs = killed.shape[0]
+    killed = killed.copy()
+    # Rank by utility; random keys break ties uniformly at random.
+    order = np.lexsort(
+        (rng.random((n_runs, len(utility))), np.broadcast_to(-utility, (n_runs, len(utility))))
+    )
+    ranked = ci.ranked[order]
+    n_kill_tests = np.diff(ci.kill_indptr)
+
+    step = np.zeros(n_runs, dtype=np.int64)
+    nodes_killed = np.zeros(n_runs, dtype=np.int64)
+    out: Dict[str, List[np.ndarray]] = {
+        k: [] for k in ("run", "step", "mutant", "test", "nodes")
+    }
+    all_runs = np.arange(n_runs)
+    for k in range(ranked.shape[1]):
+        mutant = ranked[:, k]
+        live = ~bitset.test_bits(killed, mutant)
+        runs = all_runs[live]
+        if not len(runs):
+            continue
+        mutant = mutant[live]
+        step[runs] += 1
+
+        test = np.full(len(runs), -1, dtype=np.int64)
+        killable = ci.killable[mutant]
+        if killable.any():
+            kr, km = runs[killable], mutant[killable]
+            # Randomly choose one of the tests that kill the mutant.
+            choice = (rng.random(len(km)) * n_kill_tests[km]).astype(np.int64)
+            test[killable] = ci.kill_indices[ci.kill_indptr[km] + choice]
+            kill_set = ci.kill_sets[test[killable]]
+            nodes_killed[kr] += nodes.count(kill_set & ~killed[kr])
+            killed[kr] |= kill_set
+
+        out["run"].append(runs)
+        out["step"].append(step[runs])
+        out["mutant"].append(mutant)
+        out["test"].append(test)
+        out["nodes"].append(nodes_killed[runs])
+    if not out["run"]:
+        return {k: np.zeros(0, dtype=np.int64) for k in out}
+    return {k: np.concatenate(v) for k, v in out.items()}
+
+
+def simulate_class(
+    ci: ClassInputs, n_runs: int, sample: bool, seed: int
+) -> Tuple[Optional[pd.DataFrame], dict]:
+    """Runs all strategies' simulations for a class, like sim_core.R's runSimulation.
+
+    Returns the trace (None if no simulation was run) and the summary row.
+    """
+    n_mutants = len(ci.mutant_ids)
+    n_killable = int(ci.killable.sum())
+    summary = {
+        "Class": ci.name,
+        "MutantsTotal": n_mutants,
+        "MutantsKillable": n_killable,
+        "TestsTotal": len(ci.covering),
+        "SimRuns": -1,
+    }
+    # No mutants, all mutants are equivalent, or only one mutant (exp
+    # efficiency is identical for all strategies) -> skip
+    if n_mutants == 0 or n_killable == 0 or n_mutants == 1:
+        return None, summary
+
+    rng = np.random.default_rng(cov_sampler.class_seed(seed, ci.name))
+    nodes = _DomNodes(ci)
+    if sample:
+        bases = _sampled_bases(ci, nodes, n_runs, rng)
+    else:
+        bases = _unsampled_bases(ci, nodes, n_runs)
+    # Skip runs whose sampled test suite already kills all killable mutants.
+    runs = np.flatnonzero(bases.killable > 0)
+    batch = max(1, _BATCH_ELEMENTS // max(len(ci.ranked), 1))
+
+    traces = []
+    for strategy in STRATEGIES:
+        utility = ci.utilities[strategy]
+        for start in range(0, len(runs), batch):
+            batch_runs = runs[start : start + batch]
+            steps = _simulate_batch(ci, nodes, utility, bases.killed[batch_runs], rng)
+            run = batch_runs[steps["run"]]
+            mutant = steps["mutant"]
+            test = steps["test"]
+            is_equi = (test < 0).astype(np.int64)
+            is_dom = (ci.is_dom[mutant] & (is_equi == 0)).astype(np.int64)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ratio = steps["nodes"] / bases.dom_nodes[run]
+            df = pd.DataFrame(
+                {
+                    "Strategy": strategy,
+                    "Run": run + 1,
+                    "Step": steps["step"],
+                    "LinesTotal": ci.n_lines,
+                    "LinesCoveredBase": bases.lines[run],
+                    "TestsTotal": len(ci.covering),
+                    "TestsSelectedBase": bases.tests[run],
+                    "MutantsTotal": bases.mutants[run],
+                    "MutantsKillable": bases.killable[run],
+                    "MutantId": ci.mutant_ids[mutant],
+                    "TestId": np.where(is_equi == 1, -1, ci.test_ids[np.maximum(test, 0)]),
+                    "MutantUtility": utility[np.searchsorted(ci.ranked, mutant)],
+                    "isEqui": is_equi,
+                    "isDom": is_dom,
+                    "isTriv": (ci.is_triv[mutant] & (is_equi == 0)).astype(np.int64),
+                    "NodesKilled": steps["nodes"],
+                    "NodesRatio": ratio,
+                }
+            )
+            traces.append(df.sort_values(["Run", "Step"], kind="stable"))
+
+    if not traces or not sum(len(t) for t in traces):
+        summary["SimRuns"] = 0
+        return None, summary
+    result = pd.concat(traces, ignore_index=True)
+    # Simplify plotting by encoding the type of a mutant
+    result["Type"] = np.where(
+        result.isEqui == 1, "Equi", np.where(result.isDom == 1, "Dom", "Sub")
+    )
+    summary["SimRuns"] = len(result[["Strategy", "Run"]].drop_duplicates())
+    return result[TRACE_COLUMNS], summary
+
+
+def _class_job(
+    ci: ClassInputs, n_runs: int, sample: bool, seed: int, out_path: pathlib.Path
+) -> dict:
+    trace, summary = simulate_class(ci, n_runs, sample, seed)
+    if trace is not None and out_path.name.endswith(trace_store.TRACE_SUFFIX):
+        trace_store.write_trace(out_path, trace)
+    elif trace is not None:
+        trace.to_csv(out_path, index=False)
+    return summary
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    in_dir = args.res_root / args.pid / f"{args.bid}f"
+    if args.class_name is None:
+        all_classes = sorted(os.listdir(in_dir / "score_matrix_slices"))
+    else:
+        all_classes = [args.class_name]
+    print(f"Found {len(all_classes)} classes for {args.pid}-{args.bid}")
+
+    subject = read_subject(args.res_root, args.pid, args.bid, args.sample)
+    args.out_dir.mkdir(parents=True, exist_ok=True)
+
+    suffix = ".csv" if args.store == "csv" else trace_store.TRACE_SUFFIX
+    # Parallelize simulation for all classes
+    summaries = joblib.Parallel(n_jobs=args.jobs)(
+        joblib.delayed(_class_job)(
+            class_inputs(subject, c),
+            args.runs,
+            args.sample,
+            args.seed,
+            args.out_dir / f"{args.pid}-{args.bid}-{c}{suffix}",
+        )
+        for c in all_classes
+    )
+    log_csv = args.out_dir / f"{args.pid}-{args.bid}-summary.csv"
+    pd.DataFrame(summaries, columns=SUMMARY_COLUMNS).to_csv(log_csv, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
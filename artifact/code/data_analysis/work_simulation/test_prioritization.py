@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""Greedy test prioritization for dominator-node coverage.
+
+Given a class's kill matrix, its dmsg nodes, and the predicted utilities of
+its mutants, this orders the tests that kill some dominator mutant so that
+each next test kills the most not-yet-killed dominator nodes (greedy set
+cover). Ties are broken by the test's predicted utility: the sum of
+predictedProbKillsDom over the class mutants it kills (then by test id).
+
+Each test's killed nodes are a bitset, so the gain of a test is the popcount
+of its set minus the covered nodes. Gains only shrink as nodes get covered,
+so the greedy search is lazy: tests are kept in a heap keyed by their last
+known gain, and only the top test's gain is recomputed until it stays on top.
+
+The output has one row per selected test (in order), with the cumulative
+number and ratio of dominator nodes killed.
+
+Run `test_prioritization.py --help` for more information.
+"""
+
+import argparse
+import heapq
+import os
+import pathlib
+import sys
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# bitset.py is shared with (and lives with) the data-collection scripts.
+sys.path.append(str(pathlib.Path(__file__).resolve().parents[2] / "data_collection"))
+import bitset  # noqa: E402
+import sim_engine  # noqa: E402
+
+# int.bit_count needs Python 3.10; bin() counts the bits on older versions.
+_bit_count = getattr(int, "bit_count", lambda x: bin(x).count("1"))
+
+CURVE_COLUMNS = [
+    "Class",
+    "Position",
+    "TestId",
+    "Utility",
+    "NewNodes",
+    "NodesKilled",
+    "NodesRatio",
+]
+
+arg_parser = argparse.ArgumentParser(
+    description="Order a subject's tests by the dominator nodes they kill."
+)
+arg_parser.add_argument("pid", type=str, help="The project ID")
+arg_parser.add_argument("bid", type=int, help="The bug ID")
+arg_parser.add_argument(
+    "res_root",
+    type=pathlib.Path,
+    help="The results directory (CM_RESULTS_ROOT), containing predictions.csv.",
+)
+arg_parser.add_argument("out_csv", type=pathlib.Path)
+arg_parser.add_argument(
+    "--class",
+    dest="class_name",
+    type=str,
+    default=None,
+    help="Only prioritize the tests of this class.",
+)
+
+
+def node_sets(ci: sim_engine.ClassInputs) -> Tuple[np.ndarray, int]:
+    """Returns the packed set of dominator nodes killed by each column of `ci`.
+
+    Nodes are the groups of the class's dominator mutants, numbered in order
+    of first appearance.
+    """
+    n_mutants, n_cols = len(ci.mutant_ids), len(ci.test_ids)
+    kills = sparse.csr_matrix(
+        (np.ones(len(ci.kill_indices)), ci.kill_indices, ci.kill_indptr),
+        shape=(n_mutants, n_cols),
+    )
+    dom = np.flatnonzero(ci.is_dom)
+    node_of, nodes = pd.factorize(ci.group[dom])
+    membership = sparse.csr_matrix(
+        (np.ones(len(dom)), (dom, node_of)), shape=(n_mutants, len(nodes))
+    )
+    test_nodes = (kills.T @ membership).tocoo()
+    sets = bitset.from_indices(test_nodes.row, test_nodes.col, (n_cols, len(nodes)))
+    return sets, len(nodes)
+
+
+def test_utilities(ci: sim_engine.ClassInputs) -> np.ndarray:
+    """Returns the summed predicted utility of the mutants killed by each column."""
+    utility = np.zeros(len(ci.mutant_ids))
+    utility[ci.ranked] = ci.utilities["predictedProbKillsDom"]
+    per_kill = np.repeat(utility, np.diff(ci.kill_indptr))
+    return np.bincount(ci.kill_indices, weights=per_kill, minlength=len(ci.test_ids))
+
+
+def greedy_order(
+    sets: np.ndarray, n_elements: int, utilities: np.ndarray, test_ids: np.ndarray
+) -> pd.DataFrame:
+    """Lazy-greedy set cover of `n_elements` by the packed `sets`.
+
+    Returns:
+        A DataFrame with a row per selected set (column) in order, with
+        columns Position (1-based), TestId, Utility, NewNodes, NodesKilled,
+        and NodesRatio. Selection stops once no set adds a new element.
+    """
+    # Heap operations dominate, so each set is a Python int: & and a bit count
+    # on one row are much cheaper than NumPy calls.
+    rows = [int.from_bytes(row.tobytes(), "little") for row in sets]
+    sizes = bitset.popcount(sets)
+    # Max-heap on (gain, utility), then smallest test id.
+    heap = [
+        (-sizes[c], -utilities[c], test_ids[c], c) for c in np.flatnonzero(sizes > 0)
+    ]
+    heapq.heapify(heap)
+
+    order, gains = [], []
+    covered, n_covered = 0, 0
+    while heap and n_covered < n_elements:
+        _, neg_utility, test_id, c = heapq.heappop(heap)
+        gain = _bit_count(rows[c] & ~covered)
+        if gain == 0:
+            continue
+        key = (-gain, neg_utility, test_id, c)
+        if heap and heap[0] < key:
+            heapq.heappush(heap, key)
+            continue
+        covered |= rows[c]
+        n_covered += gain
+        order.append(c)
+        gains.append(gain)
+
+    order = np.asarray(order, dtype=np.int64)
+    nodes_killed = np.cumsum(gains, dtype=np.int64)
+    return pd.DataFrame(
+        {
+            "Position": np.arange(1, len(order) + 1),
+            "TestId": test_ids[order],
+            "Utility": utilities[order],
+            "NewNodes": np.asarray(gains, dtype=np.int64),
+            "NodesKilled": nodes_killed,
+            "NodesRatio": nodes_killed / max(n_elements, 1),
+        }
+    )
+
+
+def prioritize_class(ci: sim_engine.ClassInputs) -> pd.DataFrame:
+    sets, n_nodes = node_sets(ci)
+    curve = greedy_order(sets, n_nodes, test_utilities(ci), ci.test_ids)
+    curve.insert(0, "Class", ci.name)
+    return curve
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    in_dir = args.res_root / args.pid / f"{args.bid}f"
+    if args.class_name is None:
+        all_classes = sorted(os.listdir(in_dir / "score_matrix_slices"))
+    else:
+        all_classes = [args.class_name]
+    print(f"Found {len(all_classes)} classes for {args.pid}-{args.bid}")
+
+    subject = sim_engine.read_subject(args.res_root, args.pid, args.bid, sample=False)
+    curves = []
+    for c in all_classes:
+        ci = sim_engine.class_inputs(subject, c)
+        curve = prioritize_class(ci)
+        n_nodes = curve.NodesKilled.values.max(initial=0)
+        print(
+            f"{c}: {len(curve)} of {len(ci.test_ids)} tests kill all "
+            f"{n_nodes} dominator nodes"
+        )
+        curves.append(curve)
+
+    df = pd.concat(curves, ignore_index=True)[CURVE_COLUMNS]
+    df.to_csv(args.out_csv, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
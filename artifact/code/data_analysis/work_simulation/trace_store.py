@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""A compact store for work-simulation traces, and aggregations over it.
+
+The work simulation (work_simulation.R or sim_engine.py) writes one trace
+per class: a row per step, run, and strategy, with the columns listed in
+sim_engine.TRACE_COLUMNS. As csv, these traces take many gigabytes. This
+module stores a trace as a compressed .npz file (`<name>.trace.npz`):
+
+* Strategy and Type are dictionary-encoded (uint8 codes plus the values);
+* integer columns are stored in the smallest integer type that holds them;
+* MutantUtility and NodesRatio are kept as float64.
+
+It also computes the summaries of efficiency.R, efficiency_sample.R, and
+stopping.R in a single pass over a simulation directory, reading only the
+columns each summary needs, one class at a time. Directories of csv traces
+are read as well, so existing simulations can be aggregated (or converted)
+without re-running them.
+
+Run `trace_store.py --help` for more information.
+"""
+
+import argparse
+import pathlib
+import sys
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+FORMAT_VERSION = 1
+TRACE_SUFFIX = ".trace.npz"
+
+# Columns stored as codes into a small set of values.
+DICT_COLUMNS = ["Strategy", "Type"]
+
+PREDICTED = "predictedProbKillsDom"
+OPTIMAL = "OptimalDom"
+RANDOM = "Random"
+
+arg_parser = argparse.ArgumentParser(
+    description="Convert and aggregate work-simulation traces."
+)
+subparsers = arg_parser.add_subparsers(dest="command", required=True)
+_convert_parser = subparsers.add_parser(
+    "convert", help="Convert a directory of csv traces into .trace.npz files."
+)
+_convert_parser.add_argument("in_dir", type=pathlib.Path)
+_convert_parser.add_argument("out_dir", type=pathlib.Path)
+for _command, _help in [
+    ("efficiency", "Overall efficiency per class (efficiency.R)."),
+    ("efficiency_sample", "Efficiency per class and run (efficiency_sample.R)."),
+    ("stopping", "Test completeness over mutant utility (stopping.R)."),
+]:
+    _parser = subparsers.add_parser(_command, help=_help)
+    _parser.add_argument("sim_dir", type=pathlib.Path, help="A work simulation dir.")
+    _parser.add_argument("out_csv", type=pathlib.Path)
+
+
+def _int_dtype(values: np.ndarray) -> np.dtype:
+    if not len(values):
+        return np.dtype(np.int8)
+    lo, hi = values.min(), values.max()
+    for dtype in (np.int8, np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if info.min <= lo and hi <= info.max:
+            return np.dtype(dtype)
+    return np.dtype(np.int64)
+
+
+def write_trace(path: Union[str, pathlib.Path], trace: pd.DataFrame) -> None:
+    arrays = {
+        "version": np.array(FORMAT_VERSION),
+        "columns": np.array(list(trace.columns), dtype=str),
+    }
+    for column in trace.columns:
+        values = trace[column]
+        if column in DICT_COLUMNS:
+            codes, uniques = pd.factorize(values)
+            arrays[f"{column}.codes"] = codes.astype(np.uint8)
+            arrays[f"{column}.values"] = np.array(uniques, dtype=str)
+        elif pd.api.types.is_bool_dtype(values) or pd.api.types.is_integer_dtype(values):
+            values = values.values.astype(np.int64)
+            arrays[column] = values.astype(_int_dtype(values))
+        else:
+            arrays[column] = values.values.astype(np.float64)
+    np.savez_compressed(path, **arrays)
+
+
+def read_trace(
+    path: Union[str, pathlib.Path], columns: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Reads (some columns of) a .trace.npz or csv trace.
+
+    Dictionary-encoded columns are returned as categoricals.
+    """
+    path = pathlib.Path(path)
+    if not path.name.endswith(TRACE_SUFFIX):
+        df = pd.read_csv(path, usecols=columns)
+        for column in DICT_COLUMNS:
+            if column in df:
+                df[column] = df[column].astype("category")
+        return df
+
+    with np.load(path) as z:
+        if int(z["version"]) != FORMAT_VERSION:
+            raise ValueError(f"Unsupported trace version {int(z['version'])} in {path}")
+        if columns is None:
+            columns = list(z["columns"])
+        data = {}
+        for column in columns:
+            if column in DICT_COLUMNS:
+                data[column] = pd.Categorical.from_codes(
+                    z[f"{column}.codes"].astype(np.int64), z[f"{column}.values"]
+                )
+            else:
+                data[column] = z[column]
+    return pd.DataFrame(data)
+
+
+def trace_files(sim_dir: Union[str, pathlib.Path]) -> List[pathlib.Path]:
+    """Returns the traces in a simulation directory, skipping summary files."""
+    sim_dir = pathlib.Path(sim_dir)
+    paths = [
+        p
+        for p in sim_dir.iterdir()
+        if (p.name.endswith(TRACE_SUFFIX) or p.suffix == ".csv")
+        and "summary.csv" not in p.name
+    ]
+    return sorted(paths)
+
+
+def trace_name(path: pathlib.Path) -> str:
+    """Returns the name of the csv trace for `path`, as used in the Class column."""
+    if path.name.endswith(TRACE_SUFFIX):
+        return path.name[: -len(TRACE_SUFFIX)] + ".csv"
+    return path.name
+
+
+def _project(name: str) -> str:
+    return name.split("-", 1)[0]
+
+
+def _wide_means(
+    keys: Sequence[np.ndarray], strategy: pd.Categorical, values: np.ndarray
+) -> Tuple[List[np.ndarray], Dict[str, np.ndarray]]:
+    """Like R's dcast(keys ~ Strategy, mean) followed by replacing NAs with 1.
+
+    Returns the unique key combinations (one array per key) and the mean of
+    `values` per key combination and strategy. As in R, a NaN value makes
+    its mean NaN; missing and NaN means become 1.
+    """
+    combined = pd.MultiIndex.from_arrays(keys)
+    rows, uniques = pd.factorize(combined, sort=True)
+    n_rows = len(uniques)
+    means = {}
+    codes = np.asarray(strategy.codes)
+    for code, name in enumerate(strategy.categories):
+        mask = codes == code
+        sums = np.bincount(rows[mask], weights=values[mask], minlength=n_rows)
+        counts = np.bincount(rows[mask], minlength=n_rows)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = sums / counts
+        mean[np.isnan(mean)] = 1.0
+        means[name] = mean
+    key_values = [uniques.get_level_values(i).values for i in range(len(keys))]
+    return key_values, means
+
+
+def _diffs(means: Dict[str, np.ndarray], n_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+    ones = np.ones(n_rows)
+    random = means.get(RANDOM, ones)
+    return means.get(PREDICTED, ones) - random, means.get(OPTIMAL, ones) - random
+
+
+def class_efficiency(trace: pd.DataFrame, name: str) -> dict:
+    """One row of efficiency.R's output for a (non-sampled) simulation trace."""
+    (steps,), means = _wide_means(
+        [trace.Step.values], trace.Strategy.values, trace.NodesRatio.values
+    )
+    diff_prob_rnd, diff_opt_rnd = _diffs(means, len(steps))
+    sum_prob_rnd, sum_opt_rnd = diff_prob_rnd.sum(), diff_opt_rnd.sum()
+    # Avoid spurious results due to rounding errors; efficiency=0 if Prob=Rnd
+    if abs(sum_prob_rnd) <= 0.01:
+        efficiency = 0.0
+    elif sum_opt_rnd == 0:
+        efficiency = np.nan
+    else:
+        efficiency = sum_prob_rnd / sum_opt_rnd
+
+    # These are constant for non-sampled simulations
+    first = trace.iloc[0]
+    return {
+        "Project": _project(name),
+        "Class": name,
+        "Efficiency": efficiency,
+        "Coverage": first.LinesCoveredBase / first.LinesTotal,
+        "LinesTotal": first.LinesTotal,
+        "TestsRatio": first.TestsSelectedBase / first.TestsTotal,
+        "TestsTotal": first.TestsTotal,
+        "EquiRatio": (first.MutantsTotal - first.MutantsKillable) / first.MutantsTotal,
+        "MutantsTotal": first.MutantsTotal,
+        "SumProbRnd": sum_prob_rnd,
+        "SumOptRnd": sum_opt_rnd,
+        "MaxSteps": steps.max(),
+    }
+
+
+def run_efficiencies(trace: pd.DataFrame, name: str) -> pd.DataFrame:
+    """efficiency_sample.R's output (one row per run) for a sampled simulation trace."""
+    (runs, steps), means = _wide_means(
+        [trace.Run.values, trace.Step.values],
+        trace.Strategy.values,
+        trace.NodesRatio.values,
+    )
+    diff_prob_rnd, diff_opt_rnd = _diffs(means, len(runs))
+    run_ids, run_of = np.unique(runs, return_inverse=True)
+    sum_prob_rnd = np.bincount(run_of, weights=diff_prob_rnd)
+    sum_opt_rnd = np.bincount(run_of, weights=diff_opt_rnd)
+    max_steps = np.zeros(len(run_ids), dtype=np.int64)
+    np.maximum.at(max_steps, run_of, steps)
+
+    efficiency = np.where(
+        sum_opt_rnd <= 0.01,
+        np.nan,
+        np.where(
+            np.abs(sum_prob_rnd) <= 0.01,
+            0.0,
+            sum_prob_rnd / np.where(sum_opt_rnd == 0, 1, sum_opt_rnd),
+        ),
+    )
+
+    per_run = trace.drop_duplicates("Run").set_index("Run").loc[run_ids]
+    return pd.DataFrame(
+        {
+            "Project": _project(name),
+            "Class": name,
+            "Run": run_ids,
+            "Efficiency": efficiency,
+            "Coverage": (per_run.LinesCoveredBase / per_run.LinesTotal).values,
+            "LinesTotal": per_run.LinesTotal.values,
+            "TestsRatio": (per_run.TestsSelectedBase / per_run.TestsTotal).values,
+            "TestsTotal": per_run.TestsTotal.values,
+            "EquiRatio": (
+                (per_run.MutantsTotal - per_run.MutantsKillable) / per_run.MutantsTotal
+            ).values,
+            "MutantsTotal": per_run.MutantsTotal.values,
+            "MaxSteps": max_steps,
+        }
+    )
+
+
+def class_stopping(trace: pd.DataFrame, name: str) -> pd.DataFrame:
+    """stopping.R's output for a simulation trace.
+
+    Averages LinesTotal and MutantsTotal per (Step, MutantUtility, NodesRatio)
+    of the predicted-utility strategy; rows with a NaN NodesRatio are dropped,
+    as by R's aggregate.
+    """
+    df = trace[(trace.Strategy == PREDICTED) & trace.NodesRatio.notna()]
+    agg = (
+        df.groupby(["Step", "MutantUtility", "NodesRatio"])[["LinesTotal", "MutantsTotal"]]
+        .mean()
+        .reset_index()
+        # R's aggregate orders groups with the first grouping variable varying fastest.
+        .sort_values(["NodesRatio", "MutantUtility", "Step"], kind="stable")
+    )
+    return pd.DataFrame(
+        {
+            "Project": _project(name),
+            "Class": name,
+            "Utility": agg.MutantUtility.values,
+            "TestCompleteness": agg.NodesRatio.values,
+            "LinesTotal": agg.LinesTotal.values,
+            "MutantsTotal": agg.MutantsTotal.values,
+            "MaxSteps": agg.Step.max(),
+        }
+    )
+
+
+_EFFICIENCY_COLUMNS = [
+    "Strategy",
+    "Run",
+    "Step",
+    "NodesRatio",
+    "LinesTotal",
+    "LinesCoveredBase",
+    "TestsTotal",
+    "TestsSelectedBase",
+    "MutantsTotal",
+    "MutantsKillable",
+]
+_STOPPING_COLUMNS = [
+    "Strategy",
+    "Step",
+    "MutantUtility",
+    "NodesRatio",
+    "LinesTotal",
+    "MutantsTotal",
+]
+
+
+def _traces(
+    sim_dir: Union[str, pathlib.Path], columns: Sequence[str]
+) -> Iterable[Tuple[str, pd.DataFrame]]:
+    for path in trace_files(sim_dir):
+        name = trace_name(path)
+        trace = read_trace(path, columns)
+        if not len(trace):
+            print(f"No simulation results: {name}", file=sys.stderr)
+            continue
+        if trace.NodesRatio.max() > 1:
+            print(f"Broken simulation results: {name}", file=sys.stderr)
+        yield name, trace
+
+
+def efficiency(sim_dir: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """efficiency.R: overall efficiency of every class; invalid rows are dropped."""
+    rows = [class_efficiency(t, n) for n, t in _traces(sim_dir, _EFFICIENCY_COLUMNS)]
+    return pd.DataFrame(rows).dropna().reset_index(drop=True)
+
+
+def efficiency_sample(sim_dir: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """efficiency_sample.R: efficiency of every class and run; invalid runs are dropped."""
+    parts = [run_efficiencies(t, n) for n, t in _traces(sim_dir, _EFFICIENCY_COLUMNS)]
+    df = pd.concat(parts, ignore_index=True)
+    print(f"{df.isna().any(axis=1).sum()} invalid Runs (NA efficiency)")
+    return df.dropna().reset_index(drop=True)
+
+
+def stopping(sim_dir: Union[str, pathlib.Path]) -> pd.DataFrame:
+    parts = [class_stopping(t, n) for n, t in _traces(sim_dir, _STOPPING_COLUMNS)]
+    return pd.concat(parts, ignore_index=True)
+
+
+def _print_efficiency_table(df: pd.DataFrame) -> None:
+    by_project = df.groupby("Project")[["SumProbRnd", "SumOptRnd"]].sum()
+    by_project["Efficiency"] = by_project.SumProbRnd / by_project.SumOptRnd
+    for pid, eff in by_project.Efficiency.items():
+        print(f"{pid} & {eff:.2f} \\\\")
+    print("\\midrule")
+    print(f"Total & {df.SumProbRnd.sum() / df.SumOptRnd.sum():.2f} \\\\")
+    print("Distribution of efficiency per project")
+    print(by_project.Efficiency.describe())
+    print("Distribution of efficiency per class")
+    print(df.Efficiency.describe())
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    if args.command == "convert":
+        args.out_dir.mkdir(parents=True, exist_ok=True)
+        for path in trace_files(args.in_dir):
+            if path.name.endswith(TRACE_SUFFIX):
+                continue
+            out_path = args.out_dir / (path.stem + TRACE_SUFFIX)
+            write_trace(out_path, read_trace(path))
+            print(f"{path.name}: {path.stat().st_size:,} -> {out_path.stat().st_size:,} bytes")
+        return 0
+
+    if args.command == "efficiency":
+        df = efficiency(args.sim_dir)
+        _print_efficiency_table(df)
+    elif args.command == "efficiency_sample":
+        df = efficiency_sample(args.sim_dir)
+    else:
+        df = stopping(args.sim_dir)
+    df.to_csv(args.out_csv, index=False)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -12,21 +12,35 @@
 #   1) project_id -- Any of the (17) project IDs that are valid in Defects4J.
 #   2) bug_id     -- 1, 2, 3, ... (must be valid for the given project_id).
 #
-# This script accepts two optional named arguments:
+# This script accepts three optional named arguments:
 #   -m mml_file -- path to a compiled mml file (the default is all-mutants.mml.bin in this directory).
 #   -h sshhosts -- A comma-separated series of hosts on which to run this analysis and the number of
 #                  cores to use on each host. `:` is special syntax meaning localhost. For example,
 #                  to run 20 parallel processes on the local machine and 10 on a machine named
 #                  `other`, sshhosts would be `20/:,10/other`.
+#   -p model_file -- plan a partial, model-guided analysis with a model written by
+#                  data_analysis/ml/train_model.py (see partial_analysis.py): only the
+#                  mutants in the plan's fullMutants.txt are run against all covering
+#                  tests; those in firstKillMutants.txt are run until their first kill,
+#                  and all other covered mutants are skipped. The plan is written to
+#                  results/<PID>/<BID>/partialAnalysis/.
 #
 # When this scripts completes, it will have added to results/<PID>/<BID>/ the following
 # files:
 #   killMap.csv    -- The kill matrix. Associates tests with mutants that kill them.
-#                     (Also indicates failures and timeouts.)
+#                     (Also indicates failures and timeouts.) With -p, it only has the
+#                     mutants in fullMutants.txt.
 #   testMap.csv    -- Mapping between test IDs and names, as well as execution runtimes.
 #   covMap.csv     -- Associates test with mutants covering them.
 #   mutants.log    -- Descriptions of each mutant produced during mutation analysis.
 #
+# With -p, it also adds:
+#   partialPlan.csv -- A copy of the plan, marking killMap.csv as partial for the
+#                      downstream scripts.
+#   firstKills.csv  -- Major's outcome (e.g., killed or live) of each mutant in
+#                      firstKillMutants.txt. Major stops at the first kill of these
+#                      mutants and does not report the killing test.
+#
 # Additionally, files that might be useful for debugging:
 #   antOutput.log  -- The stdout and stderr of mutation testing for a particular job
 #                     (batch of mutants).
@@ -48,14 +62,16 @@ realpath --version 2>&1 | grep -q "realpath (GNU coreutils)" || die "realpath no
 # Make sure GNU parallel is available
 parallel --version >/dev/null 2>&1 || die "parallel not available; please run ./init.sh"
 
-USAGE="usage: $0 [-h sshhosts] [-m mml_file] [project_id bug_id]"
+USAGE="usage: $0 [-h sshhosts] [-m mml_file] [-p model_file] [project_id bug_id]"
 
 SSHHOSTS=":"
 MML_FILE="$CM_COLLECTION/all-mutants.mml.bin"
-while getopts ":h:m:" flag; do
+MODEL_FILE=""
+while getopts ":h:m:p:" flag; do
   case "$flag" in
     h) SSHHOSTS="$OPTARG";;
     m) MML="$OPTARG";;
+    p) MODEL_FILE="$OPTARG";;
     \?) die "Unknown flag $flag -- $USAGE";;
   esac
 done
@@ -67,6 +83,12 @@ MML=$(realpath -e "$MML_FILE")
 # The export MML variable is picked up by the 'major' wrapper (utils subdirectory).
 export MML
 
+# Check whether the model file exists and get its absolute path
+if [ -n "$MODEL_FILE" ]; then
+  [ -e "$MODEL_FILE" ] || die "Model file does not exist: $MODEL_FILE"
+  MODEL_FILE=$(realpath -e "$MODEL_FILE")
+fi
+
 # Shift away args parsed by getopts
 shift $((OPTIND - 1))
 
@@ -152,7 +174,27 @@ N_MUT=$(wc -l < "$WORK_DIR/includeMutants.txt")
 N_IDS=10
 mkdir mutantBatches 
 pushd mutantBatches
-split -a5 -l${N_IDS} "$WORK_DIR/includeMutants.txt" "batch-"
+if [ -z "$MODEL_FILE" ]; then
+  split -a5 -l${N_IDS} "$WORK_DIR/includeMutants.txt" "batch-"
+  # A full analysis replaces the results of an earlier partial one
+  rm -f "$CM_RESULTS_ROOT/$PID/$VID/partialPlan.csv" \
+        "$CM_RESULTS_ROOT/$PID/$VID/firstKills.csv"
+else
+  # Partial analysis: batches of "full" mutants export their complete kill
+  # vectors, batches of "first-kill" mutants (batch-first-*) only their
+  # mutant details, since Major writes no kill map without exportKillMap.
+  log_custmut "Plan a partial analysis of the $N_MUT covered mutants with $MODEL_FILE"
+  cp "$WORK_DIR/mutants.log" "$WORK_DIR/mutants.context" "$WORK_DIR/covMap.csv" \
+     "$CM_RESULTS_ROOT/$PID/$VID/"
+  python3 "$CM_COLLECTION/partial_analysis.py" --model "$MODEL_FILE" \
+     "$CM_RESULTS_ROOT/$PID/$VID" >> "$LOG_FILE" 2>&1 \
+     || die "Could not plan the partial analysis"
+  declare -r PLAN_DIR="$CM_RESULTS_ROOT/$PID/$VID/partialAnalysis"
+  shuf "$PLAN_DIR/fullMutants.txt" | split -a5 -l${N_IDS} - "batch-full-"
+  shuf "$PLAN_DIR/firstKillMutants.txt" | split -a5 -l${N_IDS} - "batch-first-"
+  N_MUT=$(cat "$PLAN_DIR/fullMutants.txt" "$PLAN_DIR/firstKillMutants.txt" | wc -l)
+  cp "$PLAN_DIR/plan.csv" "$CM_RESULTS_ROOT/$PID/$VID/partialPlan.csv"
+fi
 popd
 
 # Make sure each job JVM scales its number of threads, based on the number of "available" CPUs.
@@ -204,6 +246,7 @@ parallel --progress                                              \
   --return "$JOBS_DIR/{}/antOutput.log"                          \
   --return "$JOBS_DIR/{}/summary.csv"                            \
   --return "$JOBS_DIR/{}/killMap.csv"                            \
+  --return "$JOBS_DIR/{}/mutantDetails.csv"                      \
   --cleanup                                                      \
   timeout 30m                                                    \
     rsync -a --exclude \".git\" "$WORK_DIR/" "./work" "&&"       \
@@ -214,26 +257,45 @@ parallel --progress                                              \
    "-Dbasedir=$JOBS_DIR/{}/work"                                 \
    "-Dd4j.home=$D4J_HOME"                                        \
    -Dmajor.analysisType=mutation                                 \
-   -Dmajor.exportKillMap=true                                    \
+   "-Dmajor.exportKillMap={= \$_ = /^first-/ ? 'false' : 'true' =}" \
    -Dmajor.haltOnFailure=false                                   \
    "-Dmajor.includeMutantsFile=$JOBS_DIR/{}/batchMutantIDs.txt"  \
    mutation.test ">>" "../antOutput.log" "2>&1" "&&"             \
-  mv summary.csv killMap.csv ".." ";"                            \
+  touch killMap.csv "&&"                                         \
+  mv summary.csv killMap.csv mutantDetails.csv ".." ";"          \
   "main_exitcode=\$?;"                                           \
   cd ".." "&&"                                                   \
   rm -rf work ";"                                                \
   exit "\$main_exitcode"                                         \
   ::: ${batch_ids[@]} || die "parallel failed"
 
-# Collect the jobs' killMaps and summaries into a single file each
-head -n1 "$JOBS_DIR/aaaaa/summary.csv" > "$CM_RESULTS_ROOT/$PID/$VID/summary.csv"
-head -n1 "$JOBS_DIR/aaaaa/killMap.csv" > "$CM_RESULTS_ROOT/$PID/$VID/killMap.csv"
+# Collect the jobs' killMaps and summaries into a single file each. The killMap.csv
+# of a first-kill batch is empty (see above), so take its header from a full batch.
+head -n1 "$JOBS_DIR/${batch_ids[0]}/summary.csv" > "$CM_RESULTS_ROOT/$PID/$VID/summary.csv"
+rm -f "$CM_RESULTS_ROOT/$PID/$VID/killMap.csv"
+for batch_id in "${batch_ids[@]}"; do
+  if [ -s "$JOBS_DIR/$batch_id/killMap.csv" ]; then
+    head -n1 "$JOBS_DIR/$batch_id/killMap.csv" > "$CM_RESULTS_ROOT/$PID/$VID/killMap.csv"
+    break
+  fi
+done
+[ -e "$CM_RESULTS_ROOT/$PID/$VID/killMap.csv" ] || die "No job exported a kill map"
+if [ -n "$MODEL_FILE" ]; then
+  head -n1 "$JOBS_DIR/${batch_ids[0]}/mutantDetails.csv" \
+    > "$CM_RESULTS_ROOT/$PID/$VID/firstKills.csv"
+fi
 for f in mutantBatches/batch-*; do
   batch_id=$(extract_batch_id "$f")
 
   # Copy summary and killMap data
   tail -n+2 "$JOBS_DIR/$batch_id/summary.csv" >> "$CM_RESULTS_ROOT/$PID/$VID/summary.csv"
-  tail -n+2 "$JOBS_DIR/$batch_id/killMap.csv" >> "$CM_RESULTS_ROOT/$PID/$VID/killMap.csv"
+  if [ -s "$JOBS_DIR/$batch_id/killMap.csv" ]; then
+    tail -n+2 "$JOBS_DIR/$batch_id/killMap.csv" >> "$CM_RESULTS_ROOT/$PID/$VID/killMap.csv"
+  fi
+  if [[ $batch_id == first-* ]]; then
+    tail -n+2 "$JOBS_DIR/$batch_id/mutantDetails.csv" \
+      >> "$CM_RESULTS_ROOT/$PID/$VID/firstKills.csv"
+  fi
 
   # Concatenate all job logs into one
   {
@@ -36,6 +36,9 @@ declare -r RESULTS_DIR="$CM_RESULTS_ROOT/$PID/$VID"
 
 # Make sure that Major's data files exist for at least the developer tests.
 [ -e "$RESULTS_DIR/mutants.log" ] || die "Mutant data not found in: $RESULTS_DIR"
+# The subsumption graphs of a partial kill map miss the mutants that were not
+# analyzed in full.
+warn_partial_killmap "$RESULTS_DIR"
 
 declare -r score_matrix="$RESULTS_DIR/scoreMatrix.csv"
 
@@ -41,6 +41,7 @@ declare -r SCORE_MATRIX_FILE="$RESULTS_DIR/scoreMatrix.csv"
 for file in "$MUT_LOG_FILE" "$MUT_CONTEXT_FILE" "$SCORE_MATRIX_FILE" "$DMSGS_FILE"; do
   [ -e "$file" ] || die "Missing data file: $file"
 done
+warn_partial_killmap "$RESULTS_DIR"
 
 # The final output file for the given subject
 declare -r OUT_FILE="$RESULTS_DIR/customized-mutants.csv"
@@ -76,6 +77,12 @@ else
   die "Could not consolidate data files"
 fi
 
-Rscript utils/add_features_labels.R "$DMSGS_FILE" "$KILLMAP_FILE" "$tmp_file" "$OUT_FILE"
+# Compute the pKillsDom and expKilledDomNodes labels (from dmsgs.csv and the
+# kill map)
+declare -r labels_tmp_path=$(mktemp)
+python3 labels.py "$RESULTS_DIR" --out "$labels_tmp_path" \
+  || die "Could not compute labels"
+
+Rscript utils/add_features_labels.R "$DMSGS_FILE" "$KILLMAP_FILE" "$tmp_file" "$OUT_FILE" "$labels_tmp_path"
 
 log_custmut "Successfully created consolidated data file: $OUT_FILE"
@@ -0,0 +1,84 @@
+"""Helpers for bit-packed sets stored as rows of little-endian uint64 words.
+
+Bit `j` of a row is bit `j % 64` of word `j // 64`. Rows are padded with zero
+bits to a whole number of words, so set operations can work a word at a time
+and padding never contributes to counts.
+"""
+
+import numpy as np
+
+WORD_BITS = 64
+WORD_DTYPE = np.dtype("<u8")
+
+# Number of set bits in every byte value; used when np.bitwise_count (NumPy 2)
+# is unavailable.
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def n_words(n_bits: int) -> int:
+    return (n_bits + WORD_BITS - 1) // WORD_BITS
+
+
+def pack(bits: np.ndarray) -> np.ndarray:
+    """Packs a boolean array along its last axis into uint64 words."""
+    bits = np.asarray(bits, dtype=bool)
+    padded = np.zeros(bits.shape[:-1] + (n_words(bits.shape[-1]) * WORD_BITS,), bool)
+    padded[..., : bits.shape[-1]] = bits
+    return np.packbits(padded, axis=-1, bitorder="little").view(WORD_DTYPE)
+
+
+def unpack(words: np.ndarray, n_bits: int) -> np.ndarray:
+    """Inverse of `pack`; returns a boolean array with `n_bits` columns."""
+    as_bytes = np.ascontiguousarray(words, dtype=WORD_DTYPE).view(np.uint8)
+    bits = np.unpackbits(as_bytes, axis=-1, count=n_bits, bitorder="little")
+    return bits.astype(bool)
+
+
+def test_bits(words: np.ndarray, idx: np.ndarray) -> np.ndarray:
+    """Returns bit `idx[i]` of row `i` of `words`."""
+    idx = np.asarray(idx, dtype=np.int64)
+    word = words[np.arange(len(idx)), idx >> 6]
+    return ((word >> (idx & 63).astype(WORD_DTYPE)) & WORD_DTYPE.type(1)).astype(bool)
+
+
+def from_indices(rows: np.ndarray, cols: np.ndarray, shape) -> np.ndarray:
+    """Builds packed rows with bit (rows[i], cols[i]) set for every i.
+
+    Coordinates must be unique. Unlike `pack`, this never materializes the
+    unpacked matrix.
+    """
+    n_rows, n_cols = shape
+    row_bytes = n_words(n_cols) * WORD_DTYPE.itemsize
+    out = np.zeros(n_rows * row_bytes, dtype=np.uint8)
+    rows = np.asarray(rows, dtype=np.int64)
+    cols = np.asarray(cols, dtype=np.int64)
+    if len(rows):
+        byte_idx = rows * row_bytes + (cols >> 3)
+        bit_vals = np.left_shift(1, cols & 7).astype(np.uint8)
+        order = np.argsort(byte_idx, kind="stable")
+        byte_idx = byte_idx[order]
+        starts = np.flatnonzero(np.r_[True, byte_idx[1:] != byte_idx[:-1]])
+        # Distinct bits of one byte do not carry, so their sum is their union.
+        out[byte_idx[starts]] = np.add.reduceat(bit_vals[order], starts)
+    return out.view(WORD_DTYPE).reshape(n_rows, n_words(n_cols))
+
+
+def popcount(words: np.ndarray, axis=-1) -> np.ndarray:
+    """Counts the set bits of packed rows (summed along `axis`)."""
+    words = np.asarray(words, dtype=WORD_DTYPE)
+    if hasattr(np, "bitwise_count"):
+        per_word = np.bitwise_count(words)
+    else:
+        per_byte = _BYTE_POPCOUNT[np.ascontiguousarray(words).view(np.uint8)]
+        per_word = per_byte.reshape(words.shape + (WORD_DTYPE.itemsize,)).sum(
+            axis=-1, dtype=np.int64
+        )
+    return per_word.sum(axis=axis, dtype=np.int64)
+
+
+def union(words: np.ndarray, axis=0) -> np.ndarray:
+    return np.bitwise_or.reduce(np.asarray(words, dtype=WORD_DTYPE), axis=axis)
+
+
+def intersection(words: np.ndarray, axis=0) -> np.ndarray:
+    return np.bitwise_and.reduce(np.asarray(words, dtype=WORD_DTYPE), axis=axis)
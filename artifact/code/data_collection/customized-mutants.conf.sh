@@ -191,3 +191,14 @@ log_custmut() {
   echo "[CUSTMUT] $MSG"
 }
 
+
+# Warn if a subject's kill map comes from a partial analysis (see the -p option
+# of 10_mutation_analysis.sh), in which only the planned mutants have kill vectors.
+# Expects one argument: the subject's results directory.
+warn_partial_killmap() {
+  local -r results_dir=$1
+  if [ -e "$results_dir/partialPlan.csv" ]; then
+    log_custmut "WARNING: $results_dir/killMap.csv is partial (see partialPlan.csv); \
+the results only reflect the mutants analyzed in full" >&2
+  fi
+}
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""Computes derived mutant features, cached per subject.
+
+This is a vectorized implementation of `addContext` in
+utils/add_features_labels.R, plus a registry for new derived features. A
+derived feature is a function of some columns of a subject's
+customized-mutants.csv that returns one or more new columns:
+
+* "nesting": nestingTotal, nestingLoop, and nestingIf (1 plus the number of
+  IF|FOR|WHILE|DO, FOR|WHILE|DO, and IF matches in astStmtContextBasic),
+  maxNestingInSameMethod, and the nesting ratios;
+* "method_position": numMutantsInSameMethod, max/minLineNumberInSameMethod,
+  and lineRatio.
+
+Regex matches are counted once per distinct astStmtContextBasic value, and
+all per-method aggregates (methods are identified by projectId, bugId, and
+methodName, as in R) share one sort of the mutants by method (`MethodGroups`).
+
+Each feature's columns are cached in `<subject dir>/derivedFeatures/<name>.npz`,
+keyed by the feature's version and the size and modification time of the
+subject's customized-mutants.csv. Running this script on subject directories
+only materializes the features that are missing or stale; `load` reads them,
+aligned with the rows of customized-mutants.csv. To add a feature, decorate
+its function with `register`:
+
+    @register("callDepth", inputs=["astContextBasic"], outputs=["callDepth"])
+    def call_depth(groups, df):
+        return {"callDepth": count_matches(df.astContextBasic, "CALL")}
+
+Run `derived_features.py --help` for more information.
+"""
+
+import argparse
+import json
+import pathlib
+import sys
+from typing import Callable, Dict, List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+DEFAULT_DIR_NAME = "derivedFeatures"
+CM_FILE_NAME = "customized-mutants.csv"
+
+# The columns that identify a method, as in add_features_labels.R.
+METHOD_COLUMNS = ["projectId", "bugId", "methodName"]
+
+
+class DerivedFeature(NamedTuple):
+    name: str
+    inputs: List[str]
+    outputs: List[str]
+    compute: Callable[["MethodGroups", pd.DataFrame], Dict[str, np.ndarray]]
+    # Bump when `compute` changes, to invalidate cached values.
+    version: int
+
+
+REGISTRY: Dict[str, DerivedFeature] = {}
+
+
+def register(name: str, inputs: List[str], outputs: List[str], version: int = 1):
+    """Registers a derived feature (decorator).
+
+    The decorated function takes the subject's `MethodGroups` and a DataFrame
+    with (at least) the `inputs` columns, and returns an array per output.
+    """
+
+    def decorator(fn):
+        if name in REGISTRY:
+            raise ValueError(f"Derived feature {name} is already registered")
+        REGISTRY[name] = DerivedFeature(name, list(inputs), list(outputs), fn, version)
+        return fn
+
+    return decorator
+
+
+class MethodGroups:
+    """The mutants of a subject grouped by method, for per-method aggregates."""
+
+    def __init__(self, df: pd.DataFrame):
+        self.codes = df.groupby(METHOD_COLUMNS, sort=False, dropna=False).ngroup()
+        self.codes = self.codes.values
+        self.order = np.argsort(self.codes, kind="stable")
+        sorted_codes = self.codes[self.order]
+        self.starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+
+    def _reduce(self, ufunc: np.ufunc, values: np.ndarray) -> np.ndarray:
+        values = np.asarray(values, dtype=np.float64)
+        if not len(values):
+            return values
+        return ufunc.reduceat(values[self.order], self.starts)[self.codes]
+
+    def size(self) -> np.ndarray:
+        """The number of mutants in each row's method."""
+        return np.bincount(self.codes)[self.codes]
+
+    def max(self, values: np.ndarray) -> np.ndarray:
+        """The maximum (ignoring NaN) of `values` in each row's method."""
+        return self._reduce(np.fmax, values)
+
+    def min(self, values: np.ndarray) -> np.ndarray:
+        """The minimum (ignoring NaN) of `values` in each row's method."""
+        return self._reduce(np.fmin, values)
+
+
+def count_matches(values: pd.Series, pattern: str) -> np.ndarray:
+    """Counts the (non-overlapping) regex matches in each value, like str_count.
+
+    Matches are counted once per distinct value; missing values give NaN.
+    """
+    codes, uniques = pd.factorize(values)
+    counts = pd.Series(uniques, dtype=object).str.count(pattern).values
+    counts = np.append(counts.astype(np.float64), np.nan)
+    return counts[codes]
+
+
+@register(
+    "nesting",
+    inputs=["astStmtContextBasic"],
+    outputs=[
+        "nestingTotal",
+        "nestingLoop",
+        "nestingIf",
+        "maxNestingInSameMethod",
+        "nestingRatioTotal",
+        "nestingRatioLoop",
+        "nestingRatioIf",
+    ],
+)
+def nesting(groups: MethodGroups, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    context = df.astStmtContextBasic
+    total = 1 + count_matches(context, "IF|FOR|WHILE|DO")
+    loop = 1 + count_matches(context, "FOR|WHILE|DO")
+    if_ = 1 + count_matches(context, "IF")
+    max_total = groups.max(total)
+    return {
+        "nestingTotal": total,
+        "nestingLoop": loop,
+        "nestingIf": if_,
+        "maxNestingInSameMethod": max_total,
+        "nestingRatioTotal": total / max_total,
+        "nestingRatioLoop": loop / max_total,
+        "nestingRatioIf": if_ / max_total,
+    }
+
+
+@register(
+    "method_position",
+    inputs=["lineNumber"],
+    outputs=[
+        "numMutantsInSameMethod",
+        "maxLineNumberInSameMethod",
+        "minLineNumberInSameMethod",
+        "lineRatio",
+    ],
+)
+def method_position(groups: MethodGroups, df: pd.DataFrame) -> Dict[str, np.ndarray]:
+    line = df.lineNumber.values.astype(np.float64)
+    max_line = groups.max(line)
+    min_line = groups.min(line)
+    # Methods with mutants on a single line have a lineRatio of NaN (0/0).
+    with np.errstate(invalid="ignore", divide="ignore"):
+        line_ratio = (line - min_line) / (max_line - min_line)
+    return {
+        "numMutantsInSameMethod": groups.size(),
+        "maxLineNumberInSameMethod": max_line,
+        "minLineNumberInSameMethod": min_line,
+        "lineRatio": line_ratio,
+    }
+
+
+def compute(
+    df: pd.DataFrame, names: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Computes the derived features `names` (default: all) of one subject."""
+    names = list(REGISTRY) if names is None else list(names)
+    groups = MethodGroups(df)
+    columns = {}
+    for name in names:
+        columns.update(REGISTRY[name].compute(groups, df))
+    return pd.DataFrame(columns, index=df.index)
+
+
+def read_cm_columns(cm_path: pathlib.Path, columns: Sequence[str]) -> pd.DataFrame:
+    """Reads columns of customized-mutants.csv like R's fread.
+
+    Only "NA" is a missing value; empty fields (e.g., an empty
+    astStmtContextBasic) are empty strings.
+    """
+    return pd.read_csv(
+        cm_path, usecols=list(columns), keep_default_na=False, na_values=["NA"]
+    )
+
+
+def _cache_key(feature: DerivedFeature, cm_path: pathlib.Path) -> str:
+    stat = cm_path.stat()
+    return json.dumps(
+        {
+            "name": feature.name,
+            "version": feature.version,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+        },
+        sort_keys=True,
+    )
+
+
+def _cache_path(subject_dir: pathlib.Path, name: str) -> pathlib.Path:
+    return subject_dir / DEFAULT_DIR_NAME / f"{name}.npz"
+
+
+def _read_cached(
+    subject_dir: pathlib.Path, feature: DerivedFeature
+) -> Optional[Dict[str, np.ndarray]]:
+    path = _cache_path(subject_dir, feature.name)
+    if not path.exists():
+        return None
+    with np.load(path, allow_pickle=False) as npz:
+        if str(npz["key"]) != _cache_key(feature, subject_dir / CM_FILE_NAME):
+            return None
+        return {column: npz[column] for column in feature.outputs}
+
+
+def missing_features(
+    subject_dir: Union[str, pathlib.Path], names: Optional[Sequence[str]] = None
+) -> List[str]:
+    """Returns the features of `names` (default: all) that are not cached."""
+    subject_dir = pathlib.Path(subject_dir)
+    names = list(REGISTRY) if names is None else list(names)
+    return [n for n in names if _read_cached(subject_dir, REGISTRY[n]) is None]
+
+
+def materialize(
+    subject_dir: Union[str, pathlib.Path],
+    names: Optional[Sequence[str]] = None,
+    force: bool = False,
+) -> List[str]:
+    """Computes and caches the missing (or, if `force`, all) features.
+
+    Returns:
+        The names of the features that were computed.
+    """
+    subject_dir = pathlib.Path(subject_dir)
+    names = list(REGISTRY) if names is None else list(names)
+    todo = names if force else missing_features(subject_dir, names)
+    if not todo:
+        return []
+    cm_path = subject_dir / CM_FILE_NAME
+    inputs = sorted(set(METHOD_COLUMNS).union(*(REGISTRY[n].inputs for n in todo)))
+    df = read_cm_columns(cm_path, inputs)
+    values = compute(df, todo)
+    (subject_dir / DEFAULT_DIR_NAME).mkdir(exist_ok=True)
+    for name in todo:
+        feature = REGISTRY[name]
+        np.savez(
+            _cache_path(subject_dir, name),
+            key=np.array(_cache_key(feature, cm_path)),
+            **{column: values[column].values for column in feature.outputs},
+        )
+    return todo
+
+
+def load(
+    subject_dir: Union[str, pathlib.Path], names: Optional[Sequence[str]] = None
+) -> pd.DataFrame:
+    """Returns the derived features of a subject, materializing missing ones.
+
+    Rows are aligned with the subject's customized-mutants.csv.
+    """
+    subject_dir = pathlib.Path(subject_dir)
+    names = list(REGISTRY) if names is None else list(names)
+    materialize(subject_dir, names)
+    columns = {}
+    for name in names:
+        cached = _read_cached(subject_dir, REGISTRY[name])
+        assert cached is not None, f"{name} was not materialized"
+        columns.update(cached)
+    return pd.DataFrame(columns)
+
+
+arg_parser = argparse.ArgumentParser(
+    description="Materialize derived mutant features for subjects."
+)
+arg_parser.add_argument(
+    "subject_dirs",
+    type=pathlib.Path,
+    nargs="+",
+    help=f"Directories containing {CM_FILE_NAME}.",
+)
+arg_parser.add_argument(
+    "--features",
+    nargs="+",
+    default=None,
+    choices=sorted(REGISTRY),
+    help="The derived features to materialize (default: all).",
+)
+arg_parser.add_argument(
+    "--force",
+    action="store_true",
+    help="Recompute features even if they are cached.",
+)
+arg_parser.add_argument(
+    "--check",
+    action="store_true",
+    help=f"Compare the derived features with the columns in {CM_FILE_NAME}.",
+)
+arg_parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=1e-12,
+    help="The maximum absolute difference accepted by --check.",
+)
+
+
+def check(subject_dir: pathlib.Path, names: Sequence[str], tolerance: float) -> bool:
+    actual = load(subject_dir, names)
+    expected = read_cm_columns(subject_dir / CM_FILE_NAME, actual.columns)
+    ok = True
+    for column in actual.columns:
+        a, e = actual[column].values, expected[column].values.astype(np.float64)
+        nan_mismatch = np.isnan(a) != np.isnan(e)
+        both = ~np.isnan(a) & ~np.isnan(e)
+        diff = np.abs(a[both] - e[both]).max(initial=0.0)
+        print(f"{subject_dir}: {column}: max absolute difference {diff:.3g}")
+        if nan_mismatch.any() or diff > tolerance:
+            print(f"{column} does not match {CM_FILE_NAME}", file=sys.stderr)
+            ok = False
+    return ok
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    ok = True
+    for subject_dir in args.subject_dirs:
+        computed = materialize(subject_dir, args.features, force=args.force)
+        print(f"{subject_dir}: computed {', '.join(computed) or 'nothing'}")
+        if args.check:
+            names = args.features or list(REGISTRY)
+            ok = check(subject_dir, names, args.tolerance) and ok
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
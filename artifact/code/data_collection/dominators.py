@@ -0,0 +1,397 @@
+#!/usr/bin/env python3
+"""Recomputes dominator mutant subsumption graphs (DMSGs) from a kill matrix.
+
+20_dmsg_analysis.sh computes a subject's dmsgs.csv with the Java
+MutantAnalyzer, one score-matrix slice per top-level class. This module
+computes the same graph nodes and dominators in memory, from the bit-packed
+kill matrix (see killmatrix.py), for any subset of the tests and mutants, so
+what-if questions (e.g., dropping the EvoSuite tests, or disabling a mutation
+operator) do not require rerunning the stage:
+
+* Mutants with identical kill vectors (restricted to the test subset) form
+  one node (groupId). Nodes are numbered 1, 2, ... in order of their smallest
+  mutant id.
+* A node that no test kills is equivalent (dominatorStrength -1).
+* A killed node is subsumed (dominatorStrength 0) if another node's kill set
+  is a strict subset of its kill set, and a dominator (dominatorStrength 1)
+  otherwise. MutantAnalyzer's fractional scores for subsumed mutants are not
+  reproduced; all consumers of dmsgs.csv only distinguish 1, [0, 1), and -1.
+
+Dominators are found without comparing all pairs of nodes: nodes are visited
+in increasing order of their number of killing tests, and a node is a
+dominator iff none of the dominators found so far is a subset of it (a node
+that is subsumed is always subsumed by some dominator with fewer killing
+tests). Nodes with equally many killing tests cannot subsume each other, so
+each such level is checked at once with word-wise (d & ~n) == 0 tests.
+
+`ClassKills` holds a class's kill vectors, restricted to the 64-bit words of
+tests that kill any of its mutants, so that evaluating many subsets of one
+class only touches those words.
+
+Run `dominators.py --help` for more information.
+"""
+
+import argparse
+import pathlib
+import sys
+from typing import List, NamedTuple, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+import bitset
+import killmatrix
+import labels
+
+DMSG_COLUMNS = ["mutantId", "groupId", "dominatorStrength", "class"]
+
+# Upper bound on the number of words compared at once (limits the size of the
+# temporary arrays of the subset checks).
+_BLOCK_WORDS = 1 << 22
+
+arg_parser = argparse.ArgumentParser(
+    description="Recompute a subject's dmsgs for a subset of its tests and mutants."
+)
+arg_parser.add_argument(
+    "subject_dir",
+    type=pathlib.Path,
+    help="A directory containing a kill matrix, testMap.csv, and mutants.log.",
+)
+arg_parser.add_argument(
+    "--include_tests",
+    type=str,
+    default=None,
+    help="Only use the tests whose name (in testMap.csv) matches this regex.",
+)
+arg_parser.add_argument(
+    "--exclude_tests",
+    type=str,
+    default=None,
+    help="Drop the tests whose name (in testMap.csv) matches this regex.",
+)
+arg_parser.add_argument(
+    "--exclude_operators",
+    type=str,
+    nargs="+",
+    default=[],
+    help="Drop the mutants of these mutation operators (as in mutants.log).",
+)
+arg_parser.add_argument(
+    "--out",
+    type=pathlib.Path,
+    default=None,
+    help="Write the recomputed dmsgs (in the format of dmsgs.csv) to this csv.",
+)
+arg_parser.add_argument(
+    "--labels_out",
+    type=pathlib.Path,
+    default=None,
+    help="Write the labels under the subsets (see labels.py) to this csv.",
+)
+arg_parser.add_argument(
+    "--check",
+    action="store_true",
+    help="Compare the nodes and dominators of all tests and mutants with dmsgs.csv.",
+)
+
+
+def _block_rows(n_other: int, n_words: int) -> int:
+    return max(1, _BLOCK_WORDS // max(1, n_other * n_words))
+
+
+def _has_subset(sets: np.ndarray, vectors: np.ndarray) -> np.ndarray:
+    """Returns, for each of `vectors`, whether any of `sets` is a subset of it."""
+    out = np.zeros(len(vectors), dtype=bool)
+    if not len(sets):
+        return out
+    step = _block_rows(len(sets), vectors.shape[1])
+    for start in range(0, len(vectors), step):
+        block = ~vectors[start : start + step, None, :]
+        subset = ((sets[None] & block) == 0).all(axis=-1)
+        out[start : start + step] = subset.any(axis=-1)
+    return out
+
+
+def find_dominators(vectors: np.ndarray) -> np.ndarray:
+    """Returns which of the distinct, packed kill vectors are dominators.
+
+    A nonempty vector is a dominator iff no other vector is a strict subset of
+    it; empty vectors (equivalent mutants) are never dominators.
+    """
+    counts = bitset.popcount(vectors)
+    order = np.argsort(counts, kind="stable")
+    order = order[counts[order] > 0]
+    level_starts = np.flatnonzero(np.r_[True, np.diff(counts[order]) != 0])
+    is_dominator = np.zeros(len(vectors), dtype=bool)
+    dominators = vectors[:0]
+    for level in np.split(order, level_starts[1:]):
+        new = level[~_has_subset(dominators, vectors[level])]
+        is_dominator[new] = True
+        dominators = np.concatenate([dominators, vectors[new]])
+    return is_dominator
+
+
+class Dmsg(NamedTuple):
+    """The DMSG of a set of mutants.
+
+    `node` maps each mutant to a row of `vectors`, the distinct (packed) kill
+    vectors; nodes are ordered by their first mutant.
+    """
+
+    mutant_ids: np.ndarray
+    node: np.ndarray
+    vectors: np.ndarray
+    is_dominator: np.ndarray
+
+    @property
+    def is_equivalent(self) -> np.ndarray:
+        return ~self.vectors.any(axis=1)
+
+    def dominator_strength(self) -> np.ndarray:
+        """1 for dominators, -1 for equivalent mutants, and 0 otherwise."""
+        strength = np.where(self.is_dominator, 1.0, 0.0)
+        strength[self.is_equivalent] = -1.0
+        return strength[self.node]
+
+    def subsumption(self) -> np.ndarray:
+        """Returns a node x node matrix, true where node i subsumes node j.
+
+        Node i subsumes node j if both are killed and the tests that kill i
+        are a strict subset of those that kill j.
+        """
+        n, n_words = self.vectors.shape
+        out = np.zeros((n, n), dtype=bool)
+        step = _block_rows(n, n_words)
+        for start in range(0, n, step):
+            block = self.vectors[start : start + step, None, :]
+            out[start : start + step] = ((block & ~self.vectors[None]) == 0).all(-1)
+        killed = ~self.is_equivalent
+        out &= killed[:, None] & killed[None, :]
+        np.fill_diagonal(out, False)
+        return out
+
+    def frame(self, class_name: str) -> pd.DataFrame:
+        """Returns the DMSG as rows of dmsgs.csv (without projectId and bugId)."""
+        return pd.DataFrame(
+            {
+                "mutantId": self.mutant_ids,
+                "groupId": self.node + 1,
+                "dominatorStrength": self.dominator_strength(),
+                "class": class_name,
+            }
+        )
+
+
+def build_dmsg(mutant_ids: np.ndarray, vectors: np.ndarray) -> Dmsg:
+    """Builds the DMSG of mutants with the given packed kill vectors."""
+    vectors = np.ascontiguousarray(vectors, dtype=bitset.WORD_DTYPE)
+    if not vectors.shape[1]:
+        # No killing tests: all mutants are equivalent and form one node.
+        vectors = np.zeros((len(vectors), 1), dtype=bitset.WORD_DTYPE)
+    rows = vectors.view(np.dtype((np.void, vectors.dtype.itemsize * vectors.shape[1])))
+    _, first, inverse = np.unique(rows.ravel(), return_index=True, return_inverse=True)
+    # Number the nodes in order of their first mutant.
+    order = np.argsort(first)
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    unique = vectors[first[order]]
+    return Dmsg(
+        np.asarray(mutant_ids), rank[inverse.ravel()], unique, find_dominators(unique)
+    )
+
+
+def test_mask(n_tests: int, cols: Sequence[int]) -> np.ndarray:
+    """Returns the packed set of the test columns `cols`."""
+    cols = np.unique(np.asarray(cols, dtype=np.int64))
+    return bitset.from_indices(np.zeros_like(cols), cols, (1, n_tests))[0]
+
+
+class ClassKills:
+    """The kill vectors of one top-level class, for DMSGs of many subsets."""
+
+    def __init__(self, km: killmatrix.KillMatrix, class_name: str):
+        rows = km.class_rows(class_name)
+        vectors = km.kill_vectors(rows)
+        self.class_name = class_name
+        self.mutant_ids = np.asarray(km.mutant_ids[rows])
+        # Only the words of tests that kill some mutant of the class matter.
+        self.words = np.flatnonzero(bitset.union(vectors))
+        self.vectors = np.ascontiguousarray(vectors[:, self.words])
+
+    def dmsg(
+        self, tests: Optional[np.ndarray] = None, mutants: Optional[np.ndarray] = None
+    ) -> Dmsg:
+        """Returns the DMSG of the class under a test and mutant subset.
+
+        Args:
+            tests: A packed set of test columns (see `test_mask`); all tests by
+                default.
+            mutants: A boolean mask over the class's mutants; all by default.
+        """
+        vectors, mutant_ids = self.vectors, self.mutant_ids
+        if mutants is not None:
+            vectors, mutant_ids = vectors[mutants], mutant_ids[mutants]
+        if tests is not None:
+            vectors = vectors & tests[self.words]
+        return build_dmsg(mutant_ids, vectors)
+
+
+def subject_dmsgs(
+    km: killmatrix.KillMatrix,
+    tests: Optional[np.ndarray] = None,
+    mutants: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Returns the DMSGs of all classes, like dmsgs.csv without projectId/bugId.
+
+    Args:
+        tests: A packed set of test columns; all tests by default.
+        mutants: A boolean mask over the kill matrix rows; all by default.
+    """
+    frames = []
+    for class_name, rows in km.classes.items():
+        class_mutants = None if mutants is None else mutants[rows]
+        dmsg = ClassKills(km, class_name).dmsg(tests, class_mutants)
+        frames.append(dmsg.frame(class_name))
+    if not frames:
+        return pd.DataFrame(columns=DMSG_COLUMNS)
+    return pd.concat(frames).sort_values("mutantId", kind="stable")
+
+
+def read_mutant_operators(mutants_log: Union[str, pathlib.Path]) -> pd.Series:
+    """Returns the mutation operator of each mutant in mutants.log, by mutant id."""
+    ids = []
+    operators = []
+    with open(mutants_log, encoding="utf8", errors="replace") as fo:
+        for line in fo:
+            fields = line.split(":", 5)
+            if len(fields) < 6:
+                continue
+            ids.append(int(fields[0]))
+            operators.append(fields[1])
+    return pd.Series(
+        operators, index=pd.Index(ids, name="mutantId"), name="mutationOperator"
+    )
+
+
+def select_tests(
+    km: killmatrix.KillMatrix,
+    test_names: pd.Series,
+    include: Optional[str] = None,
+    exclude: Optional[str] = None,
+) -> np.ndarray:
+    """Returns the packed set of tests whose names pass the regex filters.
+
+    Args:
+        test_names: Test names indexed by test id (TestNo), as in testMap.csv.
+    """
+    names = test_names.reindex(km.test_ids).fillna("").astype(str)
+    keep = np.ones(km.n_tests, dtype=bool)
+    if include is not None:
+        keep &= names.str.contains(include, regex=True).values
+    if exclude is not None:
+        keep &= ~names.str.contains(exclude, regex=True).values
+    return test_mask(km.n_tests, np.flatnonzero(keep))
+
+
+def subset_labels(
+    km: killmatrix.KillMatrix,
+    dmsgs: pd.DataFrame,
+    tests: Optional[np.ndarray] = None,
+    mutants: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """Computes the labels (see labels.py) from the kills within the subsets."""
+    coo = km.status().tocoo()
+    keep = np.ones(len(coo.row), dtype=bool)
+    if tests is not None:
+        keep &= bitset.unpack(tests, km.n_tests)[coo.col]
+    if mutants is not None:
+        keep &= mutants[coo.row]
+    return labels.compute_labels(
+        km.mutant_ids[coo.row[keep]], km.test_ids[coo.col[keep]], dmsgs
+    )
+
+
+def same_dmsgs(actual: pd.DataFrame, expected: pd.DataFrame) -> List[str]:
+    """Returns the classes whose nodes or dominators differ between two dmsgs."""
+    merged = actual.merge(
+        expected, on=["class", "mutantId"], how="outer", suffixes=("", "_exp")
+    )
+    differing = []
+    for class_name, df in merged.groupby("class", sort=True):
+        if df.isna().any().any():
+            differing.append(class_name)
+            continue
+        # Group ids are arbitrary; compare the partitions they induce.
+        pairs = df[["groupId", "groupId_exp"]].drop_duplicates()
+        same_nodes = pairs.groupId.is_unique and pairs.groupId_exp.is_unique
+        strength, strength_exp = df.dominatorStrength, df.dominatorStrength_exp
+        same_dominators = ((strength == 1) == (strength_exp == 1)).all()
+        same_equivalent = ((strength < 0) == (strength_exp < 0)).all()
+        if not (same_nodes and same_dominators and same_equivalent):
+            differing.append(class_name)
+    return differing
+
+
+def _summary(dmsgs: pd.DataFrame) -> str:
+    strength = dmsgs.dominatorStrength
+    return (
+        f"{len(dmsgs)} mutants, {(strength == 1).sum()} dominators, "
+        f"{(strength < 0).sum()} equivalent"
+    )
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    km_dir = args.subject_dir / killmatrix.DEFAULT_DIR_NAME
+    if not (km_dir / "meta.json").exists():
+        print(f"No kill matrix in {km_dir}; run killmatrix.py first", file=sys.stderr)
+        return 1
+    km = killmatrix.KillMatrix(km_dir)
+
+    tests = None
+    if args.include_tests is not None or args.exclude_tests is not None:
+        test_map = pd.read_csv(args.subject_dir / "testMap.csv")
+        test_names = pd.Series(test_map.TestName.values, index=test_map.TestNo.values)
+        tests = select_tests(km, test_names, args.include_tests, args.exclude_tests)
+        print(f"Using {bitset.popcount(tests)} of {km.n_tests} tests")
+    mutants = None
+    if args.exclude_operators:
+        operators = read_mutant_operators(args.subject_dir / "mutants.log")
+        excluded = operators.reindex(km.mutant_ids).isin(args.exclude_operators)
+        mutants = ~excluded.values
+        print(f"Using {mutants.sum()} of {km.n_mutants} mutants")
+
+    dmsgs = subject_dmsgs(km, tests, mutants)
+    print(f"Recomputed dmsgs: {_summary(dmsgs)}")
+    if args.out is not None:
+        print(f"Writing to: {args.out}")
+        out = dmsgs.assign(
+            projectId=args.subject_dir.parent.name,
+            bugId=args.subject_dir.name.rstrip("f"),
+        )
+        out[DMSG_COLUMNS[:3] + ["projectId", "bugId", "class"]].to_csv(
+            args.out, index=False
+        )
+    if args.labels_out is not None:
+        print(f"Writing labels to: {args.labels_out}")
+        subset = subset_labels(km, dmsgs, tests, mutants)
+        subset.reset_index().to_csv(args.labels_out, index=False)
+
+    if args.check:
+        expected = pd.read_csv(args.subject_dir / "dmsgs.csv")
+        print(f"dmsgs.csv: {_summary(expected)}")
+        if tests is not None or mutants is not None:
+            print("--check compares the dmsgs of all tests and mutants")
+            dmsgs = subject_dmsgs(km)
+        differing = same_dmsgs(dmsgs, expected)
+        if differing:
+            print(f"dmsgs differ for: {', '.join(differing)}", file=sys.stderr)
+            return 1
+        print("Nodes and dominators match dmsgs.csv")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""Converts Major's kill map into a compact, memory-mappable kill matrix.
+
+Major's killMap.csv lists one (TestNo, MutantNo, status) row per kill. This
+script stores the same data as a mutant x test matrix in a directory
+(`<subject dir>/killMatrix` by default) containing:
+
+* `by_mutant.npy`: one bit-packed row per mutant, with a bit per test (see
+  bitset.py for the layout);
+* `by_test.npy`: the transpose, one bit-packed row per test;
+* `status_indptr.npy`, `status_indices.npy`, `status_codes.npy`: a CSR matrix
+  parallel to `by_mutant` with the kill reason of every kill (`STATUS_CODES`);
+* `mutant_ids.npy`, `test_ids.npy`: the MutantNo and TestNo of each row and
+  column; and
+* `meta.json`: the dimensions and the row range of each top-level class.
+
+Mutant rows are ordered by top-level class (as extracted from mutants.log by
+utils/slice_score_matrix.R) and then by mutant id, so each class is a
+contiguous range of rows. `KillMatrix` reads the arrays memory-mapped.
+
+Run `killmatrix.py --help` for more information.
+"""
+
+import argparse
+import json
+import pathlib
+import re
+import sys
+from typing import Dict, Iterable, List, Union
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import bitset
+
+FORMAT_VERSION = 1
+DEFAULT_DIR_NAME = "killMatrix"
+
+# Kill reasons as they appear in killMap.csv. Code 0 means "not killed".
+STATUS_CODES = {"FAIL": 1, "TIME": 2, "EXC": 3}
+
+# Same as the regex in utils/slice_score_matrix.R: strips inner classes
+# ($...) and methods (@...) from a mutation target.
+_TOP_LEVEL_CLASS_RE = re.compile(r"^([^$^@]+)(\$[^@]+)?(@.+)?$")
+
+_ARRAYS = [
+    "by_mutant",
+    "by_test",
+    "status_indptr",
+    "status_indices",
+    "status_codes",
+    "mutant_ids",
+    "test_ids",
+]
+
+arg_parser = argparse.ArgumentParser(
+    description="Convert killMap.csv files into bit-packed kill matrices."
+)
+arg_parser.add_argument(
+    "subject_dirs",
+    type=pathlib.Path,
+    nargs="+",
+    help="Directories containing killMap.csv, testMap.csv, and mutants.log.",
+)
+arg_parser.add_argument(
+    "--out_name",
+    type=str,
+    default=DEFAULT_DIR_NAME,
+    help="The name of the output directory, created in each subject directory.",
+)
+
+
+def top_level_class(target: str) -> str:
+    return _TOP_LEVEL_CLASS_RE.sub(r"\1", target)
+
+
+def read_mutants_log(mutants_log: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """Returns the target of each mutant in mutants.log, by mutant id.
+
+    The columns are the top-level class (className), the mutation target
+    (methodName; the class, plus the method if applicable), and lineNumber.
+
+    Format of mutants.log (no header):
+    mutant id:mutation operator:from:to:mutation target:line number:details
+    """
+    ids = []
+    targets = []
+    lines = []
+    with open(mutants_log, encoding="utf8", errors="replace") as fo:
+        for line in fo:
+            fields = line.split(":", 5)
+            if len(fields) < 6:
+                continue
+            ids.append(int(fields[0]))
+            targets.append(fields[4])
+            lines.append(int(fields[5].split(":", 1)[0]))
+    return pd.DataFrame(
+        {
+            "className": [top_level_class(t) for t in targets],
+            "methodName": targets,
+            "lineNumber": lines,
+        },
+        index=pd.Index(ids, name="mutantId"),
+    )
+
+
+def read_mutant_classes(mutants_log: Union[str, pathlib.Path]) -> pd.Series:
+    """Returns the top-level class of each mutant in mutants.log, by mutant id."""
+    return read_mutants_log(mutants_log).className
+
+
+def read_kill_map(kill_map_csv: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """Returns the TestNo, MutantNo, and (stripped) status of every kill.
+
+    TestNo and MutantNo are read by name; the kill reason is the third column,
+    whatever its header.
+    """
+    df = pd.read_csv(kill_map_csv)
+    columns = list(df.columns)
+    id_columns = {"TestNo", "MutantNo"}
+    if len(columns) != 3 or not id_columns <= set(columns) or columns[2] in id_columns:
+        raise ValueError(
+            f"Expected TestNo, MutantNo, and a status column in {kill_map_csv}, "
+            f"got {columns}"
+        )
+    df = pd.DataFrame(
+        {
+            "TestNo": df["TestNo"],
+            "MutantNo": df["MutantNo"],
+            "status": df[columns[2]].astype(str).str.strip(),
+        }
+    )
+    return df
+
+
+def convert(
+    kill_map_csv: Union[str, pathlib.Path],
+    test_map_csv: Union[str, pathlib.Path],
+    mutants_log: Union[str, pathlib.Path],
+    out_dir: Union[str, pathlib.Path],
+) -> None:
+    """Writes the kill matrix of one subject to `out_dir`."""
+    kill_map = read_kill_map(kill_map_csv)
+    test_ids = np.sort(pd.read_csv(test_map_csv).TestNo.values.astype(np.int64))
+    mutant_classes = read_mutant_classes(mutants_log)
+
+    order = np.lexsort((mutant_classes.index.values, mutant_classes.values))
+    mutant_classes = mutant_classes.iloc[order]
+    mutant_ids = mutant_classes.index.values.astype(np.int64)
+
+    rows = pd.Index(mutant_ids).get_indexer(kill_map.MutantNo.values)
+    cols = pd.Index(test_ids).get_indexer(kill_map.TestNo.values)
+    if (rows < 0).any():
+        raise ValueError("killMap.csv has mutants that are not in mutants.log")
+    if (cols < 0).any():
+        raise ValueError("killMap.csv has tests that are not in testMap.csv")
+    codes = kill_map.status.map(STATUS_CODES)
+    if codes.isna().any():
+        unknown = sorted(set(kill_map.status[codes.isna()]))
+        raise ValueError(f"Unknown kill status in killMap.csv: {unknown}")
+
+    status = sparse.csr_matrix(
+        (codes.values.astype(np.uint8), (rows, cols)),
+        shape=(len(mutant_ids), len(test_ids)),
+    )
+    status.sort_indices()
+    if status.nnz != len(kill_map):
+        raise ValueError("killMap.csv has duplicate (test, mutant) pairs")
+
+    # The rows are sorted by class (see the lexsort above), so classes are
+    # contiguous.
+    class_names, class_starts = np.unique(mutant_classes.values, return_index=True)
+    class_stops = np.r_[class_starts[1:], len(mutant_ids)]
+    meta = {
+        "version": FORMAT_VERSION,
+        "nMutants": len(mutant_ids),
+        "nTests": len(test_ids),
+        "nKills": int(status.nnz),
+        "classes": [
+            {"name": name, "start": int(start), "stop": int(stop)}
+            for name, start, stop in zip(class_names, class_starts, class_stops)
+        ],
+    }
+
+    out_dir = pathlib.Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    coo = status.tocoo()
+    arrays = {
+        "by_mutant": bitset.from_indices(coo.row, coo.col, status.shape),
+        "by_test": bitset.from_indices(coo.col, coo.row, status.shape[::-1]),
+        "status_indptr": status.indptr.astype(np.int64),
+        "status_indices": status.indices.astype(np.int32),
+        "status_codes": status.data,
+        "mutant_ids": mutant_ids,
+        "test_ids": test_ids,
+    }
+    for name in _ARRAYS:
+        np.save(out_dir / f"{name}.npy", arrays[name])
+    # Written last, so an existing meta.json marks a complete conversion.
+    with open(out_dir / "meta.json", "w") as fo:
+        json.dump(meta, fo, indent=1)
+
+
+class KillMatrix:
+    """A read-only view of a converted kill matrix.
+
+    Rows are mutants and columns are tests, both addressed by position; use
+    `mutant_rows` and `test_columns` to look up positions by id.
+    """
+
+    def __init__(self, path: Union[str, pathlib.Path], mmap: bool = True):
+        path = pathlib.Path(path)
+        with open(path / "meta.json") as fo:
+            meta = json.load(fo)
+        if meta["version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported kill matrix version {meta['version']} in {path}"
+            )
+        mmap_mode = "r" if mmap else None
+        for name in _ARRAYS:
+            setattr(self, name, np.load(path / f"{name}.npy", mmap_mode=mmap_mode))
+        self.n_mutants = meta["nMutants"]
+        self.n_tests = meta["nTests"]
+        self.classes: Dict[str, slice] = {
+            c["name"]: slice(c["start"], c["stop"]) for c in meta["classes"]
+        }
+        self._mutant_index = pd.Index(self.mutant_ids)
+        self._test_index = pd.Index(self.test_ids)
+
+    @property
+    def shape(self):
+        return (self.n_mutants, self.n_tests)
+
+    def mutant_rows(self, mutant_ids: Iterable[int]) -> np.ndarray:
+        rows = self._mutant_index.get_indexer(np.asarray(mutant_ids))
+        if (rows < 0).any():
+            raise KeyError("Unknown mutant id")
+        return rows
+
+    def test_columns(self, test_ids: Iterable[int]) -> np.ndarray:
+        cols = self._test_index.get_indexer(np.asarray(test_ids))
+        if (cols < 0).any():
+            raise KeyError("Unknown test id")
+        return cols
+
+    def class_rows(self, class_name: str) -> slice:
+        return self.classes[class_name]
+
+    def kill_vectors(self, rows=slice(None)) -> np.ndarray:
+        """Returns the packed kill vectors (over all tests) of the given mutant rows."""
+        return np.asarray(self.by_mutant[rows])
+
+    def kill_sets(self, cols=slice(None)) -> np.ndarray:
+        """Returns the packed sets of killed mutant rows of the given test columns."""
+        return np.asarray(self.by_test[cols])
+
+    def num_killing_tests(self, rows=slice(None)) -> np.ndarray:
+        return bitset.popcount(self.kill_vectors(rows))
+
+    def num_killed_mutants(self, cols=slice(None)) -> np.ndarray:
+        return bitset.popcount(self.kill_sets(cols))
+
+    def killing_tests(self, row: int) -> np.ndarray:
+        """Returns the test ids that kill the mutant at `row`."""
+        start, stop = self.status_indptr[row], self.status_indptr[row + 1]
+        return self.test_ids[self.status_indices[start:stop]]
+
+    def killed_mutants(self, col: int) -> np.ndarray:
+        """Returns the mutant ids killed by the test at `col`."""
+        bits = bitset.unpack(self.kill_sets(col), self.n_mutants)
+        return self.mutant_ids[bits]
+
+    def status(self, rows=slice(None)) -> sparse.csr_matrix:
+        """Returns the kill reasons (`STATUS_CODES`) of the given mutant rows."""
+        full = sparse.csr_matrix(
+            (self.status_codes, self.status_indices, self.status_indptr),
+            shape=self.shape,
+        )
+        return full[rows]
+
+    def to_kill_map(self) -> pd.DataFrame:
+        """Returns the kill matrix in killMap.csv's long format."""
+        coo = self.status().tocoo()
+        names = np.array([""] + list(STATUS_CODES), dtype=object)
+        return pd.DataFrame(
+            {
+                "TestNo": self.test_ids[coo.col],
+                "MutantNo": self.mutant_ids[coo.row],
+                "status": names[coo.data],
+            }
+        )
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+    for subject_dir in args.subject_dirs:
+        out_dir = subject_dir / args.out_name
+        convert(
+            subject_dir / "killMap.csv",
+            subject_dir / "testMap.csv",
+            subject_dir / "mutants.log",
+            out_dir,
+        )
+        km = KillMatrix(out_dir)
+        print(
+            f"{subject_dir}: {km.n_mutants} mutants x {km.n_tests} tests, "
+            f"{len(km.status_codes)} kills, {len(km.classes)} classes -> {out_dir}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
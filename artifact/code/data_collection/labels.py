@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Computes the pKillsDom and expKilledDomNodes labels of a subject's mutants.
+
+This is a vectorized implementation of the labeling in
+utils/add_features_labels.R. For a mutant m of class c, killed by the tests
+T(m) (with multiplicity, as listed in the kill map):
+
+* pKillsDom is the fraction of tests in T(m) that kill some dominator mutant
+  of class c; and
+* expKilledDomNodes is the mean, over the tests in T(m), of the number of
+  distinct DMSG nodes (groups) of class c whose dominators the test kills.
+
+Tests are only related to mutants of the same class, so every kill is mapped
+to a (class, test) column; both labels are then sparse matrix products over
+integer ids. Mutants that are not killed, or not in dmsgs.csv, get 0.
+
+Run `labels.py --help` for more information.
+"""
+
+import argparse
+import pathlib
+import sys
+from typing import Tuple, Union
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import killmatrix
+
+LABELS = ["pKillsDom", "expKilledDomNodes"]
+
+arg_parser = argparse.ArgumentParser(
+    description="Compute pKillsDom and expKilledDomNodes for a subject."
+)
+arg_parser.add_argument(
+    "subject_dir",
+    type=pathlib.Path,
+    help="A directory containing dmsgs.csv and a kill matrix or killMap.csv.",
+)
+arg_parser.add_argument(
+    "--out",
+    type=pathlib.Path,
+    default=None,
+    help="Write the labels (mutantId,pKillsDom,expKilledDomNodes) to this csv.",
+)
+arg_parser.add_argument(
+    "--check",
+    action="store_true",
+    help="Compare the labels with those in the subject's customized-mutants.csv.",
+)
+arg_parser.add_argument(
+    "--tolerance",
+    type=float,
+    default=1e-12,
+    help="The maximum absolute difference accepted by --check.",
+)
+
+
+def read_kills(subject_dir: Union[str, pathlib.Path]) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the (mutant ids, test ids) of all kills in a subject.
+
+    Reads the converted kill matrix (see killmatrix.py) if it exists, and
+    killMap.csv otherwise.
+    """
+    subject_dir = pathlib.Path(subject_dir)
+    km_dir = subject_dir / killmatrix.DEFAULT_DIR_NAME
+    if (km_dir / "meta.json").exists():
+        km = killmatrix.KillMatrix(km_dir)
+        coo = km.status().tocoo()
+        return km.mutant_ids[coo.row], km.test_ids[coo.col]
+    kill_map = killmatrix.read_kill_map(subject_dir / "killMap.csv")
+    return kill_map.MutantNo.values, kill_map.TestNo.values
+
+
+def compute_labels(
+    kill_mutants: np.ndarray, kill_tests: np.ndarray, dmsgs: pd.DataFrame
+) -> pd.DataFrame:
+    """Computes the labels of all killed mutants that appear in `dmsgs`.
+
+    Args:
+        kill_mutants, kill_tests: The mutant and test id of every kill.
+        dmsgs: The subject's dmsgs.csv, with columns mutantId, groupId,
+            dominatorStrength, and class.
+
+    Returns:
+        A DataFrame indexed by mutantId, with one column per entry in LABELS.
+    """
+    dmsgs = dmsgs.drop_duplicates("mutantId")
+    mutant_index = pd.Index(dmsgs.mutantId.values)
+    class_codes, _ = pd.factorize(dmsgs["class"])
+
+    rows = mutant_index.get_indexer(np.asarray(kill_mutants))
+    in_dmsgs = rows >= 0
+    rows = rows[in_dmsgs]
+    tests = np.asarray(kill_tests)[in_dmsgs]
+    test_codes, _ = pd.factorize(tests)
+
+    # One column per (class, test) pair that occurs in the kill map.
+    pair_keys = class_codes[rows].astype(np.int64) * (test_codes.max(initial=0) + 1)
+    _, cols = np.unique(pair_keys + test_codes, return_inverse=True)
+    n_cols = cols.max(initial=-1) + 1
+    # Duplicate kills are summed, so they are weighted as in the R means.
+    kills = sparse.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=(len(mutant_index), n_cols)
+    )
+
+    is_dom = (dmsgs.dominatorStrength.values == 1).astype(np.float64)
+    # Dominator nodes, identified by (class, groupId); non-dominators are dropped.
+    node, _ = pd.factorize(pd.MultiIndex.from_arrays([class_codes, dmsgs.groupId]))
+    dom_rows = np.flatnonzero(is_dom)
+    dom_nodes = sparse.csr_matrix(
+        (np.ones(len(dom_rows)), (dom_rows, node[dom_rows])),
+        shape=(len(mutant_index), node.max(initial=-1) + 1),
+    )
+
+    col_kills_dom = (kills.T @ is_dom > 0).astype(np.float64)
+    col_dom_nodes = (kills.T @ dom_nodes > 0).sum(axis=1).A1.astype(np.float64)
+
+    n_kills = kills.sum(axis=1).A1
+    killed = n_kills > 0
+    return pd.DataFrame(
+        {
+            "pKillsDom": (kills @ col_kills_dom)[killed] / n_kills[killed],
+            "expKilledDomNodes": (kills @ col_dom_nodes)[killed] / n_kills[killed],
+        },
+        index=pd.Index(mutant_index[killed], name="mutantId"),
+    )
+
+
+def subject_labels(subject_dir: Union[str, pathlib.Path]) -> pd.DataFrame:
+    subject_dir = pathlib.Path(subject_dir)
+    dmsgs = pd.read_csv(subject_dir / "dmsgs.csv")
+    return compute_labels(*read_kills(subject_dir), dmsgs)
+
+
+def label_mutants(mutant_ids, labels: pd.DataFrame) -> pd.DataFrame:
+    """Returns the labels of `mutant_ids`, with 0 for mutants without a label."""
+    return labels.reindex(pd.Index(mutant_ids, name="mutantId"), fill_value=0.0)
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    labels = subject_labels(args.subject_dir)
+    print(f"Computed labels for {len(labels)} killed mutants")
+    if args.out is not None:
+        print(f"Writing to: {args.out}")
+        labels.reset_index().to_csv(args.out, index=False)
+
+    if args.check:
+        cm_df = pd.read_csv(
+            args.subject_dir / "customized-mutants.csv",
+            usecols=["mutantId"] + LABELS,
+        )
+        expected = cm_df.set_index("mutantId")[LABELS]
+        actual = label_mutants(expected.index, labels)
+        diffs = (actual - expected).abs().max()
+        for label in LABELS:
+            print(f"{label}: max absolute difference {diffs[label]:.3g}")
+        if not (diffs <= args.tolerance).all():
+            print("Labels do not match customized-mutants.csv", file=sys.stderr)
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
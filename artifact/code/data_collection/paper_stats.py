@@ -9,13 +9,35 @@ import pandas as pd
 
 import sys
 import os
-from typing import Iterable, Union, Mapping
+import json
+from concurrent import futures
+from typing import Iterable, Union, Mapping, Tuple
 import subprocess
 import pathlib
 import argparse
 
 IGNORED_SUBDIRS = {"simulations"}
 
+# Per-subject kill map and test map counts are cached in this file, in the
+# subject's directory, and reused while the sizes and mtimes of the counted
+# files are unchanged.
+STATS_SIDECAR = "subject_stats.json"
+STATS_SIDECAR_VERSION = 1
+
+# The customized-mutants.csv columns used for the paper's tables and macros.
+CM_COLUMNS = [
+    "projectId",
+    "className",
+    "mutantId",
+    "isCovered",
+    "isDominator",
+    "isKilled",
+    "coveringTests",
+    "killingTests",
+]
+
+_READ_BLOCK_SIZE = 1 << 24
+
 arg_parser = argparse.ArgumentParser()
 arg_parser.add_argument(
     "in_path",
@@ -23,6 +45,12 @@ arg_parser.add_argument(
     help="The path to a results directory with subdirs. <pid>/<vid>/...",
 )
 arg_parser.add_argument("out_dir", type=str)
+arg_parser.add_argument(
+    "--jobs",
+    type=int,
+    default=os.cpu_count(),
+    help="The number of subjects to process in parallel.",
+)
 
 
 def walk_subject_dirs(root: Union[str, pathlib.Path]) -> Iterable[pathlib.Path]:
@@ -47,10 +75,77 @@ def walk_subject_dirs(root: Union[str, pathlib.Path]) -> Iterable[pathlib.Path]:
             versions_seen += 1
 
 
-def read_killmap(path) -> pd.DataFrame:
-    df = pd.read_csv(path)
-    assert isinstance(df, pd.DataFrame)
-    return df.rename(columns={"[FAIL | TIME | EXC]": "status"})
+def count_rows(path: Union[str, pathlib.Path], needle: bytes = b"") -> Tuple[int, int]:
+    """Streams a CSV file and counts its data rows and occurrences of `needle`.
+
+    The header line is not counted, nor is any occurrence of `needle` in it.
+    """
+    rows = 0
+    matches = 0
+    header_done = False
+    tail = b""
+    last = b""
+    with open(path, "rb") as fo:
+        for block in iter(lambda: fo.read(_READ_BLOCK_SIZE), b""):
+            if not header_done:
+                newline = block.find(b"\n")
+                if newline < 0:
+                    continue
+                block = block[newline + 1 :]
+                header_done = True
+                if not block:
+                    continue
+            rows += block.count(b"\n")
+            if needle:
+                # Only the last len(needle)-1 bytes are carried over, so a match
+                # is never counted twice.
+                buf = tail + block
+                matches += buf.count(needle)
+                tail = buf[len(buf) - len(needle) + 1 :]
+            last = block[-1:]
+    # Count a final row that lacks a trailing newline.
+    if last and last != b"\n":
+        rows += 1
+    return rows, matches
+
+
+def _file_key(path: pathlib.Path) -> Mapping[str, int]:
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+def subject_stats(subject_dir: pathlib.Path) -> Mapping[str, int]:
+    """Returns kill map and test map counts, using the sidecar if it is current."""
+    counted = ["killMap.csv", "testMap.csv"]
+    files = {name: _file_key(subject_dir / name) for name in counted}
+    sidecar = subject_dir / STATS_SIDECAR
+    try:
+        with sidecar.open() as fo:
+            cached = json.load(fo)
+        if cached["version"] == STATS_SIDECAR_VERSION and cached["files"] == files:
+            return cached["stats"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    killmap_rows, timeouts = count_rows(subject_dir / "killMap.csv", b",TIME")
+    test_rows, _ = count_rows(subject_dir / "testMap.csv")
+    stats = {
+        "killMapRows": killmap_rows,
+        "killMapTimeouts": timeouts,
+        "testMapRows": test_rows,
+    }
+    tmp_path = sidecar.with_suffix(".tmp")
+    with tmp_path.open("w") as fo:
+        json.dump(
+            {"version": STATS_SIDECAR_VERSION, "files": files, "stats": stats}, fo
+        )
+    os.replace(tmp_path, sidecar)
+    return stats
+
+
+def _read_subject(subject_dir: pathlib.Path) -> Tuple[Mapping[str, int], pd.DataFrame]:
+    cm_df = pd.read_csv(subject_dir / "customized-mutants.csv", usecols=CM_COLUMNS)
+    return subject_stats(subject_dir), cm_df
 
 
 def _only_log_or_empty(path: pathlib.Path) -> bool:
@@ -207,19 +302,18 @@ def main():
     timeouts = 0
     mutant_test_pairs = 0
     tests_per_project = {}
-    for subject_dir in walk_subject_dirs(args.in_path):
-        killmap = read_killmap(subject_dir / "killMap.csv")
-        cm_dfs.append(pd.read_csv(subject_dir / "customized-mutants.csv"))
-
-        project_id = cm_dfs[-1].iloc[0].projectId
-        tests_per_project[project_id] = len(pd.read_csv(subject_dir / "testMap.csv"))
-
-        timeouts += (killmap.status == "TIME").sum()
-        mutant_test_pairs += len(killmap)
-        assert isinstance(
-            timeouts, (np.int64, int)
-        ), f"Expected timeouts to be int, but was {type(timeouts)}"
-        projects_in_results += 1
+    with futures.ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        for stats, cm_df in executor.map(
+            _read_subject, walk_subject_dirs(args.in_path)
+        ):
+            cm_dfs.append(cm_df)
+
+            project_id = cm_df.iloc[0].projectId
+            tests_per_project[project_id] = stats["testMapRows"]
+
+            timeouts += stats["killMapTimeouts"]
+            mutant_test_pairs += stats["killMapRows"]
+            projects_in_results += 1
     cm_df = pd.concat(cm_dfs, ignore_index=True)
     _emit_def("numOfProjectsUsed", projects_in_results, file=numbers_macros_fo)
     _emit_def(
@@ -0,0 +1,513 @@
+#!/usr/bin/env python3
+"""Plans a partial, model-guided mutation analysis of a subject.
+
+10_mutation_analysis.sh runs every test that covers a mutant against it, to
+obtain complete kill vectors. This script uses a trained model's predicted
+utility and the coverage map (covMap.csv) to plan which mutant-test pairs to
+execute instead. It only needs the outputs of Major's mutate and preproc
+steps: with `--model`, the covered mutants are featurized from mutants.log
+and mutants.context (plus their derived features, see derived_features.py)
+and scored by the model, a train_model.py output file. Alternatively,
+`--predictions` reads the predictedProbKillsDom of a subject that has been
+fully analyzed from a predictions.csv (see data_analysis/ml/model_eval.py).
+Within each top-level class, the covered mutants are ranked by predicted
+utility, and each mutant gets a mode from its position in the ranking:
+
+* "full": the mutants before the point at which the ranking reaches
+  `--full_share` of the class's total predicted utility are the likely
+  dominators. They are run against all covering tests (Major's
+  exportKillMap=true), since the dominators are found from their kill
+  vectors.
+* "first_kill": the following mutants only need a label. They are run until
+  their first kill (Major's default, exportKillMap=false). Their labels are
+  estimated from that one killing test.
+* "skip": once the ranking reaches `--saturation` of the predicted utility,
+  the predicted dominator coverage of the class has saturated. The remaining
+  mutants are not run and get no labels.
+
+The plan is written to `<subject dir>/partialAnalysis/`: plan.csv (mode,
+rank, and number of covering tests per mutant), and fullMutants.txt and
+firstKillMutants.txt (Major's includeMutantsFile format), which
+`10_mutation_analysis.sh -p <model file>` runs instead of all covered
+mutants.
+
+With `--evaluate`, the plan is replayed on the subject's complete kill matrix
+(see killmatrix.py), with tests run in increasing TestNo order. The dmsgs of
+the "full" mutants (see dominators.py) and the labels of all executed mutants
+(see labels.py) are compared with dmsgs.csv and the labels of the full
+analysis. A class's dominators are found exactly if its "full" mutants
+include all of them. The per-class comparison is written to report.csv, next
+to the partial dmsgs.csv and labels.csv.
+
+Run `partial_analysis.py --help` for more information.
+"""
+
+import argparse
+import pathlib
+import sys
+from typing import List, NamedTuple, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+import bitset
+import derived_features
+import dominators
+import killmatrix
+import labels
+
+DEFAULT_DIR_NAME = "partialAnalysis"
+# The modules of the models written by train_model.py.
+ML_DIR = pathlib.Path(__file__).resolve().parents[1] / "data_analysis" / "ml"
+# Accepted names of the mutant id column of mutants.context.
+CONTEXT_ID_COLUMNS = ["mutantNo", "MutantNo", "mutantId"]
+MODES = ["full", "first_kill", "skip"]
+PLAN_COLUMNS = [
+    "mutantId",
+    "className",
+    "predictedProbKillsDom",
+    "rank",
+    "nTests",
+    "mode",
+]
+
+arg_parser = argparse.ArgumentParser(
+    description="Plan a partial mutation analysis from a model's predictions."
+)
+arg_parser.add_argument(
+    "subject_dirs",
+    type=pathlib.Path,
+    nargs="+",
+    help="Directories (<PID>/<BID>f) containing covMap.csv, mutants.log, and "
+    "(with --model) mutants.context.",
+)
+utility_group = arg_parser.add_mutually_exclusive_group(required=True)
+utility_group.add_argument(
+    "--model",
+    type=pathlib.Path,
+    help="A model file written by train_model.py, used to score the mutants.",
+)
+utility_group.add_argument(
+    "--predictions",
+    type=pathlib.Path,
+    help="The predictions.csv of a model, for subjects it has been evaluated on.",
+)
+arg_parser.add_argument(
+    "--full_share",
+    type=float,
+    default=0.5,
+    help="The share of a class's predicted utility whose mutants are run "
+    "against all covering tests.",
+)
+arg_parser.add_argument(
+    "--saturation",
+    type=float,
+    default=1.0,
+    help="The share of a class's predicted utility after which its remaining "
+    "mutants are skipped (1 runs every covered mutant).",
+)
+arg_parser.add_argument(
+    "--out_name",
+    type=str,
+    default=DEFAULT_DIR_NAME,
+    help="The name of the output directory, created in each subject directory.",
+)
+arg_parser.add_argument(
+    "--evaluate",
+    action="store_true",
+    help="Replay the plan on the subject's kill matrix and compare the partial "
+    "dmsgs and labels with those of the full analysis.",
+)
+
+
+def read_coverage(subject_dir: Union[str, pathlib.Path]) -> pd.DataFrame:
+    """Returns the distinct (TestNo, MutantNo) pairs of a subject's covMap.csv."""
+    cov_map = pd.read_csv(pathlib.Path(subject_dir) / "covMap.csv")
+    cov_map = cov_map[["TestNo", "MutantNo"]].drop_duplicates()
+    return cov_map.sort_values(["MutantNo", "TestNo"], ignore_index=True)
+
+
+def read_mutant_features(
+    subject_dir: Union[str, pathlib.Path], pid: str, bid: int
+) -> pd.DataFrame:
+    """Returns the features of a subject's mutants, like customized-mutants.csv.
+
+    The context features are read from mutants.context, the class, method
+    (mutation target), and line number from mutants.log, and the derived
+    features are computed from them. Rows are the mutants in both files,
+    indexed by mutant id.
+    """
+    subject_dir = pathlib.Path(subject_dir)
+    context = pd.read_csv(subject_dir / "mutants.context")
+    id_columns = [c for c in CONTEXT_ID_COLUMNS if c in context.columns]
+    if len(id_columns) != 1:
+        raise ValueError(
+            f"Expected one of {CONTEXT_ID_COLUMNS} in mutants.context, "
+            f"got {list(context.columns)}"
+        )
+    context = context.set_index(id_columns[0]).rename_axis("mutantId")
+    targets = killmatrix.read_mutants_log(subject_dir / "mutants.log")
+    context = context.drop(columns=targets.columns, errors="ignore")
+    df = targets.join(context, how="inner").assign(projectId=pid, bugId=bid)
+
+    inputs = set().union(*(f.inputs for f in derived_features.REGISTRY.values()))
+    missing = sorted(inputs - set(df.columns))
+    if missing:
+        raise ValueError(f"mutants.context has no {missing} columns")
+    # Empty contexts are read as NaN, but are empty strings to derived_features.
+    derived = derived_features.compute(
+        df.assign(astStmtContextBasic=df.astStmtContextBasic.fillna(""))
+    )
+    return df.drop(columns=derived.columns, errors="ignore").join(derived)
+
+
+def load_model(path: Union[str, pathlib.Path]):
+    """Returns the (mapper, results) of a train_model.py output file."""
+    # Unpickling the models imports their modules.
+    if str(ML_DIR) not in sys.path:
+        sys.path.append(str(ML_DIR))
+    with open(path, "rb") as fo:
+        return joblib.load(fo)
+
+
+def _mapper_columns(mapper) -> List[str]:
+    columns = []
+    for c, *_ in mapper.features:
+        columns.extend([c] if isinstance(c, str) else c)
+    return columns
+
+
+def predict_utility(
+    mutants: pd.DataFrame, mapper, results, pid: str, bid: int
+) -> pd.Series:
+    """Returns a model's predicted utility of a subject's mutants, by mutant id.
+
+    As in model_eval.py, a class is scored by the fold model that held it (or
+    its project) out. Other classes, e.g., of subjects the model was not
+    trained on, are in no fold's training set, so they get the mean
+    prediction of all fold models.
+    """
+    missing = sorted(set(_mapper_columns(mapper)) - set(mutants.columns))
+    if missing:
+        raise ValueError(f"The mutants have no values for the features {missing}")
+    X = mapper.transform(mutants)
+    held_out = {}
+    for (proj, bug_id, key), model in results:
+        if isinstance(key, str):  # See model_eval.create_predictions.
+            key = {"class": key}
+        if (proj, bug_id) == (pid, bid):
+            # Project folds hold out all classes (None).
+            held_out[key.get("class")] = model
+
+    preds = np.zeros(len(mutants))
+    scored = np.zeros(len(mutants), dtype=bool)
+    for class_name in mutants.className.unique():
+        model = held_out.get(class_name, held_out.get(None))
+        if model is not None:
+            rows = (mutants.className == class_name).values
+            preds[rows] = model.predict(X[rows])
+            scored |= rows
+    if not scored.all():
+        rest = ~scored
+        preds[rest] = np.mean([m.predict(X[rest]) for _, m in results], axis=0)
+    return pd.Series(preds, index=mutants.index, name="predictedProbKillsDom")
+
+
+def read_predictions(path: Union[str, pathlib.Path], pid: str, bid: int) -> pd.Series:
+    """Returns the predicted utility of a subject's mutants, by mutant id."""
+    predictions = pd.read_csv(path)
+    predictions = predictions[
+        (predictions.projectId == pid) & (predictions.bugId == bid)
+    ]
+    predictions = predictions.drop_duplicates("mutantId").set_index("mutantId")
+    return predictions.predictedProbKillsDom
+
+
+def plan_subject(
+    cov_map: pd.DataFrame,
+    mutant_classes: pd.Series,
+    predictions: pd.Series,
+    full_share: float,
+    saturation: float,
+) -> pd.DataFrame:
+    """Returns the plan of a subject's covered mutants (see the module doc).
+
+    Args:
+        cov_map: The subject's coverage map (see `read_coverage`).
+        mutant_classes: The top-level class of each mutant, by mutant id.
+        predictions: The predicted utility of each mutant, by mutant id;
+            mutants without a prediction get 0.
+    """
+    if not 0 <= full_share <= saturation <= 1:
+        raise ValueError("Expected 0 <= full_share <= saturation <= 1")
+    n_tests = cov_map.groupby("MutantNo").size()
+    plan = pd.DataFrame(
+        {
+            "mutantId": n_tests.index.values,
+            "className": mutant_classes.reindex(n_tests.index).values,
+            "predictedProbKillsDom": predictions.reindex(n_tests.index)
+            .fillna(0.0)
+            .clip(lower=0.0)
+            .values,
+            "nTests": n_tests.values,
+        }
+    )
+    if plan.className.isna().any():
+        raise ValueError("covMap.csv has mutants that are not in mutants.log")
+    plan = plan.sort_values(
+        ["className", "predictedProbKillsDom", "mutantId"],
+        ascending=[True, False, True],
+        ignore_index=True,
+    )
+
+    by_class = plan.groupby("className", sort=False)
+    plan["rank"] = by_class.cumcount() + 1
+    utility = plan.predictedProbKillsDom
+    total = by_class.predictedProbKillsDom.transform("sum")
+    # The share of the class's predicted utility ranked before each mutant;
+    # classes without any predicted utility are ranked uniformly.
+    share = ((by_class.predictedProbKillsDom.cumsum() - utility) / total).where(
+        total > 0, (plan["rank"] - 1) / by_class.mutantId.transform("size")
+    )
+    mode = np.where((share < full_share) | (full_share >= 1), "full", "first_kill")
+    if saturation < 1:
+        mode = np.where(share < saturation, mode, "skip")
+    plan["mode"] = mode
+    return plan[PLAN_COLUMNS]
+
+
+def write_plan(plan: pd.DataFrame, out_dir: pathlib.Path) -> None:
+    out_dir.mkdir(parents=True, exist_ok=True)
+    plan.to_csv(out_dir / "plan.csv", index=False)
+    for mode, name in [
+        ("full", "fullMutants.txt"),
+        ("first_kill", "firstKillMutants.txt"),
+    ]:
+        ids = plan.mutantId[plan["mode"] == mode]
+        ids.to_csv(out_dir / name, index=False, header=False)
+
+
+class Execution(NamedTuple):
+    """The outcome of a plan: the observed kills and the pairs run per mutant."""
+
+    kill_mutants: np.ndarray
+    kill_tests: np.ndarray
+    # The number of mutant-test pairs run, per row of the plan.
+    n_pairs: np.ndarray
+
+
+def replay(
+    km: killmatrix.KillMatrix, cov_map: pd.DataFrame, plan: pd.DataFrame
+) -> Execution:
+    """Replays a plan on a complete kill matrix, running tests in TestNo order."""
+    rows = km.mutant_rows(plan.mutantId.values)
+    covered = sparse.csr_matrix(
+        (
+            np.ones(len(cov_map), dtype=np.uint8),
+            (
+                pd.Index(plan.mutantId.values).get_indexer(cov_map.MutantNo.values),
+                km.test_columns(cov_map.TestNo.values),
+            ),
+        ),
+        shape=(len(plan), km.n_tests),
+    )
+    # Only covering tests are run, so kills outside the coverage map are missed.
+    observed = sparse.csr_matrix(km.status(rows).multiply(covered) > 0)
+    observed.sort_indices()
+    n_kills = np.diff(observed.indptr)
+    mode = plan["mode"].values
+
+    # A "first_kill" mutant runs the covering tests up to its first killing one.
+    is_full = mode == "full"
+    is_first = (mode == "first_kill") & (n_kills > 0)
+    first_test = np.full(len(plan), km.n_tests)
+    first_test[is_first] = observed.indices[observed.indptr[:-1][is_first]]
+    coo = covered.tocoo()
+    run = coo.col <= first_test[coo.row]
+    n_pairs = np.bincount(coo.row[run], minlength=len(plan))
+    n_pairs[mode == "skip"] = 0
+
+    kills = observed.tocoo()
+    is_first_kill = is_first[kills.row] & (kills.col == first_test[kills.row])
+    kept = is_full[kills.row] | is_first_kill
+    return Execution(
+        plan.mutantId.values[kills.row[kept]], km.test_ids[kills.col[kept]], n_pairs
+    )
+
+
+def partial_dmsgs(
+    km: killmatrix.KillMatrix, plan: pd.DataFrame, execution: Execution
+) -> pd.DataFrame:
+    """Returns the dmsgs of the executed mutants, like dmsgs.csv.
+
+    Nodes and dominators are those of the "full" mutants of each class; every
+    "first_kill" mutant is a node of its own, subsumed if it was killed and
+    equivalent otherwise.
+    """
+    frames = []
+    for class_name, class_plan in plan.groupby("className", sort=True):
+        full_ids = class_plan.mutantId[class_plan["mode"] == "full"].values
+        kill_rows = pd.Index(full_ids).get_indexer(execution.kill_mutants)
+        in_class = kill_rows >= 0
+        vectors = bitset.from_indices(
+            kill_rows[in_class],
+            km.test_columns(execution.kill_tests[in_class]),
+            (len(full_ids), km.n_tests),
+        )
+        frame = dominators.build_dmsg(full_ids, vectors).frame(class_name)
+        frames.append(frame)
+        first_ids = class_plan.mutantId[class_plan["mode"] == "first_kill"].values
+        frames.append(
+            pd.DataFrame(
+                {
+                    "mutantId": first_ids,
+                    "groupId": frame.groupId.values.max(initial=0)
+                    + np.arange(1, len(first_ids) + 1),
+                    "dominatorStrength": np.where(
+                        np.isin(first_ids, execution.kill_mutants), 0.0, -1.0
+                    ),
+                    "class": class_name,
+                }
+            )
+        )
+    if not frames:
+        return pd.DataFrame(columns=dominators.DMSG_COLUMNS)
+    return pd.concat(frames).sort_values("mutantId", kind="stable")
+
+
+def compare(
+    plan: pd.DataFrame,
+    execution: Execution,
+    partial: pd.DataFrame,
+    partial_labels: pd.DataFrame,
+    full: pd.DataFrame,
+    full_labels: pd.DataFrame,
+) -> pd.DataFrame:
+    """Compares the partial with the full dmsgs and labels, per class.
+
+    Labels are compared on the executed ("full" and "first_kill") mutants.
+    """
+    df = plan.assign(
+        nPairs=execution.n_pairs,
+        isDominator=plan.mutantId.isin(full.mutantId[full.dominatorStrength == 1]),
+        isPartialDominator=plan.mutantId.isin(
+            partial.mutantId[partial.dominatorStrength == 1]
+        ),
+    )
+    executed = df["mode"] != "skip"
+    for label in labels.LABELS:
+        expected = labels.label_mutants(df.mutantId, full_labels)[label].values
+        actual = labels.label_mutants(df.mutantId, partial_labels)[label].values
+        df[label + "Error"] = np.where(executed, np.abs(actual - expected), np.nan)
+        df[label] = expected
+        df["partial" + label[0].upper() + label[1:]] = np.where(
+            executed, actual, np.nan
+        )
+
+    def summarize(c: pd.DataFrame) -> pd.Series:
+        ran = c[c["mode"] != "skip"]
+        return pd.Series(
+            {
+                "mutants": len(c),
+                "fullMutants": (c["mode"] == "full").sum(),
+                "firstKillMutants": (c["mode"] == "first_kill").sum(),
+                "skippedMutants": (c["mode"] == "skip").sum(),
+                "pairs": c.nTests.sum(),
+                "executedPairs": c.nPairs.sum(),
+                "dominators": c.isDominator.sum(),
+                "partialDominators": c.isPartialDominator.sum(),
+                "foundDominators": (c.isDominator & c.isPartialDominator).sum(),
+                "pKillsDomMae": ran.pKillsDomError.mean(),
+                # Spearman's rho; NaN if either side is constant.
+                "pKillsDomSpearman": ran.pKillsDom.rank().corr(
+                    ran.partialPKillsDom.rank()
+                ),
+                "expKilledDomNodesMae": ran.expKilledDomNodesError.mean(),
+            }
+        )
+
+    report = df.groupby("className").apply(summarize).reset_index()
+    counts = report.columns[1:-3]
+    report[counts] = report[counts].astype(np.int64)
+    return report
+
+
+def _summary(report: pd.DataFrame) -> str:
+    totals = report.sum(numeric_only=True).round().astype(np.int64)
+    executed = report.mutants - report.skippedMutants
+    mae = (report.pKillsDomMae * executed).sum() / max(executed.sum(), 1)
+    return (
+        f"ran {totals.executedPairs} of {totals.pairs} covered pairs "
+        f"({totals.executedPairs / max(totals.pairs, 1):.1%}); found "
+        f"{totals.foundDominators} of {totals.dominators} dominators "
+        f"({totals.partialDominators} partial dominators); pKillsDom MAE "
+        f"{mae:.3f}, median class Spearman {report.pKillsDomSpearman.median():.3f}"
+    )
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+    if args.model is not None:
+        mapper, results = load_model(args.model)
+
+    for subject_dir in args.subject_dirs:
+        pid, bid = subject_dir.parent.name, int(subject_dir.name.rstrip("f"))
+        cov_map = read_coverage(subject_dir)
+        if args.model is not None:
+            mutants = read_mutant_features(subject_dir, pid, bid)
+            mutants = mutants[mutants.index.isin(cov_map.MutantNo)]
+            predictions = predict_utility(mutants, mapper, results, pid, bid)
+        else:
+            predictions = read_predictions(args.predictions, pid, bid)
+        plan = plan_subject(
+            cov_map,
+            killmatrix.read_mutant_classes(subject_dir / "mutants.log"),
+            predictions,
+            args.full_share,
+            args.saturation,
+        )
+        out_dir = subject_dir / args.out_name
+        print(f"Writing the plan to: {out_dir}")
+        write_plan(plan, out_dir)
+        counts = plan["mode"].value_counts().reindex(MODES, fill_value=0)
+        print(
+            f"{subject_dir}: {len(plan)} covered mutants: {counts.full} full, "
+            f"{counts.first_kill} until the first kill, {counts.skip} skipped"
+        )
+        if not args.evaluate:
+            continue
+
+        km_dir = subject_dir / killmatrix.DEFAULT_DIR_NAME
+        if not (km_dir / "meta.json").exists():
+            print(
+                f"No kill matrix in {km_dir}; run killmatrix.py first", file=sys.stderr
+            )
+            return 1
+        km = killmatrix.KillMatrix(km_dir)
+        execution = replay(km, cov_map, plan)
+        dmsgs = partial_dmsgs(km, plan, execution)
+        partial_labels = labels.compute_labels(
+            execution.kill_mutants, execution.kill_tests, dmsgs
+        )
+        report = compare(
+            plan,
+            execution,
+            dmsgs,
+            partial_labels,
+            pd.read_csv(subject_dir / "dmsgs.csv"),
+            labels.subject_labels(subject_dir),
+        )
+        dmsgs.assign(projectId=pid, bugId=bid)[
+            dominators.DMSG_COLUMNS[:3] + ["projectId", "bugId", "class"]
+        ].to_csv(out_dir / "dmsgs.csv", index=False)
+        partial_labels.reset_index().to_csv(out_dir / "labels.csv", index=False)
+        report.to_csv(out_dir / "report.csv", index=False)
+        print(f"{subject_dir}: {_summary(report)}")
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
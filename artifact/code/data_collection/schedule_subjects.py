@@ -0,0 +1,356 @@
+#!/usr/bin/env python3
+"""Runs the data-collection pipeline for many subjects at once, longest first.
+
+collect_all_subjects.sh (and the Makefile) process one subject at a time, so a
+single large subject can keep one host busy while the others sit idle. This
+script instead runs several subjects concurrently, one per slot, where a slot
+is an entry of a GNU Parallel sshlogin list (e.g., `8/:,8/:,4/other` gives two
+local slots with 8 cores each and one slot with 4 cores on host `other`). A
+subject's mutation analysis runs on its slot's host (10_mutation_analysis.sh
+-h <slot>); the other stages run locally.
+
+Subjects are dispatched longest-first, based on an estimate of their cost:
+
+1. the subject's own past stage runtimes, if any;
+2. otherwise, the number of mutants (mutants.log) times the number of tests
+   (testMap.csv), if known, times the median cost per mutant-test pair of past
+   runs;
+3. otherwise, the median past runtime of the subject's project (or of all
+   subjects).
+
+Runtimes of the mutation analysis are recorded in core seconds (wall time
+times the slot's cores). Every finished stage is appended to a JSON-lines
+history file, which later runs use for their estimates.
+
+Run `schedule_subjects.py --help` for more information.
+"""
+
+import argparse
+import heapq
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+import pandas as pd
+
+SCRIPT_DIR = pathlib.Path(__file__).resolve().parent
+
+# The pipeline stages, in order, and whether they take the -h sshhosts option.
+STAGES = [
+    ("10_mutation_analysis.sh", True),
+    ("20_dmsg_analysis.sh", False),
+    ("30_consolidate_data.sh", False),
+]
+
+HISTORY_FILE_NAME = "schedule_history.jsonl"
+
+arg_parser = argparse.ArgumentParser(
+    description="Run the data-collection pipeline for many subjects, longest first."
+)
+arg_parser.add_argument(
+    "subjects_csv",
+    type=pathlib.Path,
+    nargs="?",
+    default=SCRIPT_DIR / "subjects.csv",
+    help="A csv file with PID and BID columns (default: subjects.csv).",
+)
+slots_group = arg_parser.add_mutually_exclusive_group()
+slots_group.add_argument(
+    "--hosts",
+    type=str,
+    default=":",
+    help="Comma-separated slots, in GNU Parallel sshlogin syntax (e.g., 8/:,4/other).",
+)
+slots_group.add_argument(
+    "--local_slots",
+    type=int,
+    default=None,
+    help="Split the local cores evenly into this many slots.",
+)
+arg_parser.add_argument(
+    "--results_root",
+    type=pathlib.Path,
+    default=os.environ.get("CM_RESULTS_ROOT", SCRIPT_DIR.parent / "results"),
+    help="CM_RESULTS_ROOT, used to read cost signals of already analyzed subjects.",
+)
+arg_parser.add_argument(
+    "--history",
+    type=pathlib.Path,
+    default=None,
+    help=f"The history file (default: <results_root>/{HISTORY_FILE_NAME}).",
+)
+arg_parser.add_argument(
+    "--log_dir",
+    type=pathlib.Path,
+    default=None,
+    help="Write the output of each subject to <log_dir>/<PID>-<BID>.log.",
+)
+arg_parser.add_argument(
+    "--dry_run",
+    action="store_true",
+    help="Only print the estimated schedule.",
+)
+
+
+class Slot(NamedTuple):
+    # The sshlogin entry passed to 10_mutation_analysis.sh.
+    spec: str
+    host: str
+    cores: int
+
+
+class Subject(NamedTuple):
+    pid: str
+    bid: int
+
+
+class Job(NamedTuple):
+    subject: Subject
+    # Estimated cost per stage; core seconds for stages that take -h.
+    estimate: Dict[str, float]
+
+    @property
+    def cost(self) -> float:
+        return sum(self.estimate.values())
+
+    def wall_seconds(self, slot: Slot) -> float:
+        seconds = 0.0
+        for stage, takes_hosts in STAGES:
+            cost = self.estimate.get(stage, 0.0)
+            seconds += cost / slot.cores if takes_hosts else cost
+        return seconds
+
+
+def parse_slots(hosts: str) -> List[Slot]:
+    """Parses a sshlogin list into slots.
+
+    Entries without a core count get all local cores (for `:`) or 1 core.
+    """
+    slots = []
+    for spec in hosts.split(","):
+        cores, sep, host = spec.partition("/")
+        if sep:
+            slots.append(Slot(spec, host, int(cores)))
+        else:
+            slots.append(Slot(spec, spec, os.cpu_count() if spec == ":" else 1))
+    return slots
+
+
+def local_slots(n_slots: int) -> List[Slot]:
+    cores = max(1, (os.cpu_count() or 1) // n_slots)
+    return [Slot(f"{cores}/:", ":", cores)] * n_slots
+
+
+def read_subjects(subjects_csv: pathlib.Path) -> List[Subject]:
+    df = pd.read_csv(subjects_csv)
+    return [Subject(pid, int(bid)) for pid, bid in zip(df.PID, df.BID)]
+
+
+def _count_lines(path: pathlib.Path) -> Optional[int]:
+    if not path.exists():
+        return None
+    with open(path, "rb") as f:
+        return sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 24), b""))
+
+
+def subject_signals(
+    results_root: pathlib.Path, subject: Subject
+) -> Dict[str, Optional[int]]:
+    """Returns the numbers of mutants and tests of a subject (None if unknown)."""
+    subject_dir = results_root / subject.pid / f"{subject.bid}f"
+    tests = _count_lines(subject_dir / "testMap.csv")
+    return {
+        "mutants": _count_lines(subject_dir / "mutants.log"),
+        "tests": None if tests is None else max(tests - 1, 0),
+    }
+
+
+def read_history(path: pathlib.Path) -> pd.DataFrame:
+    columns = ["pid", "bid", "stage", "seconds", "cores", "cost"]
+    columns += ["mutants", "tests", "status"]
+    if not path.exists():
+        return pd.DataFrame(columns=columns)
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame.from_records(records, columns=columns)
+
+
+class CostModel:
+    """Estimates per-stage costs of subjects from a history of past runs."""
+
+    def __init__(self, history: pd.DataFrame):
+        history = history[history.status == "ok"]
+        self.latest = history.groupby(["pid", "bid", "stage"]).cost.last()
+        work = history.mutants * history.tests
+        has_work = work.notna() & (work > 0)
+        self.rates = (history.cost[has_work] / work[has_work]).groupby(
+            history.stage[has_work]
+        ).median()
+        self.project_medians = history.groupby(["pid", "stage"]).cost.median()
+        self.medians = history.groupby("stage").cost.median()
+
+    def estimate(
+        self, subject: Subject, mutants: Optional[int], tests: Optional[int]
+    ) -> Dict[str, float]:
+        estimate = {}
+        for stage, _ in STAGES:
+            if (subject.pid, subject.bid, stage) in self.latest:
+                cost = self.latest[(subject.pid, subject.bid, stage)]
+            elif mutants and tests and stage in self.rates:
+                cost = self.rates[stage] * mutants * tests
+            elif (subject.pid, stage) in self.project_medians:
+                cost = self.project_medians[(subject.pid, stage)]
+            else:
+                cost = self.medians.get(stage, 0.0)
+            estimate[stage] = float(cost)
+        return estimate
+
+
+def make_jobs(
+    subjects: List[Subject], model: CostModel, results_root: pathlib.Path
+) -> List[Job]:
+    """Returns a job per subject, longest first (ties keep the input order)."""
+    jobs = [
+        Job(s, model.estimate(s, **subject_signals(results_root, s))) for s in subjects
+    ]
+    return sorted(jobs, key=lambda job: -job.cost)
+
+
+def plan(jobs: List[Job], slots: List[Slot]) -> pd.DataFrame:
+    """Simulates dispatching `jobs` in order, each to the slot that frees up first."""
+    free = [(0.0, i) for i in range(len(slots))]
+    rows = []
+    for job in jobs:
+        start, i = heapq.heappop(free)
+        end = start + job.wall_seconds(slots[i])
+        heapq.heappush(free, (end, i))
+        rows.append((job.subject.pid, job.subject.bid, slots[i].spec, i, start, end))
+    return pd.DataFrame(rows, columns=["PID", "BID", "Slot", "SlotNo", "Start", "End"])
+
+
+def run_stage(
+    stage: str,
+    takes_hosts: bool,
+    subject: Subject,
+    slot: Slot,
+    log_dir: Optional[pathlib.Path],
+) -> bool:
+    cmd = [f"./{stage}"] + (["-h", slot.spec] if takes_hosts else [])
+    cmd += [subject.pid, str(subject.bid)]
+    if log_dir is None:
+        return subprocess.run(cmd, cwd=SCRIPT_DIR).returncode == 0
+    with open(log_dir / f"{subject.pid}-{subject.bid}.log", "a") as log:
+        result = subprocess.run(
+            cmd, cwd=SCRIPT_DIR, stdout=log, stderr=subprocess.STDOUT
+        )
+    return result.returncode == 0
+
+
+def run_schedule(
+    jobs: List[Job],
+    slots: List[Slot],
+    history_path: pathlib.Path,
+    results_root: pathlib.Path,
+    run: Callable[[str, bool, Subject, Slot], bool],
+) -> List[Subject]:
+    """Runs the pipeline for all jobs, with one worker thread per slot.
+
+    Workers take the next (longest remaining) job whenever they are free, and
+    append the runtime of every stage to the history file.
+
+    Returns:
+        The subjects for which a stage failed.
+    """
+    pending = list(jobs)
+    failed = []
+    lock = threading.Lock()
+
+    def worker(slot: Slot):
+        while True:
+            with lock:
+                if not pending:
+                    return
+                job = pending.pop(0)
+            subject = job.subject
+            print(f"Processing {subject.pid}-{subject.bid} on {slot.spec}", flush=True)
+            for stage, takes_hosts in STAGES:
+                start = time.monotonic()
+                ok = run(stage, takes_hosts, subject, slot)
+                seconds = time.monotonic() - start
+                cores = slot.cores if takes_hosts else 1
+                record = {
+                    "pid": subject.pid,
+                    "bid": subject.bid,
+                    "stage": stage,
+                    "seconds": seconds,
+                    "cores": cores,
+                    "cost": seconds * cores,
+                    **subject_signals(results_root, subject),
+                    "status": "ok" if ok else "failed",
+                    "host": slot.host,
+                    "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                }
+                with lock:
+                    with open(history_path, "a") as f:
+                        f.write(json.dumps(record) + "\n")
+                if not ok:
+                    name = f"{subject.pid}-{subject.bid}"
+                    print(f"{stage} failed for {name}", file=sys.stderr)
+                    with lock:
+                        failed.append(subject)
+                    break
+
+    threads = [threading.Thread(target=worker, args=(slot,)) for slot in slots]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return failed
+
+
+def main() -> int:
+    args = arg_parser.parse_args()
+
+    if args.local_slots is not None:
+        slots = local_slots(args.local_slots)
+    else:
+        slots = parse_slots(args.hosts)
+    history_path = args.history or args.results_root / HISTORY_FILE_NAME
+
+    subjects = read_subjects(args.subjects_csv)
+    jobs = make_jobs(subjects, CostModel(read_history(history_path)), args.results_root)
+    schedule = plan(jobs, slots)
+    print(f"{len(jobs)} subjects on slots {','.join(s.spec for s in slots)}")
+    print(schedule.to_string(index=False))
+    print(f"Estimated makespan: {schedule.End.values.max(initial=0):.0f}s")
+    if args.dry_run:
+        return 0
+
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    if args.log_dir is not None:
+        args.log_dir.mkdir(parents=True, exist_ok=True)
+    failed = run_schedule(
+        jobs,
+        slots,
+        history_path,
+        args.results_root,
+        lambda stage, takes_hosts, subject, slot: run_stage(
+            stage, takes_hosts, subject, slot, args.log_dir
+        ),
+    )
+    if failed:
+        print(
+            "Failed subjects: " + ", ".join(f"{s.pid}-{s.bid}" for s in failed),
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -5,13 +5,13 @@ from sklearn.impute import SimpleImputer
 from sklearn.linear_model import Ridge
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from scipy import sparse
-import pandas as pd
 import sklearn_pandas
 import numpy as np
 import matplotlib.pyplot as plt
 import argparse
 import pprint
-from count_features import get_expanded_counts
+from count_features import EXPANDED_FEATURES, get_expanded_counts
+from stratified_sample import load_sample
 from getFeaturesNamesAndCount import getFeatureNamesAndCount
 from linear_model_feature_importance import get_interval_from_dataframe
 
@@ -94,7 +94,7 @@ def cod_per_feature(transformed_df, original_df, ind_feature, dep_feature):
     
 def main():
     print("\nReading csv...")
-    custmut_csv = pd.read_csv("data/all-customized-mutants.csv").sample(frac=0.20, random_state=42)
+    custmut_csv = load_sample(cover=EXPANDED_FEATURES)
     print("Done!")
     print("Creating mapper...")
     mapper = sklearn_pandas.DataFrameMapper(
@@ -1,4 +1,3 @@
-import pandas as pd
 import numpy as np
 import warnings
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -10,6 +9,8 @@ from sklearn.linear_model import Ridge
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 import sklearn_pandas
 
+from stratified_sample import load_sample
+
 
 EXPANDED_FEATURES = [
              "nodeTypeBasic",
@@ -89,7 +90,7 @@ def get_expanded_counts(dataframe,debug=False):
     return columnNameToCount
 
 def main():
-    custmut_csv = pd.read_csv("data/all-customized-mutants.csv").sample(frac=0.20, random_state=42)
+    custmut_csv = load_sample(cover=EXPANDED_FEATURES)
     
     # There are a total of 13451 columns
     mapper = sklearn_pandas.DataFrameMapper(
@@ -16,7 +16,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import argparse
 import re
-from count_features import get_expanded_counts
+from count_features import EXPANDED_FEATURES, get_expanded_counts
+from stratified_sample import load_sample
 
 # Parser
 parser = argparse.ArgumentParser(
@@ -115,7 +116,7 @@ def main():
     print("Done!")
     
     print("Reading csv...")
-    custmut_csv = pd.read_csv("data/all-customized-mutants.csv").sample(frac=0.20, random_state=42)
+    custmut_csv = load_sample(cover=EXPANDED_FEATURES)
     columnNameToCount = get_expanded_counts(custmut_csv)
     print("Done!")
     
@@ -11,7 +11,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import argparse
 import pprint
-from count_features import get_expanded_counts
+from count_features import EXPANDED_FEATURES, get_expanded_counts
+from stratified_sample import load_sample
 from getFeaturesNamesAndCount import getFeatureNamesAndCount
 
 # Parser
@@ -216,7 +217,7 @@ def hold_out_feature_train(model, custmut_csv, X_all, Y_all, X_test, y_test, bas
 
 def main():
     print("\nReading csv...")
-    custmut_csv = pd.read_csv("data/all-customized-mutants.csv").sample(frac=0.20, random_state=42)
+    custmut_csv = load_sample(cover=EXPANDED_FEATURES)
     print("Done!")
 
     print("Creating mapper...")
@@ -0,0 +1,210 @@
+"""A reproducible, stratified sample of a customized-mutants csv file.
+
+The analysis scripts in this directory work on a 20% sample of
+data/all-customized-mutants.csv. `load_sample` draws that sample while
+streaming the file once, in chunks, and keeps only candidate rows in memory:
+
+* Every row gets a uniform random key from a generator seeded with `seed`
+  (drawn in file order, so the keys do not depend on the chunk size).
+* Within each stratum (by default, each class of each project), the sample
+  holds the ceil(frac * n) rows with the smallest keys, where n is the
+  stratum's size, so every stratum is represented in proportion and none
+  disappears.
+* For the columns in `cover`, the row with the smallest key among those with
+  a given value is added if the value is not otherwise in the sample, so
+  every value (e.g., every mutation operator) occurs at least once.
+
+While streaming, only rows whose key is below a margin above `frac` (and the
+smallest-key row of each stratum and covered value) are kept. That is almost
+always enough to select the sample; for the rare (small) strata where it is
+not, the file is read a second time for those strata only. The sample keeps
+the file's row order and index.
+
+Samples are cached (as joblib files, in a sample_cache directory next to the
+csv file by default), keyed by the file's path, size, and modification time
+and by the sampling parameters.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+import tempfile
+from typing import Iterator, Optional, Sequence, Tuple, Union
+
+import joblib
+import numpy as np
+import pandas as pd
+
+# Bump when the sampling changes, to invalidate cached samples.
+SAMPLE_VERSION = 1
+
+DEFAULT_CSV = "data/all-customized-mutants.csv"
+DEFAULT_STRATA = ("projectId", "className")
+
+# Rows with keys below frac * _MARGIN (plus _MIN_MARGIN) are candidates.
+_MARGIN = 1.5
+_MIN_MARGIN = 0.01
+
+_CHUNK_SIZE = 200_000
+
+
+def _cache_key(csv_path: pathlib.Path, params: dict) -> str:
+    stat = csv_path.stat()
+    h = hashlib.sha256()
+    h.update(
+        json.dumps(
+            {
+                "version": SAMPLE_VERSION,
+                "path": str(csv_path.resolve()),
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                **params,
+            },
+            sort_keys=True,
+        ).encode("utf8")
+    )
+    return h.hexdigest()
+
+
+def _new_minima(
+    best: Optional[pd.Series], keys: pd.Series, by
+) -> Tuple[pd.Series, np.ndarray]:
+    """Merges a chunk's smallest key per group into `best` (group -> key).
+
+    Returns:
+        The updated `best`, and the labels of the chunk rows that hold a new
+        smallest key of their group.
+    """
+    rows = keys.groupby(by, sort=False).idxmin()
+    minima = pd.Series(keys[rows.values].values, index=rows.index)
+    if best is not None:
+        previous = best.reindex(minima.index)
+        improved = (previous.isna() | (minima < previous)).values
+        rows, minima = rows[improved], minima[improved]
+        minima = pd.concat([best, minima])
+        minima = minima[~minima.index.duplicated(keep="last")]
+    return minima, rows.values
+
+
+def _stream(
+    csv_path: pathlib.Path, seed: int, chunk_size: int
+) -> Iterator[Tuple[pd.DataFrame, pd.Series]]:
+    """Yields the chunks of a csv file with their row keys."""
+    rng = np.random.default_rng(seed)
+    offset = 0
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        chunk.index = pd.RangeIndex(offset, offset + len(chunk))
+        offset += len(chunk)
+        yield chunk, pd.Series(rng.random(len(chunk)), index=chunk.index)
+
+
+def _sample_stream(
+    csv_path: pathlib.Path,
+    frac: float,
+    seed: int,
+    strata: Sequence[str],
+    cover: Sequence[str],
+    chunk_size: int,
+) -> pd.DataFrame:
+    threshold = min(1.0, frac * _MARGIN + _MIN_MARGIN)
+    strata = list(strata)
+    candidates = []
+    sizes = []
+    stratum_best = None
+    cover_best = {col: None for col in cover}
+
+    for chunk, keys in _stream(csv_path, seed, chunk_size):
+        sizes.append(chunk.groupby(strata, sort=False).size())
+        keep = (keys < threshold).values
+        stratum_best, new_rows = _new_minima(
+            stratum_best, keys, [chunk[c] for c in strata]
+        )
+        keep[new_rows - chunk.index[0]] = True
+        for col in cover:
+            cover_best[col], new_rows = _new_minima(cover_best[col], keys, chunk[col])
+            keep[new_rows - chunk.index[0]] = True
+        candidates.append(chunk[keep].assign(_key=keys[keep]))
+
+    if not candidates:
+        return pd.read_csv(csv_path, nrows=0)
+    df = pd.concat(candidates)
+    del candidates
+    sizes = pd.concat(sizes).groupby(level=list(range(len(strata)))).sum()
+    df = df.join(sizes.rename("_n"), on=strata)
+
+    # A stratum whose ceil(frac * n)-th smallest key is above the threshold
+    # (which is likely only for small strata) needs all its rows.
+    below = df[df._key < threshold].groupby(strata).size()
+    short = np.ceil(frac * sizes) > below.reindex(sizes.index, fill_value=0)
+    if short.any():
+        short_strata = sizes.index[short.values]
+        extra = []
+        for chunk, keys in _stream(csv_path, seed, chunk_size):
+            in_short = chunk.set_index(strata).index.isin(short_strata)
+            rows = in_short & (keys >= threshold).values
+            extra.append(chunk[rows].assign(_key=keys[rows]))
+        df = pd.concat([df, pd.concat(extra).join(sizes.rename("_n"), on=strata)])
+        df = df[~df.index.duplicated()]
+
+    # The ceil(frac * n) smallest keys of each stratum.
+    df = df.sort_values("_key", kind="stable")
+    rank = df.groupby(strata, sort=False).cumcount().values
+    selected = rank < np.ceil(frac * df._n.values)
+    # The smallest key of every value of a covered column that is missing.
+    for col in cover:
+        missing = ~df[col].isin(set(df[col][selected].dropna()))
+        selected |= (missing & df[col].notna() & ~df.duplicated(col)).values
+    return df[selected].drop(columns=["_key", "_n"]).sort_index()
+
+
+def load_sample(
+    csv_path: Union[str, pathlib.Path] = DEFAULT_CSV,
+    frac: float = 0.20,
+    seed: int = 42,
+    strata: Sequence[str] = DEFAULT_STRATA,
+    cover: Sequence[str] = (),
+    cache_dir: Union[str, pathlib.Path, None] = None,
+    use_cache: bool = True,
+    chunk_size: int = _CHUNK_SIZE,
+) -> pd.DataFrame:
+    """Returns a stratified sample of about `frac` of the rows of `csv_path`.
+
+    Args:
+        csv_path: A customized-mutants csv file.
+        frac: The fraction of each stratum to sample.
+        seed: The seed of the row keys; the same seed gives the same sample.
+        strata: The columns whose value combinations form the strata.
+        cover: Columns each of whose values should occur in the sample.
+        cache_dir: Where to cache samples (default: <csv dir>/sample_cache).
+        use_cache: Whether to read and write the cache.
+        chunk_size: The number of rows to parse at a time.
+    """
+    if not 0 < frac <= 1:
+        raise ValueError(f"frac must be in (0, 1], got {frac}")
+    csv_path = pathlib.Path(csv_path)
+    if not use_cache:
+        return _sample_stream(csv_path, frac, seed, strata, cover, chunk_size)
+
+    params = {
+        "frac": frac,
+        "seed": seed,
+        "strata": list(strata),
+        "cover": list(cover),
+    }
+    cache_dir = pathlib.Path(cache_dir or csv_path.parent / "sample_cache")
+    cache_path = cache_dir / f"{_cache_key(csv_path, params)}.joblib"
+    if cache_path.exists():
+        return joblib.load(cache_path)
+
+    df = _sample_stream(csv_path, frac, seed, strata, cover, chunk_size)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fo:
+            joblib.dump(df, fo)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return df